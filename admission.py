@@ -0,0 +1,124 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+
+class Overloaded(Exception):
+    """Admitting the request would exceed the latency budget"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Over the latency budget, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Admits recordings only while the server can get through them within a latency budget.
+
+    Admitted requests are accounted for in seconds of audio until they finish.
+    The cost of a second of audio is the CPU time the process spent per second
+    of audio finished, sampled every sample_seconds and smoothed, so it covers
+    decoding, bcrypt and inference alike (it starts at initial_cost). The
+    queue wait is the admitted backlog times that cost, spread over cpus. A
+    request whose own audio would push it past budget_seconds is rejected with
+    a retry hint of how long the backlog needs to drain; with nothing in flight
+    everything is admitted.
+
+    The audio length is estimated from the encoded size before anything is
+    decoded, using the observed seconds per encoded byte, and assumed to be
+    max_audio_seconds until a decode has been observed. cpu_time has to see the
+    work, which time.process_time does not for a process pool executor.
+    """
+
+    def __init__(
+        self,
+        budget_seconds: float,
+        max_audio_seconds: float,
+        cpus: int = 1,
+        initial_cost: float = 0.2,
+        smoothing: float = 0.3,
+        sample_seconds: float = 1.0,
+        cpu_time: Callable[[], float] = time.process_time,
+    ):
+        self.budget_seconds = budget_seconds
+        self.max_audio_seconds = max_audio_seconds
+        self.cpus = max(1, cpus)
+        self.cost_per_audio_second = initial_cost
+        self.smoothing = smoothing
+        self.sample_seconds = sample_seconds
+        self.cpu_time = cpu_time
+        self.seconds_per_byte: Optional[float] = None
+        self.in_flight_audio_seconds = 0.0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._sampled_at = time.perf_counter()
+        self._sampled_cpu = cpu_time()
+        self._finished_audio_seconds = 0.0
+
+    def estimate_audio_seconds(self, encoded_bytes: int) -> float:
+        if self.seconds_per_byte is None:
+            return self.max_audio_seconds
+        return min(self.max_audio_seconds, encoded_bytes * self.seconds_per_byte)
+
+    def estimated_wait(self) -> float:
+        """Seconds until the admitted backlog has been worked through"""
+        return self.in_flight_audio_seconds * self.cost_per_audio_second / self.cpus
+
+    @contextmanager
+    def admit(self, *encoded_sizes: int) -> Iterator[None]:
+        """Hold a slot for recordings of the given encoded sizes while the block runs, or raise Overloaded"""
+        audio_seconds = sum(self.estimate_audio_seconds(size) for size in encoded_sizes)
+        with self._lock:
+            wait = self.estimated_wait()
+            own = audio_seconds * self.cost_per_audio_second / self.cpus
+            if self.in_flight and wait + own > self.budget_seconds:
+                self.rejected += 1
+                raise Overloaded(max(1, math.ceil(wait)))
+            if not self.in_flight and not self._finished_audio_seconds:
+                # CPU spent while idle belongs to no request
+                self._sampled_at, self._sampled_cpu = time.perf_counter(), self.cpu_time()
+            self.in_flight += 1
+            self.in_flight_audio_seconds += audio_seconds
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.in_flight_audio_seconds = max(0.0, self.in_flight_audio_seconds - audio_seconds)
+                self._finished_audio_seconds += audio_seconds
+                self._sample()
+
+    def _sample(self) -> None:
+        now = time.perf_counter()
+        if now - self._sampled_at < self.sample_seconds or self._finished_audio_seconds <= 0:
+            return
+        cpu = self.cpu_time()
+        cost = (cpu - self._sampled_cpu) / self._finished_audio_seconds
+        self.cost_per_audio_second += self.smoothing * (cost - self.cost_per_audio_second)
+        self._sampled_at, self._sampled_cpu = now, cpu
+        self._finished_audio_seconds = 0.0
+
+    def observe_decode(self, encoded_bytes: int, audio_seconds: float) -> None:
+        if encoded_bytes <= 0:
+            return
+        with self._lock:
+            ratio = audio_seconds / encoded_bytes
+            if self.seconds_per_byte is None:
+                self.seconds_per_byte = ratio
+            else:
+                self.seconds_per_byte += self.smoothing * (ratio - self.seconds_per_byte)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "in_flight_audio_seconds": self.in_flight_audio_seconds,
+                "estimated_wait_seconds": self.estimated_wait(),
+                "cost_per_audio_second": self.cost_per_audio_second,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,292 @@
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+PQ_CENTROIDS = 256  # one uint8 code per subvector
+# vectors are normalized and encoded this many rows at a time, so float16 input is never widened all at once
+ADD_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, np.shape(vectors)[-1])
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+    """Index of the nearest (L2) centroid for every row, computed in row blocks"""
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start : start + block_rows]
+        labels[start : start + block_rows] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means, empty clusters are re-seeded from random points"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=len(vectors) < k)].copy()
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=k)
+        # sum each cluster as one contiguous run of the label-sorted vectors
+        order = np.argsort(labels, kind="stable")
+        present = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[present]
+        centroids[present] = np.add.reduceat(vectors[order], starts) / counts[present, None]
+        empty = counts == 0
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+class IVFPQIndex:
+    """Approximate nearest-neighbour index over L2-normalized embeddings.
+
+    A coarse k-means quantizer splits the vectors into nlist inverted lists and
+    each vector is stored as the product-quantized residual from its list
+    centroid: m one-byte codes instead of dim floats. A query only scans the
+    nprobe lists closest to it and scores codes with a per-query lookup table,
+    so scores are approximate inner products; rerank the candidates exactly.
+
+    Until train() is called (or when built from too few vectors to train),
+    vectors are kept as they are and searched exhaustively.
+    """
+
+    def __init__(self, dim: Optional[int] = None, nprobe: int = 16):
+        self.dim = dim  # taken from the first vectors added when not given
+        self.nprobe = nprobe
+
+        self.usernames: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+        self.coarse: Optional[np.ndarray] = None  # (nlist, dim)
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, dim // m)
+        self.trained_size = 0
+        self._list_codes: List[np.ndarray] = []
+        self._list_ids: List[np.ndarray] = []
+        self._list_sizes: List[int] = []
+
+        self._flat = np.empty((0, dim or 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._ids
+
+    @property
+    def trained(self) -> bool:
+        return self.coarse is not None
+
+    @property
+    def nbytes(self) -> int:
+        if not self.trained:
+            return self._flat.nbytes
+        lists = sum(codes.nbytes + ids.nbytes for codes, ids in zip(self._list_codes, self._list_ids))
+        return lists + self.coarse.nbytes + self.codebooks.nbytes
+
+    @classmethod
+    def build(cls, usernames: Sequence[str], vectors: np.ndarray, nprobe: int = 16, **train_args) -> 'IVFPQIndex':
+        """Train a fresh index on vectors and add them all"""
+        index = cls(vectors.shape[-1], nprobe=nprobe)
+        index.train(vectors, **train_args)
+        index.add(usernames, vectors)
+        return index
+
+    def _set_dim(self, dim: int) -> None:
+        if self.dim is None:
+            self.dim = dim
+            self._flat = np.empty((0, dim), dtype=np.float32)
+        elif self.dim != dim:
+            raise ValueError(f"Expected {self.dim} dimensional vectors, got {dim}")
+
+    def needs_training(self, min_size: int = 1024) -> bool:
+        """True once there is enough data to train, and again whenever the index doubles since its last training"""
+        return len(self) >= min_size and (not self.trained or len(self) >= 2 * self.trained_size)
+
+    def train(self, vectors: np.ndarray, nlist: Optional[int] = None, m: int = 50, max_train: int = 50_000, seed: int = 0) -> None:
+        """Fit the coarse quantizer and PQ codebooks, then re-encode everything already added.
+
+        nlist defaults to about sqrt(len(vectors)) and training uses at most
+        max_train of them; m must divide dim.
+        """
+        self._set_dim(vectors.shape[-1])
+        if self.dim % m:
+            raise ValueError(f"m={m} does not divide dim={self.dim}")
+        total = len(vectors)
+        nlist = nlist or max(1, min(4096, int(math.sqrt(total))))
+        if total > max_train:
+            vectors = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), max_train, replace=False))]
+        vectors = _normalize(vectors)
+
+        coarse = kmeans(vectors, nlist, seed=seed)
+        residuals = (vectors - coarse[_assign(vectors, coarse)]).reshape(len(vectors), m, -1)
+        codebooks = np.stack([kmeans(residuals[:, i], PQ_CENTROIDS, seed=seed + i) for i in range(m)])
+
+        flat = self._stored_vectors()
+        self.coarse, self.codebooks = coarse, codebooks
+        self.trained_size = max(len(self), total)
+        self._list_codes = [np.empty((0, m), dtype=np.uint8) for _ in range(nlist)]
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._list_sizes = [0] * nlist
+        self._flat = np.empty((0, self.dim), dtype=np.float32)
+        if len(flat):
+            self._publish(self._insert(np.arange(len(flat)), flat))
+
+    def _stored_vectors(self) -> np.ndarray:
+        """Vectors currently in the index, reconstructed from their codes once trained"""
+        if not self.trained:
+            return self._flat[: len(self)]
+        vectors = np.zeros((len(self), self.dim), dtype=np.float32)
+        m = self.codebooks.shape[0]
+        for list_no, (codes, ids) in enumerate(zip(self._list_codes, self._list_ids)):
+            size = self._list_sizes[list_no]
+            residual = self.codebooks[np.arange(m), codes[:size]].reshape(size, -1)
+            vectors[ids[:size]] = self.coarse[list_no] + residual
+        return vectors
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lists = _assign(vectors, self.coarse)
+        m, _, dsub = self.codebooks.shape
+        residuals = (vectors - self.coarse[lists]).reshape(len(vectors), m, dsub)
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for i in range(m):
+            codes[:, i] = _assign(residuals[:, i], self.codebooks[i])
+        return lists, codes
+
+    def _insert(self, ids: np.ndarray, vectors: np.ndarray) -> Dict[int, int]:
+        """Write vectors into storage past what searches read; returns the list sizes that make them visible"""
+        if not self.trained:
+            if ids.max(initial=-1) >= len(self._flat):
+                grown = np.empty((max(ids.max() + 1, 2 * len(self._flat), 64), self.dim), dtype=np.float32)
+                grown[: len(self._flat)] = self._flat
+                self._flat = grown
+            self._flat[ids] = vectors
+            return {}
+
+        lists, codes = self._encode(vectors)
+        sizes = {}
+        for list_no in np.unique(lists):
+            selected = lists == list_no
+            size, count = self._list_sizes[list_no], int(selected.sum())
+            if size + count > len(self._list_ids[list_no]):
+                capacity = max(size + count, 2 * len(self._list_ids[list_no]), 16)
+                for storage, shape in ((self._list_codes, (capacity, codes.shape[1])), (self._list_ids, (capacity,))):
+                    grown = np.empty(shape, dtype=storage[list_no].dtype)
+                    grown[:size] = storage[list_no][:size]
+                    storage[list_no] = grown
+            self._list_codes[list_no][size : size + count] = codes[selected]
+            self._list_ids[list_no][size : size + count] = ids[selected]
+            sizes[int(list_no)] = size + count
+        return sizes
+
+    def _publish(self, sizes: Dict[int, int]) -> None:
+        for list_no, size in sizes.items():
+            self._list_sizes[list_no] = size
+
+    def add(self, usernames: Sequence[str], vectors: np.ndarray) -> None:
+        """Append (len(usernames), dim) vectors for new usernames; usernames already in the index are skipped"""
+        self._set_dim(vectors.shape[-1])
+        fresh = np.array([i for i, username in enumerate(usernames) if username not in self._ids], dtype=np.int64)
+        for start in range(0, len(fresh), ADD_BLOCK_ROWS):
+            block = fresh[start : start + ADD_BLOCK_ROWS]
+            ids = np.arange(len(self), len(self) + len(block))
+            sizes = self._insert(ids, _normalize(vectors[block]))
+            # a search on another thread only reads up to the published list sizes (or len(self) before
+            # training), so usernames go in first and the sizes after, and every id it sees has a username
+            for i in block:
+                self._ids[usernames[i]] = len(self.usernames)
+                self.usernames.append(usernames[i])
+            self._publish(sizes)
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Top-k (username, approximate inner product) pairs, best first"""
+        query = _normalize(query)[0]
+        if len(self) == 0 or k <= 0:
+            return []
+
+        if not self.trained:
+            # read once, an add on another thread may grow it in between
+            size = len(self)
+            ids = np.arange(size)
+            scores = self._flat[:size] @ query
+        else:
+            m, _, dsub = self.codebooks.shape
+            # inner product with (centroid + residual) splits into a per-list term and a table lookup per code
+            table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, dsub))
+            coarse_scores = self.coarse @ query
+            probes = np.argsort(-coarse_scores)[: nprobe or self.nprobe]
+            sizes = [self._list_sizes[list_no] for list_no in probes]
+            if not sum(sizes):
+                return []
+            codes = np.concatenate([self._list_codes[list_no][:size] for list_no, size in zip(probes, sizes)])
+            ids = np.concatenate([self._list_ids[list_no][:size] for list_no, size in zip(probes, sizes)])
+            scores = np.repeat(coarse_scores[probes], sizes) + table[np.arange(m), codes].sum(axis=1)
+
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.usernames[ids[i]], float(scores[i])) for i in top]
+
+    def save(self, path: Path) -> None:
+        """Write the index to a single .npz file, atomically replacing any previous one"""
+        if self.trained:
+            # the sizes go first: every id they cover has its username by the time those are read
+            sizes = list(self._list_sizes)
+            usernames = list(self.usernames)
+            codes = [codes[:size] for codes, size in zip(self._list_codes, sizes)]
+            ids = [ids[:size] for ids, size in zip(self._list_ids, sizes)]
+            # an add publishing its lists meanwhile may be only partly covered, so only the ids below
+            # the first missing one are kept; load_voice_index adds the rest back from the matrix
+            present = np.zeros(len(usernames) + 1, dtype=bool)
+            for list_ids in ids:
+                present[list_ids] = True
+            count = int(np.argmin(present))
+            keep = [list_ids < count for list_ids in ids]
+            lists = {
+                "coarse": self.coarse,
+                "codebooks": self.codebooks,
+                "list_sizes": np.array([int(selected.sum()) for selected in keep], dtype=np.int64),
+                "codes": np.concatenate([list_codes[selected] for list_codes, selected in zip(codes, keep)]),
+                "ids": np.concatenate([list_ids[selected] for list_ids, selected in zip(ids, keep)]),
+            }
+        else:
+            count = len(self)
+            lists = {"flat": self._flat[:count]}
+        arrays = {
+            "dim": np.array(self.dim or 0),
+            "nprobe": np.array(self.nprobe),
+            "usernames": np.array(self.usernames[:count], dtype=str),
+            "trained_size": np.array(self.trained_size),
+            **lists,
+        }
+
+        path = Path(path)
+        temp = path.with_name(path.name + ".tmp")
+        with open(temp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'IVFPQIndex':
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(int(data["dim"]) or None, nprobe=int(data["nprobe"]))
+            index.usernames = data["usernames"].tolist()
+            index._ids = {username: i for i, username in enumerate(index.usernames)}
+            index.trained_size = int(data["trained_size"])
+            if "coarse" not in data:
+                index._flat = data["flat"].copy()
+                return index
+
+            index.coarse, index.codebooks = data["coarse"], data["codebooks"]
+            offsets = np.concatenate([[0], np.cumsum(data["list_sizes"])])
+            codes, ids = data["codes"], data["ids"]
+            # files saved during an add could hold ids past their usernames, those are left out
+            known = ids < len(index.usernames)
+            bounds = list(zip(offsets[:-1], offsets[1:]))
+            index._list_codes = [codes[start:end][known[start:end]] for start, end in bounds]
+            index._list_ids = [ids[start:end][known[start:end]] for start, end in bounds]
+            index._list_sizes = [len(list_ids) for list_ids in index._list_ids]
+        return index
@@ -1,193 +1,772 @@
+import asyncio
 import base64
 import binascii
+import functools
 import json
-from dataclasses import dataclass
+import os
+import secrets
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Any
-import typing
+from typing import Dict, Any, List, Optional, Set, Tuple, Union
+from urllib.parse import unquote
 
 import bcrypt
-import numpy as np
-import torch
-from torch.nn import CosineSimilarity
-import torchaudio.transforms as T
-from litestar import Litestar, Request, Response, get, post
+from litestar import Litestar, Request, Response, WebSocket, get, post, websocket
+from litestar.datastructures import UploadFile
 from litestar.di import Provide
+from litestar.enums import RequestEncodingType
 from litestar.static_files import create_static_files_router
-from litestar.status_codes import HTTP_200_OK, HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND
+from litestar.status_codes import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_409_CONFLICT,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
 from litestar.middleware.session.server_side import ServerSideSessionConfig
 from litestar.stores.file import FileStore
+import torch
 from torch import Tensor
-from torchcodec.decoders import AudioDecoder, AudioStreamMetadata
 
+from admission import AdmissionController, Overloaded
+from batching import BatchingEngine
+from bundle import load_bundle
+from cache import BloomFilter, UserCache
+from executor import ExecutionLayer, available_cpus
+from ingest import AudioIngest, StreamingDecoder
+from ann import IVFPQIndex
+from identify import EmbeddingMatrix
+from metrics import AUDIO_SECONDS, LOGIN_AUDIO_FRACTION, REGISTRY, VOICED_SECONDS, timed, timed_request
 from ml import EmbeddingGenerator
+from progressive import ProgressiveVerification
+from quantization import load_quantized_model
+from registry import MODEL_SAMPLE_RATE, ModelKey, ModelRegistry
 from singer_identity.model import IdentityEncoder, load_model
+from streaming import StreamingEmbedding
+from users import User, build_template, iter_users
+from vad import NotEnoughSpeech, VoiceActivityDetector
 
 HTML_DIR = Path("website")
 VOICE_SIMILARITY_THRESHOLD = 0.85
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_MS = 10.0
+# "thread" or "process"; inference always stays on threads in this process
+EXECUTOR_KIND = os.environ.get("VOICEREC_EXECUTOR", "thread")
+EXECUTOR_WORKERS = int(os.environ.get("VOICEREC_EXECUTOR_WORKERS", 0)) or None
+# torch intra-op threads for inference, by default every core this process is pinned to
+INFERENCE_THREADS = int(os.environ.get("VOICEREC_INFERENCE_THREADS", 0)) or None
+STAGE_LIMITS = {"decode": 4, "stream_decode": 4, "bcrypt": 4, "inference": 1, "model_load": 1}
+# "eager", "torchscript" (traced, frozen, optimize_for_inference), "compile" (torch.compile, dynamic shapes),
+# "onnx" (ONNX Runtime, needs voicerec[onnx]) or "fused" (FFT front-end, normalization and BatchNorm folded)
+INFERENCE_BACKEND = os.environ.get("VOICEREC_BACKEND", "eager")
+# ENROLLMENT_MODEL graph written by `voicerec export-onnx` for the onnx backend, exported on load when unset
+ONNX_MODEL_PATH = os.environ.get("VOICEREC_ONNX_MODEL")
+# checkpoint new accounts are enrolled (and identified) with; existing users are always scored with the
+# model named in their record, loaded on first use
+ENROLLMENT_MODEL = os.environ.get("VOICEREC_MODEL", "byol")
+# estimated weights plus backend copies the model registry keeps before evicting the least recently used
+MODEL_REGISTRY_MAX_BYTES = int(os.environ.get("VOICEREC_MODEL_MEMORY_MB", 256)) * 1024 * 1024
+# single-file ENROLLMENT_MODEL written by `voicerec bundle`, loaded memory-mapped instead of fetched
+MODEL_BUNDLE_PATH = os.environ.get("VOICEREC_MODEL_BUNDLE")
+# int8 backbone for ENROLLMENT_MODEL written by `voicerec quantize`, swapped into the float model when set
+QUANTIZED_ENCODER_PATH = os.environ.get("VOICEREC_QUANTIZED_ENCODER")
+# warm-up covers single and batched forwards at the shortest tail, one window and the longest recording
+WARMUP_SECONDS = (1.0, 5.0, 15.0)
+WARMUP_BATCH_SIZES = (1, BATCH_MAX_SIZE)
+# the recorder stops at 15 seconds, anything past that is not decoded
+MAX_AUDIO_SECONDS = 15.0
+# silence and noise are cut out of uploaded recordings before they are embedded, and recordings with less
+# speech than MIN_VOICED_SECONDS are rejected; VOICEREC_VAD=0 embeds recordings as they are
+VOICE_ACTIVITY_DETECTION = os.environ.get("VOICEREC_VAD", "1") != "0"
+MIN_VOICED_SECONDS = float(os.environ.get("VOICEREC_MIN_VOICED_SECONDS", 1.0))
+# logins and enrollments are turned away with 503 + Retry-After, before any audio is decoded, once the
+# backlog they would join is estimated to take longer than this
+ADMISSION_BUDGET_SECONDS = float(os.environ.get("VOICEREC_ADMISSION_BUDGET_SECONDS", 2.0))
+# logins are scored on the first PROGRESSIVE_FIRST_SECONDS, then with each next piece (as long as the audio so far)
+# averaged in, stopping once the score is this far above or below PROGRESSIVE_THRESHOLD; 0 embeds every
+# login recording whole. The averaged score needs its own threshold, calibrated with benchmarks.progressive,
+# so a margin without one refuses to start
+PROGRESSIVE_MARGIN = float(os.environ.get("VOICEREC_PROGRESSIVE_MARGIN", 0.0))
+PROGRESSIVE_FIRST_SECONDS = float(os.environ.get("VOICEREC_PROGRESSIVE_FIRST_SECONDS", 3.0))
+PROGRESSIVE_THRESHOLD = float(os.environ["VOICEREC_PROGRESSIVE_THRESHOLD"]) if "VOICEREC_PROGRESSIVE_THRESHOLD" in os.environ else None
+if PROGRESSIVE_MARGIN > 0 and PROGRESSIVE_THRESHOLD is None:
+    raise ValueError("VOICEREC_PROGRESSIVE_MARGIN needs VOICEREC_PROGRESSIVE_THRESHOLD, see python -m benchmarks.progressive")
+# storage precision of the (pre-normalized) embedding in each user record
+EMBEDDING_DTYPE = "float16"
+USER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+USER_BLOOM_CAPACITY = 100_000
+# streaming login embeds 5 second windows as they fill and averages them
+STREAM_WINDOW_SECONDS = 5.0
+# the mean of window embeddings does not score like one embedding of the whole recording,
+# so streaming logins get their own threshold (benchmarks/progressive.py prints one) and are
+# refused until it is set
+STREAM_THRESHOLD = float(os.environ["VOICEREC_STREAM_THRESHOLD"]) if "VOICEREC_STREAM_THRESHOLD" in os.environ else None
+STREAM_MIN_TAIL_SECONDS = 1.0
+STREAM_MAX_BYTES = 2 * 1024 * 1024
+# hard cap on raw audio uploads, enforced while the body is read
+MAX_UPLOAD_BYTES = 2 * 1024 * 1024
+
+# enrollment may send several recordings; the record keeps their centroid plus each sample
+MAX_ENROLLMENT_SAMPLES = 5
+# bcrypt ignores everything past this, so longer passwords are refused at signup
+MAX_PASSWORD_BYTES = 72
+TEMPLATE_KEEP_SAMPLES = True
+
+# 1:N identification scores every enrolled centroid, kept in memory at this precision
+IDENTIFY_DTYPE = torch.float16
+IDENTIFY_TOP_K = 5
+IDENTIFY_MAX_TOP_K = 50
+
+# signups whose voice is this close to an existing account are rejected; candidates come
+# from the approximate index and are checked exactly against the identification matrix
+DUPLICATE_VOICE_THRESHOLD = 0.95
+DUPLICATE_CANDIDATES = 10
+VOICE_INDEX_PATH = Path("database-index.npz")
+VOICE_INDEX_NPROBE = 16
+VOICE_INDEX_SUBQUANTIZERS = 50
+# below this many users the index stays exact; it is retrained whenever it doubles
+VOICE_INDEX_MIN_TRAIN = 1024
+VOICE_INDEX_CHECK_SECONDS = 300.0
+
+AudioBytes = Union[bytes, bytearray]
+STREAM_TOKEN_TTL_SECONDS = 30
+# prefork workers pick up accounts enrolled by the other workers this often
+USER_SYNC_SECONDS = 5.0
 
 @dataclass
 class CredentialData:
     username: str
     password: str
     audio_data: str # should be base64 encoded audio data as webm
+    audio_samples: List[str] = field(default_factory=list) # extra enrollment recordings, ignored on login
 
 @dataclass
-class User:
-    username: str
-    password: bytes # should be hashed
-    embedding: Tensor
-
-    def to_dict(self) -> Dict[str, Any]:
-        embedding_np = self.embedding.cpu().numpy()
-        return {
-            'username': self.username,
-            'password': base64.b64encode(self.password).decode('utf-8'),
-            'embedding': base64.b64encode(embedding_np.tobytes()).decode('utf-8'),
-            'embedding_shape': list(self.embedding.shape),
-            'embedding_dtype': str(embedding_np.dtype)
-        }
-
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'User':
-        password_bytes = base64.b64decode(data['password'])
-
-        embedding_bytes = base64.b64decode(data['embedding'])
-        embedding_shape = data['embedding_shape']
-        embedding_dtype = data['embedding_dtype']
-
-        embedding_np = np.frombuffer(embedding_bytes, dtype=np.dtype(embedding_dtype)).reshape(embedding_shape)
-        embedding_tensor = torch.from_numpy(embedding_np.copy())
-
-        return cls(
-            username=data['username'],
-            password=password_bytes,
-            embedding=embedding_tensor
-        )
+class IdentifyData:
+    audio_data: str # should be base64 encoded audio data as webm
+    top_k: int = IDENTIFY_TOP_K
+
+@dataclass
+class StreamSessionData:
+    token: str # handed out by /account/login/stream after a successful verification
+
+def hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+def check_password(password: str, hashed: bytes) -> bool:
+    # bcrypt only ever hashed the first MAX_PASSWORD_BYTES, newer releases raise instead of cutting them off
+    return bcrypt.checkpw(password.encode('utf-8')[:MAX_PASSWORD_BYTES], hashed)
 
 embedding_generator: EmbeddingGenerator
-cos_sim: CosineSimilarity
+model_registry: ModelRegistry
+batching_engine: BatchingEngine
+execution: ExecutionLayer
+user_cache: UserCache
+embedding_matrix: EmbeddingMatrix
+voice_index: IVFPQIndex
+voice_index_task: Optional["asyncio.Task[None]"] = None
+user_sync_task: Optional["asyncio.Task[None]"] = None
+admission: AdmissionController
+# filled by the prefork launcher before it forks the workers: weights every worker serves from
+# (shared memory) and the username filter they all write to
+preloaded_weights: Dict[str, IdentityEncoder] = {}
+shared_known_users: Optional[BloomFilter] = None
+model_loaded = False
+model_warm = False
+warm_up_task: Optional["asyncio.Task[None]"] = None
+audio_ingest = AudioIngest(sample_rate=44100, max_seconds=MAX_AUDIO_SECONDS)
+voice_activity = VoiceActivityDetector(sample_rate=44100, min_voiced_seconds=MIN_VOICED_SECONDS) if VOICE_ACTIVITY_DETECTION else None
+progressive_verification = ProgressiveVerification(
+    PROGRESSIVE_THRESHOLD,
+    PROGRESSIVE_MARGIN,
+    first_samples=int(PROGRESSIVE_FIRST_SECONDS * 44100),
+    min_tail_samples=int(STREAM_MIN_TAIL_SECONDS * 44100),
+) if PROGRESSIVE_MARGIN > 0 else None
+# usernames with a signup in flight, claimed before its first await so two concurrent
+# signups for the same name cannot both pass the existence check
+pending_usernames: Set[str] = set()
 
 async def embedding_generator_provider() -> EmbeddingGenerator:
     global embedding_generator
     return embedding_generator
 
-async def cos_sim_provider() -> CosineSimilarity:
-    global cos_sim
-    return cos_sim
+async def model_registry_provider() -> ModelRegistry:
+    global model_registry
+    return model_registry
+
+async def batching_engine_provider() -> BatchingEngine:
+    global batching_engine
+    return batching_engine
+
+async def admission_provider() -> AdmissionController:
+    global admission
+    return admission
+
+async def execution_provider() -> ExecutionLayer:
+    global execution
+    return execution
+
+async def user_cache_provider() -> UserCache:
+    global user_cache
+    return user_cache
+
+async def embedding_matrix_provider() -> EmbeddingMatrix:
+    global embedding_matrix
+    return embedding_matrix
+
+async def voice_index_provider() -> IVFPQIndex:
+    global voice_index
+    return voice_index
+
+def load_voice_index(matrix: EmbeddingMatrix) -> IVFPQIndex:
+    """Load the persisted index and add any users enrolled after it was saved"""
+    index = IVFPQIndex(nprobe=VOICE_INDEX_NPROBE)
+    if VOICE_INDEX_PATH.exists():
+        try:
+            index = IVFPQIndex.load(VOICE_INDEX_PATH)
+        except Exception as e:
+            print("Error loading voice index, rebuilding it:", e)
+    usernames, vectors = matrix.snapshot()
+    missing = [i for i, username in enumerate(usernames) if username not in index]
+    if missing:
+        index.add([usernames[i] for i in missing], vectors[missing].numpy())
+    return index
+
+async def maintain_voice_index() -> None:
+    """Retrain the index off the event loop whenever it has outgrown its quantizers"""
+    global voice_index
+    while True:
+        try:
+            if voice_index.needs_training(VOICE_INDEX_MIN_TRAIN):
+                execution = await execution_provider()
+                matrix = await embedding_matrix_provider()
+                usernames, vectors = matrix.snapshot()
+                build = functools.partial(IVFPQIndex.build, nprobe=VOICE_INDEX_NPROBE, m=VOICE_INDEX_SUBQUANTIZERS)
+                index = await execution.run("identify", build, usernames, vectors.numpy())
+                # catch up on accounts created while training, then swap
+                latest, latest_vectors = matrix.snapshot()
+                index.add(latest[len(usernames):], latest_vectors[len(usernames):].numpy())
+                voice_index = index
+                await execution.run("identify", index.save, VOICE_INDEX_PATH)
+                print("Voice index retrained on", len(index), "users")
+        except Exception as e:
+            print("Error retraining voice index:", e)
+        await asyncio.sleep(VOICE_INDEX_CHECK_SECONDS)
+
+def enrolled_since(modified_after: float) -> List[User]:
+    return [user for user in iter_users(Path("database"), modified_after) if user.model == ENROLLMENT_MODEL]
+
+async def sync_users(synced_at: float) -> None:
+    """Add the accounts other workers wrote to the store to this worker's identification matrix and index"""
+    while True:
+        await asyncio.sleep(USER_SYNC_SECONDS)
+        try:
+            started = time.time()
+            execution = await execution_provider()
+            # the overlap with the previous pass covers records renamed into place while it listed the directory
+            users = await execution.run("identify", enrolled_since, synced_at - USER_SYNC_SECONDS)
+            synced_at = started
+            if users:
+                usernames = [user.username for user in users]
+                centroids = torch.cat([user.embedding[:1] for user in users])
+                (await embedding_matrix_provider()).add_many(usernames, centroids)
+                (await voice_index_provider()).add(usernames, centroids.numpy())
+        except Exception as e:
+            print("Error syncing users:", e)
+
+def find_duplicate_voice(index: IVFPQIndex, matrix: EmbeddingMatrix, embedding: Tensor) -> Optional[str]:
+    """Username of an enrolled voice at least DUPLICATE_VOICE_THRESHOLD similar, if any"""
+    for username, _ in index.search(embedding.reshape(-1).float().numpy(), DUPLICATE_CANDIDATES):
+        similarity = matrix.similarity(username, embedding)
+        if similarity is not None and similarity >= DUPLICATE_VOICE_THRESHOLD:
+            return username
+    return None
+
+def model_key(name: str) -> ModelKey:
+    """Registry key of a checkpoint as this server runs it; audio is always decoded at the model rate"""
+    return ModelKey(name, INFERENCE_BACKEND, MODEL_SAMPLE_RATE)
+
+def load_weights(name: str) -> IdentityEncoder:
+    if name in preloaded_weights:
+        return preloaded_weights[name]
+    if name == ENROLLMENT_MODEL and MODEL_BUNDLE_PATH:
+        model = load_bundle(Path(MODEL_BUNDLE_PATH))
+    else:
+        model = load_model(name)
+    if not isinstance(model, IdentityEncoder):
+        raise ValueError(f"Model {name} is not an IdentityEncoder")
+    if name == ENROLLMENT_MODEL and QUANTIZED_ENCODER_PATH:
+        model = load_quantized_model(model, Path(QUANTIZED_ENCODER_PATH))
+    return model
+
+def build_generator(key: ModelKey, model: IdentityEncoder) -> EmbeddingGenerator:
+    onnx_path = Path(ONNX_MODEL_PATH) if ONNX_MODEL_PATH and key.name == ENROLLMENT_MODEL else None
+    return EmbeddingGenerator(model, backend=key.backend, onnx_path=onnx_path)
 
 async def on_startup() -> None:
     Path("database").mkdir(parents=True, exist_ok=True)
 
-    model = load_model("byol")
-    if (isinstance(model, IdentityEncoder)):
-        global embedding_generator
-        embedding_generator = EmbeddingGenerator(model)
-    else:
-        raise ValueError("Model is not an IdentityEncoder")
+    global user_cache, embedding_matrix
+    user_cache = UserCache(
+        app.stores.get("users"),
+        max_bytes=USER_CACHE_MAX_BYTES,
+        bloom_capacity=USER_BLOOM_CAPACITY,
+        known=shared_known_users,
+    )
+    embedding_matrix = EmbeddingMatrix(dtype=IDENTIFY_DTYPE)
+    # one pass over the store fills both the username filter and the identification matrix; embeddings of
+    # different models are not comparable, so identification only covers the enrollment model's users
+    other_models = 0
+    for user in iter_users(Path("database")):
+        # a shared filter was seeded by the launcher before forking
+        if shared_known_users is None:
+            user_cache.known.add(user.username)
+        if user.model == ENROLLMENT_MODEL:
+            embedding_matrix.add(user.username, user.embedding)
+        else:
+            other_models += 1
+    print("Known users:", len(embedding_matrix) + other_models, f"({other_models} enrolled with other models)")
+
+    global voice_index, voice_index_task, user_sync_task
+    voice_index = load_voice_index(embedding_matrix)
+    voice_index_task = asyncio.create_task(maintain_voice_index())
+    # a shared filter means prefork workers, each of which enrolls into its own matrix and index
+    if shared_known_users is not None:
+        user_sync_task = asyncio.create_task(sync_users(time.time()))
+
+    global execution
+    execution = ExecutionLayer(
+        EXECUTOR_KIND, workers=EXECUTOR_WORKERS, stage_limits=STAGE_LIMITS, inference_threads=INFERENCE_THREADS
+    )
+    execution.start()
+
+    global model_registry, embedding_generator
+    model_registry = ModelRegistry(
+        MODEL_REGISTRY_MAX_BYTES,
+        load_weights=load_weights,
+        build_generator=build_generator,
+        pinned=[model_key(ENROLLMENT_MODEL)],
+    )
+    embedding_generator = model_registry.get(model_key(ENROLLMENT_MODEL))
+
+    global admission, batching_engine, model_loaded
+    admission = AdmissionController(ADMISSION_BUDGET_SECONDS, MAX_AUDIO_SECONDS, cpus=available_cpus())
+    batching_engine = BatchingEngine(
+        embedding_generator,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        execution=execution,
+        registry=model_registry,
+    )
+    batching_engine.start()
+    model_loaded = True
+    register_gauges()
+
+    global warm_up_task
+    # requests are served while this runs, /ready only reports ready once it is done
+    warm_up_task = asyncio.create_task(warm_up())
+
+async def warm_up() -> None:
+    global model_warm
+    started = time.perf_counter()
+    try:
+        await execution.run("inference", embedding_generator.warm_up, WARMUP_SECONDS, WARMUP_BATCH_SIZES)
+    except Exception as e:
+        print("Error warming up the model:", e)
+        return
+    model_warm = True
+    print(f"Model warmed up ({INFERENCE_BACKEND}) in {time.perf_counter() - started:.1f}s")
+
+def register_gauges() -> None:
+    REGISTRY.gauge("voicerec_model_loaded", "1 once the model is loaded and the batching engine runs", lambda: float(model_loaded))
+    REGISTRY.gauge("voicerec_model_warm", "1 once the startup warm-up has finished", lambda: float(model_warm))
+    REGISTRY.gauge("voicerec_model_registry_bytes", "Estimated memory of the loaded models", lambda: model_registry.nbytes)
+    REGISTRY.gauge(
+        "voicerec_admission_estimated_wait_seconds", "Estimated time to work through the admitted requests",
+        admission.estimated_wait,
+    )
+    REGISTRY.counter("voicerec_admission_rejected_total", "Requests turned away over the latency budget", lambda: admission.rejected)
+    REGISTRY.gauge("voicerec_batch_queue_depth", "Waveforms waiting for a batch", lambda: batching_engine.queue_depth)
+    REGISTRY.gauge("voicerec_stage_in_flight", "Calls queued or running per executor stage", lambda: dict(execution.in_flight), "stage")
+    REGISTRY.gauge("voicerec_enrolled_users", "Users in the identification matrix", lambda: len(embedding_matrix))
+    REGISTRY.gauge("voicerec_user_cache_bytes", "Approximate size of the decoded user cache", lambda: user_cache.size_bytes)
+
+async def on_shutdown() -> None:
+    global model_loaded, model_warm
+    model_loaded = model_warm = False
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if voice_index_task is not None:
+        voice_index_task.cancel()
+    if user_sync_task is not None:
+        user_sync_task.cancel()
+    voice_index.save(VOICE_INDEX_PATH)
+    await batching_engine.stop()
+    execution.shutdown()
+
+def decode_base64(audio_data: str) -> Optional[bytes]:
+    try:
+        with timed("base64"):
+            return base64.b64decode(audio_data)
+    except binascii.Error as e:
+        print("Error decoding base64 audio data:", e)
+        return None
 
-    global cos_sim
-    cos_sim = CosineSimilarity(dim=1)
+async def load_wav(audio_bytes: AudioBytes) -> Optional[Tensor]:
+    """Decoded recording with non-speech cut out, None if it cannot be decoded; raises NotEnoughSpeech"""
+    execution = await execution_provider()
+    try:
+        wav = await execution.run("decode", audio_ingest, audio_bytes)
+    except Exception as e:
+        print("Error loading audio data:", e)
+        return None
+    seconds = wav.shape[-1] / 44100
+    AUDIO_SECONDS.observe(seconds)
+    # truncated recordings say nothing about how long the rest of the upload was
+    if seconds < MAX_AUDIO_SECONDS:
+        (await admission_provider()).observe_decode(len(audio_bytes), seconds)
+    if voice_activity is not None:
+        wav = await execution.run("decode", voice_activity, wav)
+        VOICED_SECONDS.observe(wav.shape[-1] / 44100)
+    return wav
 
 @get("/hello")
 async def hello() -> str:
     return "Hello, World!"
 
-@post("/account/create", status_code=HTTP_201_CREATED)
-async def account_create(request: Request, data: CredentialData) -> Response[str]:
-    file_store = app.stores.get("users")
-    if await file_store.exists(data.username):
-        # user already exists
-        return Response("User already exists", status_code=HTTP_400_BAD_REQUEST)
-
-    embedding_generator = await embedding_generator_provider()
+@get("/metrics")
+async def metrics() -> Response[str]:
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@get("/ready")
+async def ready() -> Response[Dict[str, bool]]:
+    if not (model_loaded and model_warm):
+        return Response({"ready": False}, status_code=HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({"ready": True}, status_code=HTTP_200_OK)
+
+@get("/stats")
+async def stats() -> Dict[str, Any]:
+    return {
+        "batching": (await batching_engine_provider()).stats(),
+        "user_cache": (await user_cache_provider()).stats(),
+        "models": (await model_registry_provider()).stats(),
+        "admission": (await admission_provider()).stats(),
+    }
+
+def overloaded_response(e: Overloaded) -> Response[str]:
+    return Response(
+        "Server busy, try again shortly",
+        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
+def sample_count_error(count: int) -> Optional[Response[str]]:
+    if 1 <= count <= MAX_ENROLLMENT_SAMPLES:
+        return None
+    return Response(f"Send between 1 and {MAX_ENROLLMENT_SAMPLES} recordings", status_code=HTTP_400_BAD_REQUEST)
+
+def password_error(password: str) -> Optional[Response[str]]:
+    if len(password.encode('utf-8')) <= MAX_PASSWORD_BYTES:
+        return None
+    return Response(f"Passwords can be at most {MAX_PASSWORD_BYTES} bytes long", status_code=HTTP_400_BAD_REQUEST)
+
+@timed_request("create")
+async def create_account(request: Request, username: str, password: str, audio_samples: List[Optional[AudioBytes]]) -> Response[str]:
+    # before any admission or decoding work is spent on an oversized list
+    error = sample_count_error(len(audio_samples)) or password_error(password)
+    if error is not None:
+        return error
+    if username in pending_usernames:
+        return Response("User already exists", status_code=HTTP_409_CONFLICT)
+    pending_usernames.add(username)
     try:
-        webm_bytes = base64.b64decode(data.audio_data)
-    except binascii.Error as e:
-        print("Error decoding base64 audio data:", e)
-        return Response("Invalid audio data", status_code=HTTP_400_BAD_REQUEST)
+        admission = await admission_provider()
+        with admission.admit(*[len(audio_bytes or b"") for audio_bytes in audio_samples]):
+            return await enroll(request, username, password, audio_samples)
+    except Overloaded as e:
+        return overloaded_response(e)
+    finally:
+        pending_usernames.discard(username)
+
+async def enroll(request: Request, username: str, password: str, audio_samples: List[Optional[AudioBytes]]) -> Response[str]:
+    user_cache = await user_cache_provider()
+    if await user_cache.exists(username):
+        # user already exists
+        return Response("User already exists", status_code=HTTP_400_BAD_REQUEST)
 
     try:
-        audio_decoder = AudioDecoder(source=webm_bytes)
-        samples = audio_decoder.get_all_samples()
-        wav = torch.cat([w.data for w in samples if isinstance(w, Tensor)])
-        sample_rate = typing.cast(AudioStreamMetadata, audio_decoder.metadata).sample_rate or 0
-    except Exception as e:
-        print("Error loading audio data:", e)
+        wavs = await asyncio.gather(*[load_wav(audio_bytes) for audio_bytes in audio_samples if audio_bytes is not None])
+    except NotEnoughSpeech as e:
+        return Response(f"Not enough speech in the recording: {e}", status_code=HTTP_400_BAD_REQUEST)
+    if len(wavs) != len(audio_samples) or any(wav is None for wav in wavs):
         return Response("Invalid audio data", status_code=HTTP_400_BAD_REQUEST)
 
-    if sample_rate != 44100:
-        resampler = T.Resample(orig_freq=sample_rate, new_freq=44100)
-        wav = resampler(wav)
+    engine = await batching_engine_provider()
+    execution = await execution_provider()
+    matrix = await embedding_matrix_provider()
+    index = await voice_index_provider()
+    embedding = build_template(await engine.embed_many(wavs), keep_samples=TEMPLATE_KEEP_SAMPLES)
+    if await execution.run("identify", find_duplicate_voice, index, matrix, embedding[0]) is not None:
+        return Response("Voice already enrolled", status_code=HTTP_409_CONFLICT)
 
     user: User = User(
-        username = data.username,
-        password = bcrypt.hashpw(data.password.encode('utf-8'), bcrypt.gensalt()),
-        embedding = embedding_generator.generate_embedding(wav)
+        username = username,
+        password = await execution.run("bcrypt", hash_password, password),
+        embedding = embedding,
+        model = ENROLLMENT_MODEL,
     )
 
-    user_data = user.to_dict()
-    user_json = json.dumps(user_data).encode('utf-8')
-    await file_store.set(user.username, user_json)
+    # another worker writing to the same store may have taken the name during the awaits above
+    if await user_cache.exists(username):
+        return Response("User already exists", status_code=HTTP_409_CONFLICT)
+    await user_cache.set(user, user.to_bytes(EMBEDDING_DTYPE))
+    matrix.add(user.username, user.embedding)
+    # maintain_voice_index may have swapped in a retrained index during the awaits above
+    (await voice_index_provider()).add([user.username], user.embedding[:1].numpy())
 
     if not request.session:
         request.set_session({"username": user.username})
 
     return Response("Account created successfully", status_code=HTTP_201_CREATED)
 
-@post("/account/login")
-async def account_login(request: Request, data: CredentialData) -> Response[str]:
-    file_store = app.stores.get("users")
-
-    if not await file_store.exists(data.username):
-        # user does not exist
-        return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
-
-    user_json = await file_store.get(data.username)
-    if user_json is None:
-        # user data not found
-        return Response("Data not found", status_code=HTTP_404_NOT_FOUND)
+@timed_request("login")
+async def login(request: Request, username: str, password: str, audio_bytes: Optional[AudioBytes]) -> Response[str]:
+    admission = await admission_provider()
+    try:
+        with admission.admit(len(audio_bytes or b"")):
+            return await verify_login(request, username, password, audio_bytes)
+    except Overloaded as e:
+        return overloaded_response(e)
 
+async def verify_login(request: Request, username: str, password: str, audio_bytes: Optional[AudioBytes]) -> Response[str]:
+    user_cache = await user_cache_provider()
     try:
-        user_data = json.loads(user_json.decode('utf-8'))
-        user = User.from_dict(user_data)
+        user = await user_cache.get(username)
     except Exception as e:
         print("Error deserializing user data:", e)
         return Response("Internal server error", status_code=500)
 
-    if not bcrypt.checkpw(data.password.encode('utf-8'), user.password):
+    if user is None:
+        # user does not exist
         return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
 
-    embedding_generator = await embedding_generator_provider()
+    execution = await execution_provider()
+    if not await execution.run("bcrypt", check_password, password, user.password):
+        return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
 
     try:
-        webm_bytes = base64.b64decode(data.audio_data)
-    except binascii.Error as e:
-        print("Error decoding base64 audio data:", e)
+        wav = await load_wav(audio_bytes) if audio_bytes is not None else None
+    except NotEnoughSpeech as e:
+        return Response(f"Not enough speech in the recording: {e}", status_code=HTTP_400_BAD_REQUEST)
+    if wav is None:
         return Response("Invalid audio data", status_code=HTTP_400_BAD_REQUEST)
 
+    engine = await batching_engine_provider()
+    key = model_key(user.model)
+    if progressive_verification is not None:
+        similarity, fraction = await progressive_verification.verify(wav, lambda piece: engine.embed(piece, key), user.score)
+        LOGIN_AUDIO_FRACTION.observe(fraction)
+        threshold = progressive_verification.threshold
+    else:
+        similarity = user.score(await engine.embed(wav, key))
+        threshold = VOICE_SIMILARITY_THRESHOLD
+    if similarity < threshold:
+        return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
+
+    if not request.session:
+        request.set_session({"username": user.username})
+
+    return Response(json.dumps({"similarity": similarity}), status_code=200)
+
+async def read_upload(request: Request) -> Tuple[str, str, List[Optional[AudioBytes]]]:
+    """Pull (username, password, recordings) out of a multipart or application/octet-stream request.
+
+    Octet-stream bodies are the raw recording with the credentials in the
+    X-Username and X-Password headers (percent-encoded). Multipart bodies carry
+    username and password fields plus one or more audio file parts.
+    """
+    content_type, _ = request.content_type
+    if content_type == RequestEncodingType.MULTI_PART:
+        form = await request.form()
+        audio_samples = [
+            await audio.read() if isinstance(audio, UploadFile) else None for audio in form.getall("audio", [])
+        ]
+        return str(form.get("username", "")), str(form.get("password", "")), audio_samples
+
+    username = unquote(request.headers.get("x-username", ""))
+    password = unquote(request.headers.get("x-password", ""))
+    # one growing buffer, handed to the decoder without another copy
+    audio_buffer = bytearray()
+    async for chunk in request.stream():
+        audio_buffer += chunk
+    return username, password, [audio_buffer]
+
+@post("/account/create", status_code=HTTP_201_CREATED)
+async def account_create(request: Request, data: CredentialData) -> Response[str]:
+    encoded_samples = [data.audio_data, *data.audio_samples]
+    error = sample_count_error(len(encoded_samples)) or password_error(data.password)
+    if error is not None:
+        return error
+    audio_samples = [decode_base64(audio_data) for audio_data in encoded_samples]
+    return await create_account(request, data.username, data.password, audio_samples)
+
+@post("/account/login")
+async def account_login(request: Request, data: CredentialData) -> Response[str]:
+    return await login(request, data.username, data.password, decode_base64(data.audio_data))
+
+@post("/account/create/upload", status_code=HTTP_201_CREATED, request_max_body_size=MAX_UPLOAD_BYTES)
+async def account_create_upload(request: Request) -> Response[str]:
+    username, password, audio_samples = await read_upload(request)
+    if not username or not password:
+        return Response("Missing credentials", status_code=HTTP_400_BAD_REQUEST)
+    return await create_account(request, username, password, audio_samples)
+
+@post("/account/login/upload", request_max_body_size=MAX_UPLOAD_BYTES)
+async def account_login_upload(request: Request) -> Response[str]:
+    username, password, audio_samples = await read_upload(request)
+    if not username or not password:
+        return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
+    return await login(request, username, password, audio_samples[0] if len(audio_samples) == 1 else None)
+
+@timed_request("identify")
+async def identify(audio_bytes: Optional[AudioBytes], top_k: int) -> Response[Dict[str, Any]]:
+    if not 1 <= top_k <= IDENTIFY_MAX_TOP_K:
+        return Response({"error": f"top_k must be between 1 and {IDENTIFY_MAX_TOP_K}"}, status_code=HTTP_400_BAD_REQUEST)
+
     try:
-        audio_decoder = AudioDecoder(source=webm_bytes)
-        samples = audio_decoder.get_all_samples()
-        wav = torch.cat([w.data for w in samples if isinstance(w, Tensor)])
-        sample_rate = typing.cast(AudioStreamMetadata, audio_decoder.metadata).sample_rate or 0
-    except Exception as e:
-        print("Error loading audio data:", e)
-        return Response("Invalid audio data", status_code=HTTP_400_BAD_REQUEST)
+        wav = await load_wav(audio_bytes) if audio_bytes is not None else None
+    except NotEnoughSpeech as e:
+        return Response({"error": f"Not enough speech in the recording: {e}"}, status_code=HTTP_400_BAD_REQUEST)
+    if wav is None:
+        return Response({"error": "Invalid audio data"}, status_code=HTTP_400_BAD_REQUEST)
+
+    engine = await batching_engine_provider()
+    execution = await execution_provider()
+    matrix = await embedding_matrix_provider()
+    matches = await execution.run("identify", matrix.search, await engine.embed(wav), top_k)
+    return Response(
+        {"matches": [{"username": username, "similarity": similarity} for username, similarity in matches]},
+        status_code=HTTP_200_OK,
+    )
 
-    if sample_rate != 44100:
-        resampler = T.Resample(orig_freq=sample_rate, new_freq=44100)
-        wav = resampler(wav)
+@post("/identify", status_code=HTTP_200_OK)
+async def account_identify(data: IdentifyData) -> Response[Dict[str, Any]]:
+    return await identify(decode_base64(data.audio_data), data.top_k)
+
+@post("/identify/upload", status_code=HTTP_200_OK, request_max_body_size=MAX_UPLOAD_BYTES)
+async def account_identify_upload(request: Request, top_k: int = IDENTIFY_TOP_K) -> Response[Dict[str, Any]]:
+    """Same upload formats as login, credentials are ignored; top_k is a query parameter"""
+    _, _, audio_samples = await read_upload(request)
+    return await identify(audio_samples[0] if len(audio_samples) == 1 else None, top_k)
+
+async def issue_stream_token(username: str) -> str:
+    """A one-time token /account/login/stream/session trades for a session, since websocket
+    responses cannot set the session cookie; kept in a file store so any worker can redeem it"""
+    token = secrets.token_urlsafe(32)
+    await app.stores.get("stream_tokens").set(token, username, expires_in=STREAM_TOKEN_TTL_SECONDS)
+    return token
+
+async def stream_login(socket: WebSocket, user: User) -> Optional[Dict[str, Any]]:
+    """Embed the recording as it streams in and score it; the answer to send, None if the client left"""
+    execution = await execution_provider()
+    decoder = StreamingDecoder(sample_rate=44100, max_seconds=MAX_AUDIO_SECONDS)
+    embedding = StreamingEmbedding(
+        await batching_engine_provider(),
+        window_samples=int(STREAM_WINDOW_SECONDS * 44100),
+        min_tail_samples=int(STREAM_MIN_TAIL_SECONDS * 44100),
+        model=model_key(user.model),
+        voice_activity=voice_activity,
+    )
+    await socket.send_json({"status": "ready"})
 
-    similarity = (await cos_sim_provider())(user.embedding, embedding_generator.generate_embedding(wav)).item()
-    if similarity < VOICE_SIMILARITY_THRESHOLD:
+    try:
+        while True:
+            message = await socket.receive()
+            if message["type"] == "websocket.disconnect":
+                embedding.cancel()
+                return None
+            if message.get("bytes"):
+                if len(decoder.buffer) + len(message["bytes"]) > STREAM_MAX_BYTES:
+                    embedding.cancel()
+                    return {"error": "Recording too large"}
+                embedding.add(await execution.run("stream_decode", decoder.feed, message["bytes"]))
+            elif message.get("text") and json.loads(message["text"]).get("end"):
+                break
+        embedding.add(await execution.run("stream_decode", decoder.finish))
+
+        with timed("stream_finish"):
+            mean = await embedding.finish()
+        AUDIO_SECONDS.observe(decoder.emitted / 44100)
+    except NotEnoughSpeech as e:
+        return {"error": f"Not enough speech in the recording: {e}"}
+    except Exception as e:
+        print("Error streaming audio data:", e)
+        embedding.cancel()
+        return {"error": "Invalid audio data"}
+    if voice_activity is not None:
+        VOICED_SECONDS.observe(embedding.voiced_seconds)
+
+    if mean is None:
+        return {"error": "Recording too short"}
+    similarity = user.score(mean)
+    if similarity < STREAM_THRESHOLD:
+        return {"error": "Invalid credentials"}
+    return {"similarity": similarity, "token": await issue_stream_token(user.username)}
+
+@websocket("/account/login/stream")
+async def account_login_stream(socket: WebSocket) -> None:
+    """Verify a login while the user is still speaking.
+
+    The client sends {"username", "password"} as JSON, waits for {"status": "ready"},
+    then sends recorder chunks as binary messages and finally {"end": true}. The
+    server answers with {"similarity", "token"} or {"error"} and closes.
+    """
+    await socket.accept()
+    if STREAM_THRESHOLD is None:
+        await socket.send_json({"error": "Streaming login is not configured"})
+        await socket.close()
+        return
+    try:
+        credentials = await socket.receive_json()
+        username, password = str(credentials["username"]), str(credentials["password"])
+    except Exception:
+        await socket.send_json({"error": "Invalid credentials"})
+        await socket.close()
+        return
+
+    user_cache = await user_cache_provider()
+    execution = await execution_provider()
+    user = await user_cache.get(username)
+    if user is None or not await execution.run("bcrypt", check_password, password, user.password):
+        await socket.send_json({"error": "Invalid credentials"})
+        await socket.close()
+        return
+
+    # the length is not known up front, so a stream holds a slot for the longest recording
+    admission = await admission_provider()
+    try:
+        with admission.admit(STREAM_MAX_BYTES):
+            answer = await stream_login(socket, user)
+    except Overloaded as e:
+        answer = {"error": "Server busy, try again shortly", "retry_after": e.retry_after}
+    if answer is None:
+        return
+    await socket.send_json(answer)
+    await socket.close()
+
+@post("/account/login/stream/session")
+async def account_login_stream_session(request: Request, data: StreamSessionData) -> Response[str]:
+    tokens = app.stores.get("stream_tokens")
+    username = await tokens.get(data.token)
+    if username is None:
         return Response("Invalid credentials", status_code=HTTP_401_UNAUTHORIZED)
+    await tokens.delete(data.token)
 
     if not request.session:
-        request.set_session({"username": user.username})
+        request.set_session({"username": username.decode()})
 
-    return Response(json.dumps({"similarity": similarity}), status_code=200)
+    return Response("Logged in", status_code=HTTP_200_OK)
 
 @post("/account/logout")
 async def account_logout(request: Request) -> Response[str]:
@@ -212,8 +791,17 @@ async def account_info(request: Request) -> Response[AccountInfoResponse]:
 app = Litestar(
     route_handlers=[
         hello,
+        metrics,
+        ready,
+        stats,
         account_create,
         account_login,
+        account_create_upload,
+        account_login_upload,
+        account_identify,
+        account_identify_upload,
+        account_login_stream,
+        account_login_stream_session,
         account_logout,
         create_static_files_router(
             path="/",
@@ -222,7 +810,13 @@ app = Litestar(
         ),
     ],
     middleware=[ServerSideSessionConfig().middleware],
-    stores={"users": FileStore(Path("database"), create_directories=True)},
-    dependencies={"embedding_generator": Provide(embedding_generator_provider), "cos_sim": Provide(cos_sim_provider)},
+    # sessions and stream tokens live on disk, so every prefork worker sees the same ones
+    stores={
+        "users": FileStore(Path("database"), create_directories=True),
+        "sessions": FileStore(Path("database-sessions"), create_directories=True),
+        "stream_tokens": FileStore(Path("database-stream-tokens"), create_directories=True),
+    },
+    dependencies={"embedding_generator": Provide(embedding_generator_provider), "model_registry": Provide(model_registry_provider), "batching_engine": Provide(batching_engine_provider), "execution": Provide(execution_provider), "admission": Provide(admission_provider), "user_cache": Provide(user_cache_provider), "embedding_matrix": Provide(embedding_matrix_provider), "voice_index": Provide(voice_index_provider)},
     on_startup=[on_startup],
+    on_shutdown=[on_shutdown],
 )
@@ -0,0 +1,77 @@
+import itertools
+from pathlib import Path
+from typing import Callable, Optional
+
+import torch
+from torch import Tensor, nn
+
+from fusion import fuse_for_inference
+from singer_identity.model import IdentityEncoder
+from singer_identity.models.network_components import Grey2Rgb
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "fused")
+
+
+def model_device(model: nn.Module) -> torch.device:
+    """Device of the first parameter or buffer; a frozen or quantized model may have no parameters left"""
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        return tensor.device
+    return torch.device("cpu")
+
+
+class BatchEmbedder(nn.Module):
+    """The serving forward pass, (batch, samples) peak-normalized audio to (batch, dim) embeddings,
+    as a single module so it can be traced or compiled.
+
+    Like EmbeddingGenerator.encode_batch, every clip is scaled by its own max
+    (Grey2Rgb per_sample) whatever mode the model's Grey2Rgb is in.
+    """
+
+    def __init__(self, model: IdentityEncoder):
+        super().__init__()
+        self.feature_extractor = model.feature_extractor
+        self.log_scale, _, self.backbone = model.encoder.net
+        self.grey2rgb = Grey2Rgb(per_sample=True)
+
+    def forward(self, wav: Tensor) -> Tensor:
+        return self.backbone(self.grey2rgb(self.log_scale(self.feature_extractor(wav))))
+
+
+def build_backend(
+    model: IdentityEncoder,
+    backend: str = "eager",
+    example_seconds: float = 3.0,
+    sample_rate: int = 44100,
+    onnx_path: Optional[Path] = None,
+) -> Callable[[Tensor], Tensor]:
+    """Wrap model for inference.
+
+    eager: the module as is.
+    torchscript: traced on a (2, example_seconds) batch, frozen so the weights and
+      the mel filterbank become constants, then optimize_for_inference (conv/BN
+      folding, MKLDNN layouts where available). The traced graph is shape generic.
+    compile: torch.compile with dynamic shapes, compiled lazily on the first call,
+      which is why the server warms it up before reporting ready.
+    onnx: ONNX Runtime on the CPU, running the graph at onnx_path (written by
+      `voicerec export-onnx`) or one exported in memory. Needs onnxruntime.
+    fused: fusion.FusedEncoder, an FFT log-mel front-end and the input
+      normalization and BatchNorms folded into the convolutions.
+    """
+    embedder = BatchEmbedder(model).eval()
+    if backend == "eager":
+        return embedder
+    if backend == "torchscript":
+        device = model_device(model)
+        example = torch.randn(2, int(example_seconds * sample_rate), device=device)
+        with torch.no_grad():
+            traced = torch.jit.trace(embedder, example, check_trace=False)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    if backend == "compile":
+        return torch.compile(embedder, dynamic=True)
+    if backend == "fused":
+        return fuse_for_inference(model)
+    if backend == "onnx":
+        from onnx_export import build_onnx_embedder
+
+        return build_onnx_embedder(model, onnx_path)
+    raise ValueError(f"Unknown inference backend: {backend}, expected one of {BACKENDS}")
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from executor import ExecutionLayer
+from ml import EmbeddingGenerator
+from registry import ModelKey, ModelRegistry
+
+
+@dataclass
+class _PendingEmbedding:
+    wav: Tensor
+    future: asyncio.Future
+    generator: EmbeddingGenerator
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class BatchingEngine:
+    """Collects concurrent embedding requests and runs them through the model together.
+
+    A batch is flushed as soon as it holds max_batch_size waveforms or the oldest
+    waveform has waited max_wait_ms. Waveforms are grouped into duration buckets
+    of bucket_seconds so that zero padding inside one forward pass stays small;
+    for generators that cannot mask the padding out, only waveforms of the
+    same length share a batch.
+
+    With a registry, callers can name the model to embed with; it is loaded
+    on the "model_load" stage before the waveform is queued, and a batch only
+    ever mixes waveforms for the same model.
+    """
+
+    def __init__(
+        self,
+        generator: EmbeddingGenerator,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        bucket_seconds: float = 0.5,
+        sample_rate: int = 44100,
+        stats_window: int = 1024,
+        execution: Optional[ExecutionLayer] = None,
+        registry: Optional[ModelRegistry] = None,
+    ):
+        self.generator = generator
+        self.registry = registry
+        self.execution = execution
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bucket_samples = max(1, int(bucket_seconds * sample_rate))
+
+        self._queue: "asyncio.Queue[_PendingEmbedding]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+        self.total_batches = 0
+        self.total_items = 0
+        self._batch_sizes: Deque[int] = deque(maxlen=stats_window)
+        self._wait_times: Deque[float] = deque(maxlen=stats_window)
+        self._forward_times: Deque[float] = deque(maxlen=stats_window)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def generator_for(self, key: Optional[ModelKey] = None) -> EmbeddingGenerator:
+        """The generator for key, the engine's own one when key is None"""
+        if key is None:
+            return self.generator
+        if self.registry is None:
+            raise ValueError("This batching engine has no model registry")
+        generator = self.registry.get_loaded(key)
+        if generator is not None:
+            return generator
+        if self.execution is None:
+            return await asyncio.to_thread(self.registry.get, key)
+        return await self.execution.run("model_load", self.registry.get, key)
+
+    async def embed(self, wav: Tensor, model: Optional[ModelKey] = None) -> Tensor:
+        """Queue a (channels, samples) waveform and wait for its embedding row"""
+        generator = await self.generator_for(model)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingEmbedding(wav, future, generator))
+        return await future
+
+    async def embed_many(self, wavs: List[Tensor], model: Optional[ModelKey] = None) -> Tensor:
+        """Queue several waveforms at once so they land in the same batch, returns one row per waveform"""
+        return torch.cat(await asyncio.gather(*[self.embed(wav, model) for wav in wavs]))
+
+    async def _collect(self) -> List[_PendingEmbedding]:
+        batch = [await self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _bucket(self, batch: List[_PendingEmbedding]) -> List[List[_PendingEmbedding]]:
+        buckets: Dict[Tuple[int, int], List[_PendingEmbedding]] = {}
+        for pending in batch:
+            bucket_samples = self.bucket_samples if pending.generator.supports_masking else 1
+            key = (id(pending.generator), pending.wav.shape[-1] // bucket_samples)
+            buckets.setdefault(key, []).append(pending)
+        return list(buckets.values())
+
+    async def _run_inference(self, fn, *args) -> Tensor:
+        if self.execution is None:
+            return await asyncio.to_thread(fn, *args)
+        return await self.execution.run("inference", fn, *args)
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            dispatched_at = time.perf_counter()
+            for pending in batch:
+                self._wait_times.append(dispatched_at - pending.enqueued_at)
+
+            for bucket in self._bucket(batch):
+                bucket = [p for p in bucket if not p.future.cancelled()]
+                if not bucket:
+                    continue
+                started = time.perf_counter()
+                try:
+                    embeddings = await self._run_inference(bucket[0].generator.generate_embeddings, [p.wav for p in bucket])
+                except Exception as e:
+                    for pending in bucket:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                    continue
+                self._forward_times.append(time.perf_counter() - started)
+                self._batch_sizes.append(len(bucket))
+                self.total_batches += 1
+                self.total_items += len(bucket)
+
+                for i, pending in enumerate(bucket):
+                    if not pending.future.done():
+                        pending.future.set_result(embeddings[i : i + 1])
+
+    def stats(self) -> Dict[str, float]:
+        sizes = list(self._batch_sizes)
+        waits = list(self._wait_times)
+        forwards = list(self._forward_times)
+        return {
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "queue_depth": self.queue_depth,
+            "batch_size_mean": sum(sizes) / len(sizes) if sizes else 0.0,
+            "batch_size_max": max(sizes, default=0),
+            "wait_ms_p50": _percentile(waits, 0.5) * 1000,
+            "wait_ms_p99": _percentile(waits, 0.99) * 1000,
+            "forward_ms_p50": _percentile(forwards, 0.5) * 1000,
+            "forward_ms_p99": _percentile(forwards, 0.99) * 1000,
+        }
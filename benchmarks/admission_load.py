@@ -0,0 +1,86 @@
+"""Login latency and shedding under overload.
+
+First measures capacity with a closed loop of concurrent logins, then offers
+logins open loop (Poisson arrivals) at --overload times that rate. Admitted
+logins should keep a p99 near the server's admission budget
+(VOICEREC_ADMISSION_BUDGET_SECONDS) while the excess gets a fast 503 with
+Retry-After. Run against a live server from the repository root:
+
+    litestar run &
+    python -m benchmarks.admission_load --audio test.wav --overload 2
+"""
+import argparse
+import asyncio
+import base64
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks.hello_under_load import summarize
+
+
+async def login(url: str, credentials: Dict[str, str]) -> Tuple[int, float, str]:
+    started = time.perf_counter()
+    # a fresh client per login so the session cookie does not short circuit anything
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        response = await client.post("/account/login", json=credentials)
+    return response.status_code, time.perf_counter() - started, response.headers.get("retry-after", "")
+
+
+async def capacity(args: argparse.Namespace, credentials: Dict[str, str]) -> float:
+    """Logins per second with args.concurrency always in flight"""
+    completed = 0
+    deadline = time.perf_counter() + args.capacity_seconds
+
+    async def client() -> None:
+        nonlocal completed
+        while time.perf_counter() < deadline:
+            status, _, retry_after = await login(args.url, credentials)
+            completed += status == 200
+            if status == 503:
+                await asyncio.sleep(float(retry_after or 1))
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(args.concurrency)])
+    return completed / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    audio_data = base64.b64encode(open(args.audio, "rb").read()).decode("utf-8")
+    credentials = {"username": f"loadtest-{uuid.uuid4().hex[:8]}", "password": "loadtest", "audio_data": audio_data}
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        response = await client.post("/account/create", json=credentials)
+        response.raise_for_status()
+
+    rate = await capacity(args, credentials)
+    offered = rate * args.overload
+    print(f"capacity {rate:.2f} logins/s, offering {offered:.2f}/s for {args.seconds:.0f}s")
+
+    tasks: List["asyncio.Task[Tuple[int, float, str]]"] = []
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(login(args.url, credentials)))
+        await asyncio.sleep(random.expovariate(offered))
+    results = await asyncio.gather(*tasks)
+
+    statuses = Counter(status for status, _, _ in results)
+    print("responses:", dict(statuses))
+    summarize("admitted (200)", [latency for status, latency, _ in results if status == 200])
+    summarize("shed (503)", [latency for status, latency, _ in results if status == 503])
+    retry_after = Counter(retry for status, _, retry in results if status == 503)
+    if retry_after:
+        print("Retry-After:", dict(sorted(retry_after.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--audio", default="test.wav")
+    parser.add_argument("--overload", type=float, default=2.0, help="offered load as a multiple of measured capacity")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--capacity-seconds", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(main(parser.parse_args()))
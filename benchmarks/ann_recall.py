@@ -0,0 +1,83 @@
+"""Recall and latency of the IVF-PQ voice index against exact search.
+
+Synthetic users are drawn around a few thousand "voice type" centres so that
+neighbourhoods are crowded, like real speaker embeddings. Each query is a
+re-recording of a random enrolled user (that user's vector plus noise):
+
+  recall@k: overlap of the index's top-k with the exact top-k
+  dup@k: how often the re-recorded user is among the k candidates, which is what
+    the enrollment dedupe check needs before it reranks them exactly
+
+    python -m benchmarks.ann_recall --users 10000 100000 --nprobe 8 16 32
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from ann import IVFPQIndex
+from identify import EmbeddingMatrix
+
+
+def synthetic_users(count: int, dim: int, rng: np.random.Generator, spread: float) -> np.ndarray:
+    centres = rng.standard_normal((max(1, count // 100), dim)).astype(np.float32)
+    vectors = centres[rng.integers(len(centres), size=count)] + spread * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile(timings, fraction: float) -> float:
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(fraction * len(timings)))]
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'users':>8} {'m':>4} {'nprobe':>6} {'build s':>8} {'index MB':>9} {'recall@k':>9} {'dup@k':>6} {'p50 ms':>7} {'p99 ms':>7} {'exact p50':>10}")
+    for users in args.users:
+        vectors = synthetic_users(users, args.dim, rng, args.spread)
+        usernames = [f"user{i}" for i in range(users)]
+        matrix = EmbeddingMatrix(dtype=torch.float32)
+        matrix.add_many(usernames, torch.from_numpy(vectors))
+
+        targets = rng.integers(users, size=args.queries)
+        queries = vectors[targets] + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+        exact, exact_timings = [], []
+        for query in queries:
+            started = time.perf_counter()
+            exact.append({username for username, _ in matrix.search(torch.from_numpy(query), args.k)})
+            exact_timings.append(time.perf_counter() - started)
+
+        for m in args.m:
+            started = time.perf_counter()
+            index = IVFPQIndex.build(usernames, vectors.astype(np.float16), m=m)
+            build = time.perf_counter() - started
+            for nprobe in args.nprobe:
+                overlap = found = 0
+                timings = []
+                for target, query, expected in zip(targets, queries, exact):
+                    started = time.perf_counter()
+                    candidates = {username for username, _ in index.search(query, args.k, nprobe=nprobe)}
+                    timings.append(time.perf_counter() - started)
+                    overlap += len(candidates & expected)
+                    found += f"user{target}" in candidates
+                print(
+                    f"{users:8d} {m:4d} {nprobe:6d} {build:8.1f} {index.nbytes / 2 ** 20:9.1f}"
+                    f" {overlap / (args.k * args.queries):9.3f} {found / args.queries:6.3f}"
+                    f" {statistics.median(timings) * 1000:7.2f} {percentile(timings, 0.99) * 1000:7.2f}"
+                    f" {statistics.median(exact_timings) * 1000:10.2f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1000, help="embedding size of the byol checkpoint")
+    parser.add_argument("--m", type=int, nargs="+", default=[50, 100], help="PQ sub-quantizers (bytes per user)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--k", type=int, default=10, help="candidates handed to the exact rerank")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=0.8, help="noise around each voice type centre")
+    parser.add_argument("--noise", type=float, default=0.5, help="norm of the noise of a re-recording")
+    main(parser.parse_args())
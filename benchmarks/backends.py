@@ -0,0 +1,58 @@
+"""Parity and CPU latency of the inference backends against eager.
+
+For every backend the build and warm-up cost is reported once, then each
+(batch size, clip length) case is timed after warm-up and its embeddings are
+compared with eager ones on the same input (minimum cosine similarity and
+largest absolute difference):
+
+    python -m benchmarks.backends --model random --backends eager torchscript compile
+"""
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from backends import BACKENDS
+from benchmarks.common import build_model, describe, synthetic_speech, time_call
+from ml import EmbeddingGenerator
+
+
+def main(args: argparse.Namespace) -> None:
+    model = build_model(args.model)
+    reference = EmbeddingGenerator(model)
+    cases = [(batch_size, seconds) for batch_size in args.batch_sizes for seconds in args.lengths]
+    inputs = {
+        case: torch.cat([reference.normalize_audio(synthetic_speech(case[1], seed=i)).unsqueeze(0) for i in range(case[0])])
+        for case in cases
+    }
+    expected = {case: reference.embed_batch(batch) for case, batch in inputs.items()}
+
+    for backend in args.backends:
+        started = time.perf_counter()
+        generator = EmbeddingGenerator(model, backend=backend)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        generator.warm_up(args.lengths, args.batch_sizes)
+        warmed = time.perf_counter() - started
+        print(f"{backend}: build {built:.1f}s, warm-up {warmed:.1f}s")
+
+        for case in cases:
+            batch = inputs[case]
+            features = generator.embed_batch(batch)
+            cosine = F.cosine_similarity(features, expected[case]).min().item()
+            difference = (features - expected[case]).abs().max().item()
+            timings = time_call(lambda: generator.embed_batch(batch), repeats=args.repeats)
+            print(f"  batch {case[0]:2d} x {case[1]:4.1f}s  {describe(timings)}  min cos {cosine:.6f}  max |diff| {difference:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--lengths", type=float, nargs="+", default=[1.0, 5.0, 15.0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parsed = parser.parse_args()
+    torch.set_grad_enabled(False)
+    main(parsed)
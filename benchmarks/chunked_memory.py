@@ -0,0 +1,67 @@
+"""Peak memory and latency of full-clip vs chunked embedding as clips get longer.
+
+Every (mode, length) case runs in a fresh interpreter so ru_maxrss is not
+polluted by earlier cases:
+
+    python -m benchmarks.chunked_memory --lengths 5 15 60 300
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+
+def run_case(args: argparse.Namespace) -> None:
+    from benchmarks.common import build_model, synthetic_speech
+    from ml import EmbeddingGenerator
+
+    generator = EmbeddingGenerator(build_model(args.model))
+    wav = synthetic_speech(args.case_seconds)
+    # include the warm-up allocations in the baseline, measure only the clip
+    generator.generate_embedding(synthetic_speech(1.0))
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    if args.case_mode == "full":
+        generator.generate_embedding(wav)
+    else:
+        generator.generate_embedding_chunked(wav, window_seconds=args.window, overlap_seconds=args.overlap, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "peak_mb": (peak - baseline) / 1024}))
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{'mode':>8} {'clip s':>7} {'latency ms':>11} {'peak +MB':>9}")
+    for seconds in args.lengths:
+        for mode in ("full", "chunked"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.chunked_memory", "--model", args.model,
+                 "--window", str(args.window), "--overlap", str(args.overlap), "--batch-size", str(args.batch_size),
+                 "--case-mode", mode, "--case-seconds", str(seconds)],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{mode:>8} {seconds:7.0f} {result['seconds'] * 1000:11.1f} {result['peak_mb']:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--lengths", type=float, nargs="+", default=[5, 15, 30, 60, 120, 300])
+    parser.add_argument("--window", type=float, default=5.0)
+    parser.add_argument("--overlap", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--case-mode", choices=["full", "chunked"], help=argparse.SUPPRESS)
+    parser.add_argument("--case-seconds", type=float, help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    torch.set_grad_enabled(False)
+    if parsed.case_mode:
+        run_case(parsed)
+    else:
+        main(parsed)
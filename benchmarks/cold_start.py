@@ -0,0 +1,105 @@
+"""Cold start to first embedding: load_model (from_hparams) against a model bundle.
+
+Each run is a fresh interpreter that imports the serving modules, loads the
+model one way or the other and embeds one second of audio, which is what a
+new worker pays before it can serve. The checkpoint is served from a local
+directory, so the hub lookups from_hparams makes in production are not
+included and the real gap is larger. Files stay in the page cache between
+runs; the first run of each kind is the closest to a cold disk.
+
+    python -m benchmarks.cold_start --model random --runs 5
+"""
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+started = time.perf_counter()
+
+
+def worker(args: argparse.Namespace) -> None:
+    import torch
+
+    from bundle import load_bundle
+    from ml import EmbeddingGenerator
+    from singer_identity.model import load_model
+
+    imported = time.perf_counter()
+    if args.worker == "bundle":
+        model = load_bundle(Path(args.bundle))
+    else:
+        # a local copy of the checkpoint for the random model, otherwise the hub and load_model's usual cache
+        local = {"source": args.source, "savedir": args.savedir} if args.source else {}
+        model = load_model("byol" if args.model == "random" else args.model, **local)
+    loaded = time.perf_counter()
+    with torch.no_grad():
+        EmbeddingGenerator(model).generate_embeddings([torch.randn(1, 44100) * 0.1])
+    embedded = time.perf_counter()
+    print(json.dumps({
+        "import": imported - started,
+        "load": loaded - imported,
+        "first_embedding": embedded - loaded,
+        # ru_maxrss is in kilobytes on Linux
+        "peak": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }))
+
+
+def main(args: argparse.Namespace) -> None:
+    import torch
+    import yaml
+
+    from benchmarks.common import BYOL_HPARAMS, build_model
+    from bundle import bundle_pretrained, write_bundle
+
+    with tempfile.TemporaryDirectory() as directory:
+        source, bundle = Path(directory) / "source", Path(directory) / "model.pt"
+        if args.model == "random":
+            # lay the model out like the hub repository so from_hparams reads it locally
+            (source / "byol").mkdir(parents=True)
+            (source / "byol" / "hyperparams.yaml").write_text(yaml.safe_dump(BYOL_HPARAMS))
+            state_dict = build_model("random").state_dict()
+            torch.save(state_dict, source / "byol" / "model.pt")
+            write_bundle(BYOL_HPARAMS, state_dict, bundle)
+            source_arg = str(source)
+        else:
+            bundle_pretrained(args.model, bundle)
+            source_arg = None
+
+        for kind in ("hparams", "bundle"):
+            command = [sys.executable, "-m", "benchmarks.cold_start", "--worker", kind, "--model", args.model, "--bundle", str(bundle)]
+            if source_arg:
+                command += ["--source", source_arg, "--savedir", str(Path(directory) / "savedir")]
+            reports, walls = [], []
+            for _ in range(args.runs):
+                begun = time.perf_counter()
+                result = subprocess.run(command, capture_output=True, text=True)
+                walls.append(time.perf_counter() - begun)
+                if result.returncode != 0:
+                    raise SystemExit(f"{kind} failed:\n{result.stderr}")
+                reports.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            phases = "  ".join(
+                f"{phase} {statistics.median(r[phase] for r in reports) * 1000:6.0f} ms"
+                for phase in ("import", "load", "first_embedding")
+            )
+            peak = statistics.median(r["peak"] for r in reports) / 2**20
+            print(f"{kind:>8}: process {statistics.median(walls) * 1000:6.0f} ms (first {walls[0] * 1000:.0f})  {phases}  peak {peak:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--worker", choices=["hparams", "bundle"], help=argparse.SUPPRESS)
+    parser.add_argument("--bundle", help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    parser.add_argument("--savedir", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.worker:
+        worker(parsed)
+    else:
+        main(parsed)
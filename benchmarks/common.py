@@ -0,0 +1,61 @@
+"""Helpers shared by the benchmark scripts"""
+import math
+import statistics
+import time
+from typing import Callable, List
+
+import torch
+from torch import Tensor
+
+from singer_identity.model import IdentityEncoder, load_model
+
+# hyperparameters of the published checkpoints, for timing runs without network access
+BYOL_HPARAMS = {
+    "feature_extractor": {"spec_layer": "melspectogram", "n_fft": 2048, "hop_length": 512},
+    "encoder": {"backbone": "efficientnet_b0", "embedding_dim": 1000},
+}
+
+
+def build_model(name: str) -> IdentityEncoder:
+    """Load a pretrained model, or an untrained one with the same architecture for name="random" """
+    if name == "random":
+        torch.manual_seed(0)
+        model = IdentityEncoder(**BYOL_HPARAMS)
+        # fresh batch norm statistics shrink activations to nothing, so estimate them on synthetic speech
+        model.train()
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.momentum = None
+        with torch.no_grad():
+            model(torch.cat([synthetic_speech(3.0, seed=seed) for seed in range(4)]))
+        return model.eval()
+    model = load_model(name)
+    if not isinstance(model, IdentityEncoder):
+        raise ValueError("Model is not an IdentityEncoder")
+    return model
+
+
+def synthetic_speech(seconds: float, sample_rate: int = 44100, seed: int = 0) -> Tensor:
+    """Harmonic tone with a syllable-rate envelope and a little noise, shaped (1, samples)"""
+    generator = torch.Generator().manual_seed(seed)
+    t = torch.arange(int(seconds * sample_rate)) / sample_rate
+    f0 = 100 + 150 * torch.rand(1, generator=generator)
+    voiced = sum(torch.sin(2 * math.pi * f0 * k * t) / k for k in range(1, 8))
+    envelope = torch.sin(2 * math.pi * 2.5 * t).abs()
+    noise = 0.02 * torch.randn(t.shape, generator=generator)
+    return (voiced * envelope + noise).unsqueeze(0)
+
+
+def time_call(fn: Callable[[], object], repeats: int = 5, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def describe(timings: List[float]) -> str:
+    return f"median {statistics.median(timings) * 1000:8.1f} ms  min {min(timings) * 1000:8.1f} ms"
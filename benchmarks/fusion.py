@@ -0,0 +1,75 @@
+"""Stage by stage CPU time and parity of the fused inference module against the eager one.
+
+Stages, eager (backends.BatchEmbedder) against fused (fusion.FusedEncoder):
+
+    front-end  nnAudio mel + LogScale        / FFT log mel
+    stem       Grey2Rgb + first conv + BN    / one-channel conv with bias map
+    blocks     MBConv blocks with BatchNorm  / BatchNorm folded into the convs
+    head       pooling + classifier          / (same)
+    total      whole forward
+
+Parity is the cosine and relative error of the fused embeddings against the
+eager ones on clip-length synthetic speech:
+
+    python -m benchmarks.fusion --model random --batch-sizes 1 8
+"""
+import argparse
+from typing import Callable, Dict, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from backends import BatchEmbedder
+from benchmarks.common import build_model, describe, synthetic_speech, time_call
+from fusion import fuse_for_inference, state_nbytes
+
+
+def stages(eager: BatchEmbedder, fused, wav: Tensor) -> Dict[str, Tuple[Callable[[], object], Callable[[], object]]]:
+    backbone = eager.backbone
+    eager_spec = eager.log_scale(eager.feature_extractor(wav))
+    fused_spec = fused.log_mel(wav)
+    scale = 1 / fused_spec.amax(dim=(1, 2))
+    eager_stem = backbone.features[0](eager.grey2rgb(eager_spec))
+    fused_stem = fused.stem(fused_spec, scale)
+    blocks = backbone.features[1:](eager_stem)
+    return {
+        "front-end": (lambda: eager.log_scale(eager.feature_extractor(wav)), lambda: fused.log_mel(wav)),
+        "stem": (lambda: backbone.features[0](eager.grey2rgb(eager_spec)), lambda: fused.stem(fused_spec, scale)),
+        "blocks": (lambda: backbone.features[1:](eager_stem), lambda: fused.blocks(fused_stem)),
+        "head": (
+            lambda: backbone.classifier(torch.flatten(backbone.avgpool(blocks), 1)),
+            lambda: fused.classifier(torch.flatten(fused.avgpool(blocks), 1)),
+        ),
+        "total": (lambda: eager(wav), lambda: fused(wav)),
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    torch.set_grad_enabled(False)
+    model = build_model(args.model)
+    eager = BatchEmbedder(model).eval()
+    fused = fuse_for_inference(model)
+    print(f"state: eager {state_nbytes(eager) / 2**20:.1f} MB, fused {state_nbytes(fused) / 2**20:.1f} MB")
+
+    for batch_size in args.batch_sizes:
+        wav = torch.cat([synthetic_speech(args.seconds, seed=seed) for seed in range(batch_size)])
+        wav = wav / wav.abs().amax(dim=1, keepdim=True)
+        reference, embeddings = eager(wav), fused(wav)
+        cosine = F.cosine_similarity(reference, embeddings).min().item()
+        error = ((reference - embeddings).norm(dim=-1) / reference.norm(dim=-1)).max().item()
+        print(f"batch {batch_size} x {args.seconds:.0f}s: min cosine {cosine:.7f}, max relative error {error:.2e}")
+        for name, (eager_fn, fused_fn) in stages(eager, fused, wav).items():
+            eager_times = time_call(eager_fn, args.repeats)
+            fused_times = time_call(fused_fn, args.repeats)
+            speedup = min(eager_times) / min(fused_times)
+            print(f"  {name:>9}  eager {describe(eager_times)}  fused {describe(fused_times)}  {speedup:4.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--repeats", type=int, default=5)
+    main(parser.parse_args())
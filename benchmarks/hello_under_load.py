@@ -0,0 +1,86 @@
+"""Measures /hello latency while concurrent logins saturate the CPU pools.
+
+Run against a live server from the repository root:
+
+    litestar run &
+    python -m benchmarks.hello_under_load --audio test.wav --logins 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import base64
+import statistics
+import time
+import uuid
+from typing import List
+
+import httpx
+
+
+def summarize(name: str, latencies: List[float]) -> None:
+    if not latencies:
+        print(f"{name}: no samples")
+        return
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    print(
+        f"{name}: n={len(ordered)} p50={statistics.median(ordered) * 1000:.1f}ms "
+        f"p99={p99 * 1000:.1f}ms max={ordered[-1] * 1000:.1f}ms"
+    )
+
+
+async def poll_hello(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> List[float]:
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/hello")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def main(args: argparse.Namespace) -> None:
+    audio_data = base64.b64encode(open(args.audio, "rb").read()).decode("utf-8")
+    credentials = {"username": f"loadtest-{uuid.uuid4().hex[:8]}", "password": "loadtest", "audio_data": audio_data}
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        response = await client.post("/account/create", json=credentials)
+        response.raise_for_status()
+
+        stop = asyncio.Event()
+        idle = asyncio.create_task(poll_hello(client, stop, args.interval))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        summarize("/hello idle", await idle)
+
+        stop = asyncio.Event()
+        loaded = asyncio.create_task(poll_hello(client, stop, args.interval))
+        semaphore = asyncio.Semaphore(args.concurrency)
+        login_latencies = []
+
+        async def login() -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                # a fresh client per login so the session cookie does not short circuit anything
+                async with httpx.AsyncClient(base_url=args.url, timeout=None) as login_client:
+                    await login_client.post("/account/login", json=credentials)
+                login_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[login() for _ in range(args.logins)])
+        elapsed = time.perf_counter() - started
+        stop.set()
+
+        summarize("/hello under load", await loaded)
+        summarize("/account/login", login_latencies)
+        print(f"logins/s: {args.logins / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--audio", default="test.wav")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    asyncio.run(main(parser.parse_args()))
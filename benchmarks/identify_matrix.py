@@ -0,0 +1,91 @@
+"""Query latency and memory of 1:N identification against synthetic enrolled users.
+
+Every user count runs in a fresh interpreter so ru_maxrss only covers that matrix.
+Queries are noisy copies of random enrolled users, so the top-1 hit rate also
+checks the blocked top-k against the user each query was drawn from:
+
+    python -m benchmarks.identify_matrix --users 10000 100000 1000000
+"""
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+DTYPES = {"float16": torch.float16, "float32": torch.float32}
+
+
+def run_case(args: argparse.Namespace) -> None:
+    from identify import EmbeddingMatrix
+
+    generator = torch.Generator().manual_seed(0)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    matrix = EmbeddingMatrix(dtype=DTYPES[args.dtype], block_rows=args.block_rows)
+
+    started = time.perf_counter()
+    # enrolled in slices, as a startup load from the store would
+    for start in range(0, args.case_users, 65536):
+        count = min(65536, args.case_users - start)
+        matrix.add_many([f"user{i}" for i in range(start, start + count)], torch.randn(count, args.dim, generator=generator))
+    build = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    targets = torch.randint(args.case_users, (args.queries,), generator=generator)
+    timings = []
+    hits = 0
+    for target in targets.tolist():
+        row = matrix._matrix[target].float()
+        query = F.normalize(row, dim=0) + args.noise * torch.randn(args.dim, generator=generator) / args.dim ** 0.5
+        started = time.perf_counter()
+        matches = matrix.search(query, args.top_k)
+        timings.append(time.perf_counter() - started)
+        hits += matches[0][0] == f"user{target}"
+
+    timings.sort()
+    print(json.dumps({
+        "build_s": build,
+        "matrix_mb": matrix.nbytes / 2 ** 20,
+        "rss_mb": (peak - baseline) / 1024,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(0.99 * len(timings)))] * 1000,
+        "top1": hits / len(timings),
+    }))
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{'users':>9} {'build s':>8} {'matrix MB':>10} {'peak +MB':>9} {'p50 ms':>8} {'p99 ms':>8} {'top-1':>6}")
+    for users in args.users:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.identify_matrix", "--dim", str(args.dim), "--dtype", args.dtype,
+             "--block-rows", str(args.block_rows), "--queries", str(args.queries), "--top-k", str(args.top_k),
+             "--noise", str(args.noise), "--case-users", str(users)],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(
+            f"{users:9d} {result['build_s']:8.1f} {result['matrix_mb']:10.1f} {result['rss_mb']:9.1f}"
+            f" {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} {result['top1']:6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=1000, help="embedding size of the byol checkpoint")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="float16")
+    parser.add_argument("--block-rows", type=int, default=65536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.5, help="norm of the noise added to each query")
+    parser.add_argument("--case-users", type=int, help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    torch.set_grad_enabled(False)
+    if parsed.case_users:
+        run_case(parsed)
+    else:
+        main(parsed)
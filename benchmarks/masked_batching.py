@@ -0,0 +1,79 @@
+"""Parity and throughput of batching clips of mixed lengths.
+
+Every strategy embeds the same clips, with lengths drawn uniformly from
+--min-seconds to --max-seconds, and is compared against embedding each clip on
+its own:
+
+    single    one forward per clip
+    padded    batches of --batch-size in arrival order, zero padded, no mask
+              (what a plain batched forward computes)
+    masked    the same batches, with padded frames masked out of the pooling
+    bucketed  clips sorted by length and batched with others at most
+              --bucket-seconds longer (generate_embeddings_bucketed), masked
+
+    python -m benchmarks.masked_batching --model random --clips 48
+"""
+import argparse
+import time
+from typing import Callable, List
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from benchmarks.common import build_model, synthetic_speech
+from ml import EmbeddingGenerator
+
+
+def padded_batch(generator: EmbeddingGenerator, wavs: List[Tensor]) -> Tensor:
+    normalized = [generator.normalize_audio(wav) for wav in wavs]
+    batch = torch.zeros(len(normalized), max(wav.shape[-1] for wav in normalized))
+    for i, wav in enumerate(normalized):
+        batch[i, : wav.shape[-1]] = wav
+    return generator.embed_batch(batch)
+
+
+def in_batches(fn: Callable[[List[Tensor]], Tensor], wavs: List[Tensor], batch_size: int) -> Tensor:
+    return torch.cat([fn(wavs[start : start + batch_size]) for start in range(0, len(wavs), batch_size)])
+
+
+def main(args: argparse.Namespace) -> None:
+    torch.set_grad_enabled(False)
+    generator = EmbeddingGenerator(build_model(args.model))
+    if not generator.supports_masking:
+        raise SystemExit("This model cannot run masked batches")
+    lengths = torch.empty(args.clips).uniform_(args.min_seconds, args.max_seconds, generator=torch.Generator().manual_seed(0))
+    wavs = [synthetic_speech(seconds, seed=i) for i, seconds in enumerate(lengths.tolist())]
+    audio_seconds = lengths.sum().item()
+
+    strategies = {
+        "single": lambda: torch.cat([generator.generate_embeddings([wav]) for wav in wavs]),
+        "padded": lambda: in_batches(lambda batch: padded_batch(generator, batch), wavs, args.batch_size),
+        "masked": lambda: in_batches(generator.generate_embeddings, wavs, args.batch_size),
+        "bucketed": lambda: generator.generate_embeddings_bucketed(wavs, args.bucket_seconds, args.batch_size),
+    }
+    generator.generate_embeddings([wavs[0]])
+    reference = None
+    print(f"{len(wavs)} clips of {args.min_seconds:.0f}-{args.max_seconds:.0f}s, {audio_seconds:.0f}s of audio, batches of {args.batch_size}")
+    for name, run in strategies.items():
+        started = time.perf_counter()
+        embeddings = run()
+        elapsed = time.perf_counter() - started
+        reference = embeddings if reference is None else reference
+        cosine = F.cosine_similarity(embeddings, reference)
+        error = ((embeddings - reference).norm(dim=-1) / reference.norm(dim=-1)).max().item()
+        print(
+            f"{name:>9}: {len(wavs) / elapsed:6.2f} clips/s  {audio_seconds / elapsed:6.1f} audio s/s  "
+            f"cosine to single min {cosine.min().item():.6f}  max relative error {error:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--clips", type=int, default=48)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--max-seconds", type=float, default=15.0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--bucket-seconds", type=float, default=2.0)
+    main(parser.parse_args())
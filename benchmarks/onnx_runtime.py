@@ -0,0 +1,92 @@
+"""ONNX Runtime against the PyTorch backends: parity, CPU latency and memory.
+
+Every (backend, batch size) case runs in its own process so peak resident
+memory is not inflated by earlier cases. Each process builds the generator,
+warms it up, times embed_batch and saves its embeddings; the parent then
+compares them with eager ones on the same input (list eager first):
+
+    python -m benchmarks.onnx_runtime --model random --backends eager onnx --batch-sizes 1 8 32
+
+"rss" is resident memory once the backend is built, "peak" the high-water
+mark over the run, both in MB.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+from backends import BACKENDS
+from benchmarks.common import build_model, describe, synthetic_speech, time_call
+from metrics import rss_bytes
+from ml import EmbeddingGenerator
+
+
+def worker(args: argparse.Namespace) -> None:
+    model = build_model(args.model)
+    started = time.perf_counter()
+    generator = EmbeddingGenerator(model, backend=args.worker)
+    built = time.perf_counter() - started
+    rss = rss_bytes()
+    batch = torch.cat(
+        [generator.normalize_audio(synthetic_speech(args.seconds, seed=i)).unsqueeze(0) for i in range(args.batch_size)]
+    )
+    generator.warm_up([args.seconds], [args.batch_size])
+    timings = time_call(lambda: generator.embed_batch(batch), repeats=args.repeats)
+    torch.save(generator.embed_batch(batch), args.output)
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"built": built, "timings": timings, "rss": rss, "peak": peak}))
+
+
+def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for batch_size in args.batch_sizes:
+            expected = None
+            for backend in args.backends:
+                output = Path(directory) / f"{backend}-{batch_size}.pt"
+                command = [
+                    sys.executable, "-m", "benchmarks.onnx_runtime", "--worker", backend, "--model", args.model,
+                    "--batch-size", str(batch_size), "--seconds", str(args.seconds), "--repeats", str(args.repeats),
+                    "--output", str(output),
+                ]
+                result = subprocess.run(command, capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f"{backend} batch {batch_size} failed:\n{result.stderr}")
+                    continue
+                report = json.loads(result.stdout.strip().splitlines()[-1])
+                features = torch.load(output)
+                if expected is None and backend == "eager":
+                    expected = features
+                parity = ""
+                if expected is not None:
+                    cosine = F.cosine_similarity(features, expected).min().item()
+                    parity = f"  min cos {cosine:.6f}  max |diff| {(features - expected).abs().max().item():.2e}"
+                print(
+                    f"{backend:>11} batch {batch_size:2d} x {args.seconds:.1f}s  build {report['built']:5.1f}s  "
+                    f"{describe(report['timings'])}  rss {report['rss'] / 2**20:6.0f}  peak {report['peak'] / 2**20:6.0f}{parity}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["eager", "torchscript", "onnx"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--batch-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    torch.set_grad_enabled(False)
+    if parsed.worker:
+        worker(parsed)
+    else:
+        main(parsed)
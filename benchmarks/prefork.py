@@ -0,0 +1,134 @@
+"""Memory and throughput of prefork workers against independent ones.
+
+independent: one fresh interpreter per worker, each loading its own weights,
+    which is what running several `litestar run` processes amounts to.
+prefork: one parent loads the weights into shared memory and forks the
+    workers (prefork.fork_worker), like `voicerec serve`.
+
+Every worker is pinned to its share of the cores (prefork.cpu_groups), embeds
+clip-length synthetic speech for --seconds and then reports its resident (rss),
+proportional (pss, shared pages split between the processes mapping them) and
+private memory from /proc/self/smaps_rollup. The prefork total includes the
+parent's pss:
+
+    python -m benchmarks.prefork --model random --workers 1 2 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import torch
+
+from benchmarks.common import build_model, synthetic_speech
+from ml import EmbeddingGenerator
+from prefork import cpu_groups, fork_worker, share_model
+
+
+def memory() -> Dict[str, int]:
+    """rss, pss and private bytes of this process"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def run(model: torch.nn.Module, seconds: float, clip_seconds: float) -> Dict[str, float]:
+    generator = EmbeddingGenerator(model)
+    clip = synthetic_speech(clip_seconds)
+    generator.generate_embeddings([clip])
+    embedded = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        generator.generate_embeddings([clip])
+        embedded += 1
+    return {"embeddings": embedded, "elapsed": time.perf_counter() - started, **memory()}
+
+
+def independent(args: argparse.Namespace, workers: int) -> List[Dict[str, float]]:
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.prefork", "--worker", ",".join(map(str, cpus)), "--model", args.model,
+             "--seconds", str(args.seconds), "--clip-seconds", str(args.clip_seconds)],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for cpus in cpu_groups(workers)
+    ]
+    return [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+
+
+def prefork(args: argparse.Namespace, model: torch.nn.Module, workers: int) -> List[Dict[str, float]]:
+    reports, release = [], os.pipe()
+    readers = []
+    for cpus in cpu_groups(workers):
+        read_fd, write_fd = os.pipe()
+
+        def target(write_fd: int = write_fd) -> None:
+            os.write(write_fd, json.dumps(run(model, args.seconds, args.clip_seconds)).encode())
+            os.close(write_fd)
+            # stay alive until the parent has measured itself, so shared pages are still split
+            os.close(release[1])
+            os.read(release[0], 1)
+
+        pid = fork_worker(cpus, len(cpus), target)
+        os.close(write_fd)
+        readers.append((pid, read_fd))
+    for _, read_fd in readers:
+        with os.fdopen(read_fd) as f:
+            reports.append(json.loads(f.read()))
+    reports.append({"embeddings": 0, "elapsed": 0.0, **memory(), "parent": True})
+    os.close(release[0])
+    os.close(release[1])
+    for pid, _ in readers:
+        os.waitpid(pid, 0)
+    return reports
+
+
+def summarize(kind: str, workers: int, reports: List[Dict[str, float]]) -> None:
+    children = [report for report in reports if not report.get("parent")]
+    throughput = sum(report["embeddings"] / report["elapsed"] for report in children)
+    mb = 2**20
+    print(
+        f"{kind:>11} x{workers}: {throughput:6.2f} embeddings/s  "
+        f"worker rss {sum(r['rss'] for r in children) / len(children) / mb:5.0f} MB  "
+        f"worker private {sum(r['private'] for r in children) / len(children) / mb:5.0f} MB  "
+        f"total pss {sum(r['pss'] for r in reports) / mb:6.0f} MB"
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    # the parent must not start an intra-op thread pool before forking
+    torch.set_num_threads(1)
+    model = share_model(build_model(args.model))
+    for workers in args.workers:
+        summarize("independent", workers, independent(args, workers))
+        summarize("prefork", workers, prefork(args, model, workers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=10.0, help="embedding time per worker")
+    parser.add_argument("--clip-seconds", type=float, default=3.0)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    torch.set_grad_enabled(False)
+    if parsed.worker:
+        cpus = [int(cpu) for cpu in parsed.worker.split(",")]
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+        print(json.dumps(run(build_model(parsed.model), parsed.seconds, parsed.clip_seconds)))
+    else:
+        main(parsed)
@@ -0,0 +1,184 @@
+"""Audio embedded and error rates of progressive and streaming login verification against embedding the whole recording.
+
+Every speaker enrolls with their first recording, and every other recording
+is a login attempt against every enrolled speaker (genuine for its own
+speaker, impostor for the rest). Trials are scored four ways:
+
+    whole      the recording in one embedding, what logins do by default
+    stream     the mean of StreamingEmbedding windows, what streaming logins do
+    pieces     the mean of every ProgressiveVerification piece, no early exit
+    margin m   ProgressiveVerification with margin m, stopping early
+
+Means of windows and pieces score on their own scales, so the other rows use
+thresholds calibrated to accept the same share of impostors as whole
+recordings do at theirs, printed as VOICEREC_STREAM_THRESHOLD and
+VOICEREC_PROGRESSIVE_THRESHOLD. For each
+row the audio embedded as a fraction of the recordings, the false accept /
+false reject rates and the share of decisions that differ from the whole
+recording's are reported. The whole-recording threshold defaults to its EER
+threshold, since app.VOICE_SIMILARITY_THRESHOLD only means something for the
+trained checkpoint. Recordings are a folder with one subfolder per speaker;
+without one, synthetic speakers are used:
+
+    python -m benchmarks.progressive --recordings recordings/ --model byol --threshold 0.85
+    python -m benchmarks.progressive --synthetic 8 --model random
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from torch import Tensor
+
+from benchmarks.common import build_model, synthetic_speech
+from evaluation import equal_error_rate, error_rates, threshold_at_far
+from ml import EmbeddingGenerator
+from progressive import ProgressiveVerification
+from streaming import StreamingEmbedding
+from users import User, build_template
+
+
+def enrolled_users(generator: EmbeddingGenerator, clips: Sequence[Tuple[str, Tensor]]) -> Tuple[List[User], List[Tuple[str, Tensor]]]:
+    """A User per speaker from their first recording, and the rest of the recordings as login attempts"""
+    users: Dict[str, User] = {}
+    probes = []
+    for speaker, wav in clips:
+        if speaker in users:
+            probes.append((speaker, wav))
+        else:
+            users[speaker] = User(speaker, b"", build_template(generator.generate_embeddings([wav])))
+    return list(users.values()), probes
+
+
+class GeneratorEngine:
+    """Embeds StreamingEmbedding windows straight through the generator, in place of the app's BatchingEngine"""
+
+    def __init__(self, generator: EmbeddingGenerator):
+        self.generator = generator
+
+    async def embed(self, wav: Tensor, model: None = None) -> Tensor:
+        return self.generator.generate_embeddings([wav])
+
+
+def stream_embedding(generator: EmbeddingGenerator, wav: Tensor, window_seconds: float) -> Tensor:
+    """The (1, dim) mean a streaming login of wav ends up scoring"""
+
+    async def run() -> Tensor:
+        embedding = StreamingEmbedding(GeneratorEngine(generator), int(window_seconds * 44100), 44100)
+        embedding.add(wav)
+        return await embedding.finish()
+
+    return asyncio.run(run())
+
+
+def progressive_scores(
+    verification: ProgressiveVerification,
+    piece_embeddings: Sequence[Dict[Tuple[int, int], Tensor]],
+    wavs: Sequence[Tensor],
+    users: Sequence[User],
+) -> Tuple[Tensor, Tensor]:
+    """(probes, users) scores and fractions of audio embedded, from precomputed piece embeddings"""
+    scores, fractions = torch.empty(len(wavs), len(users)), torch.empty(len(wavs), len(users))
+    for i, (embeddings, wav) in enumerate(zip(piece_embeddings, wavs)):
+        offset = wav.storage_offset()
+
+        async def embed(piece: Tensor) -> Tensor:
+            start = piece.storage_offset() - offset
+            return embeddings[(start, start + piece.shape[-1])]
+
+        for j, user in enumerate(users):
+            scores[i, j], fractions[i, j] = asyncio.run(verification.verify(wav, embed, user.score))
+    return scores, fractions
+
+
+def evaluate(
+    generator: EmbeddingGenerator,
+    clips: Sequence[Tuple[str, Tensor]],
+    margins: Sequence[float],
+    first_seconds: float,
+    stream_window_seconds: float,
+    threshold: Optional[float],
+) -> Tuple[float, float, float, Dict[str, Dict[str, float]]]:
+    users, probes = enrolled_users(generator, clips)
+    wavs = [wav for _, wav in probes]
+    labels = torch.tensor([[speaker == user.username for user in users] for speaker, _ in probes])
+    whole = torch.tensor([[user.score(embedding) for user in users] for embedding in generator.generate_embeddings_bucketed(wavs)])
+    eer, eer_threshold = equal_error_rate(whole.flatten(), labels.flatten())
+    threshold = eer_threshold if threshold is None else threshold
+    accepted = whole >= threshold
+    far, _ = error_rates(whole.flatten(), labels.flatten(), threshold)
+    stream = torch.tensor([[user.score(stream_embedding(generator, wav, stream_window_seconds)) for user in users] for wav in wavs])
+    stream_threshold = threshold_at_far(stream.flatten(), labels.flatten(), far)
+
+    verification = ProgressiveVerification(0.0, float("inf"), int(first_seconds * 44100), 44100)
+    piece_embeddings = []
+    for wav in wavs:
+        bounds = [0] + verification.boundaries(wav.shape[-1])
+        piece_embeddings.append({(start, end): generator.generate_embeddings([wav[..., start:end]]) for start, end in zip(bounds, bounds[1:])})
+    pieces, fractions = progressive_scores(verification, piece_embeddings, wavs, users)
+    verification.threshold = threshold_at_far(pieces.flatten(), labels.flatten(), far)
+
+    def row(scores: Tensor, fractions: Tensor, threshold: float) -> Dict[str, float]:
+        far, frr = error_rates(scores.flatten(), labels.flatten(), threshold)
+        return {
+            "audio_fraction": fractions.mean().item(),
+            "genuine_fraction": fractions[labels].mean().item(),
+            "impostor_fraction": fractions[~labels].mean().item(),
+            "far": far,
+            "frr": frr,
+            "flipped": ((scores >= threshold) != accepted).float().mean().item(),
+        }
+
+    report = {
+        "whole": row(whole, torch.ones_like(whole), threshold),
+        "stream": row(stream, torch.ones_like(stream), stream_threshold),
+        "pieces": row(pieces, fractions, verification.threshold),
+    }
+    for margin in margins:
+        verification.margin = margin
+        report[f"margin {margin:g}"] = row(*progressive_scores(verification, piece_embeddings, wavs, users), verification.threshold)
+    print(f"{len(users)} speakers, {len(probes)} login recordings, {labels.numel()} trials, whole recording EER {eer:.3f}")
+    return threshold, stream_threshold, verification.threshold, report
+
+
+def synthetic_clips(speakers: int) -> List[Tuple[str, Tensor]]:
+    """Three recordings per synthetic speaker (a fixed pitch and timbre per seed), of login lengths"""
+    return [(f"speaker{seed}", synthetic_speech(seconds, seed=seed)) for seed in range(speakers) for seconds in (6.0, 9.0, 14.0)]
+
+
+def main(args: argparse.Namespace) -> None:
+    torch.set_grad_enabled(False)
+    if args.recordings:
+        from ingest import AudioIngest
+        from quantization import load_audio_folder
+
+        clips = load_audio_folder(Path(args.recordings), AudioIngest(sample_rate=44100, max_seconds=15.0))
+    else:
+        clips = synthetic_clips(args.synthetic)
+    if not clips:
+        raise SystemExit(f"No audio found in {args.recordings}")
+
+    generator = EmbeddingGenerator(build_model(args.model))
+    threshold, stream_threshold, progressive_threshold, report = evaluate(
+        generator, clips, args.margins, args.first_seconds, args.stream_window_seconds, args.threshold
+    )
+    print(f"whole recording threshold {threshold:.4f}, first piece {args.first_seconds:.1f}s")
+    print(f"VOICEREC_STREAM_THRESHOLD={stream_threshold:.4f} (same false accept rate for the mean of stream windows)")
+    print(f"VOICEREC_PROGRESSIVE_THRESHOLD={progressive_threshold:.4f} (same false accept rate for the mean of pieces)")
+    columns = list(report["whole"])
+    print(f"{'':>12}" + "".join(f"{column:>19}" for column in columns))
+    for name, row in report.items():
+        print(f"{name:>12}" + "".join(f"{row[column]:19.3f}" for column in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", help="folder of recordings, one subfolder per speaker")
+    parser.add_argument("--synthetic", type=int, default=8, help="synthetic speakers when no recordings are given")
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.01, 0.02, 0.05, 0.1])
+    parser.add_argument("--first-seconds", type=float, default=3.0, help="app.PROGRESSIVE_FIRST_SECONDS")
+    parser.add_argument("--stream-window-seconds", type=float, default=5.0, help="app.STREAM_WINDOW_SECONDS")
+    parser.add_argument("--threshold", type=float, help="acceptance threshold, by default the EER threshold of whole recordings")
+    main(parser.parse_args())
@@ -0,0 +1,49 @@
+"""Compares user record read + decode + score time for the legacy JSON format and the binary one.
+
+    python -m benchmarks.record_decode --iterations 20000
+"""
+import argparse
+import json
+import time
+
+import bcrypt
+import torch
+from torch.nn import CosineSimilarity
+
+from users import User
+
+
+def time_per_call(fn, iterations: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def main(args: argparse.Namespace) -> None:
+    user = User("benchmark", bcrypt.hashpw(b"password", bcrypt.gensalt(4)), torch.randn(1, args.dim))
+    probe = torch.randn(1, args.dim)
+
+    legacy_record = json.dumps(user.to_dict()).encode("utf-8")
+    cos_sim = CosineSimilarity(dim=1)
+
+    def legacy() -> float:
+        stored = User.from_dict(json.loads(legacy_record.decode("utf-8")))
+        return cos_sim(stored.embedding, probe).item()
+
+    results = {"legacy json": (len(legacy_record), time_per_call(legacy, args.iterations))}
+    for dtype in ("float32", "float16"):
+        record = user.to_bytes(dtype)
+        results[f"binary {dtype}"] = (len(record), time_per_call(lambda: User.from_bytes(record).score(probe), args.iterations))
+
+    baseline = results["legacy json"][1]
+    for name, (size, seconds) in results.items():
+        print(f"{name:>15}: {size:6d} bytes {seconds * 1e6:8.1f} us/record ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1000)
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+"""Time and parity of EmbeddingGenerator.embed_windows against embedding every window's slice.
+
+The recording is --speakers synthetic speakers of --speaker-seconds each, one
+after another at different levels. At each overlap (hop = window * (1 -
+overlap)) both approaches embed the same windows in batches of --batch-size:
+
+    naive    every window's slice of audio through generate_embeddings, so
+             the mel spectrogram of overlapping audio is computed again
+    windows  embed_windows, one spectrogram and strided views of it
+
+    python -m benchmarks.sliding_windows --model random --overlaps 0.5 0.75
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from benchmarks.common import build_model, describe, synthetic_speech, time_call
+from ml import EmbeddingGenerator
+
+
+def naive(generator: EmbeddingGenerator, wav: Tensor, starts: Tensor, window_samples: int, batch_size: int) -> Tensor:
+    slices = [wav[:, start : start + window_samples] for start in starts.tolist()]
+    return torch.cat([generator.generate_embeddings(slices[i : i + batch_size]) for i in range(0, len(slices), batch_size)])
+
+
+def main(args: argparse.Namespace) -> None:
+    torch.set_grad_enabled(False)
+    generator = EmbeddingGenerator(build_model(args.model))
+    hop = generator.model.feature_extractor.spec_layer.stride
+    wav = torch.cat(
+        [synthetic_speech(args.speaker_seconds, seed=seed) * (0.2 + 0.8 * seed / args.speakers) for seed in range(args.speakers)], dim=-1
+    )
+    print(f"{wav.shape[-1] / 44100:.0f}s recording, {args.window_seconds:.1f}s windows, batches of {args.batch_size}")
+
+    for overlap in args.overlaps:
+        hop_seconds = args.window_seconds * (1 - overlap)
+        embeddings, times = generator.embed_windows(wav, args.window_seconds, hop_seconds, args.batch_size)
+        # embed_windows rounds windows to whole frames, the naive slices use the same ones
+        starts = (times * 44100).round().long()
+        window_samples = int(args.window_seconds * 44100) // hop * hop
+        reference = naive(generator, wav, starts, window_samples, args.batch_size)
+        cosine = F.cosine_similarity(embeddings, reference)
+
+        naive_times = time_call(lambda: naive(generator, wav, starts, window_samples, args.batch_size), args.repeats)
+        window_times = time_call(lambda: generator.embed_windows(wav, args.window_seconds, hop_seconds, args.batch_size), args.repeats)
+        print(
+            f"overlap {overlap:.0%}, {len(starts)} windows every {hop_seconds:.2f}s: cosine to naive "
+            f"min {cosine.min().item():.6f} mean {cosine.mean().item():.7f}"
+        )
+        print(f"  naive   {describe(naive_times)}")
+        print(f"  windows {describe(window_times)}  {min(naive_times) / min(window_times):4.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--speakers", type=int, default=6)
+    parser.add_argument("--speaker-seconds", type=float, default=10.0)
+    parser.add_argument("--window-seconds", type=float, default=3.0)
+    parser.add_argument("--overlaps", type=float, nargs="+", default=[0.5, 0.75])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+"""Server-side body memory and handling latency: base64-in-JSON vs raw octet-stream uploads.
+
+The ASGI app is driven directly with a pre-built body so tracemalloc only sees
+what the server allocates while parsing it:
+
+    python -m benchmarks.upload_body --audio test.wav
+"""
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from litestar import Litestar, Request, post
+
+from app import CredentialData, decode_base64, read_upload
+
+CHUNK_BYTES = 64 * 1024
+
+
+@post("/json")
+async def json_upload(data: CredentialData) -> int:
+    audio_bytes = decode_base64(data.audio_data)
+    return len(audio_bytes or b"")
+
+
+@post("/raw", request_max_body_size=None)
+async def raw_upload(request: Request) -> int:
+    _, _, audio_bytes = await read_upload(request)
+    return len(audio_bytes or b"")
+
+
+bench_app = Litestar(route_handlers=[json_upload, raw_upload])
+
+
+async def call(path: str, body: bytes, headers: List[Tuple[bytes, bytes]]) -> None:
+    chunks = [body[i : i + CHUNK_BYTES] for i in range(0, len(body), CHUNK_BYTES)] or [b""]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] >= 300:
+            raise RuntimeError(f"{path} answered {message['status']}")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": headers + [(b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 8000), "state": {},
+    }
+    await bench_app(scope, receive, send)
+
+
+async def measure(path: str, body: bytes, headers: List[Tuple[bytes, bytes]], repeats: int) -> Tuple[float, float]:
+    await call(path, body, headers)
+    tracemalloc.start()
+    await call(path, body, headers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await call(path, body, headers)
+        timings.append(time.perf_counter() - started)
+    return peak, statistics.median(timings)
+
+
+async def main(args: argparse.Namespace) -> None:
+    audio = open(args.audio, "rb").read() * args.repeat_audio
+    json_body = json.dumps({"username": "bench", "password": "bench", "audio_data": base64.b64encode(audio).decode()}).encode()
+
+    cases = {
+        "json+base64": ("/json", json_body, [(b"content-type", b"application/json")]),
+        "octet-stream": ("/raw", audio, [(b"content-type", b"application/octet-stream"), (b"x-username", b"bench"), (b"x-password", b"bench")]),
+    }
+    print(f"audio payload: {len(audio) / 1024:.0f} KiB")
+    for name, (path, body, headers) in cases.items():
+        peak, median = await measure(path, body, headers, args.repeats)
+        print(f"{name:>13}: body {len(body) / 1024:7.0f} KiB  peak alloc {peak / 1024:7.0f} KiB  median {median * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", default="test.wav")
+    parser.add_argument("--repeat-audio", type=int, default=1, help="tile the file to emulate longer uploads")
+    parser.add_argument("--repeats", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""Compute saved by voice activity detection and its effect on verification scores.
+
+Every recording is embedded three ways: as recorded (clean), with
+--pad-seconds of quiet room noise added before and after it like the browser
+recorder leaves (padded), and padded then trimmed by the VAD (vad). For each
+the total embedding time, the cosine to the clean embedding, the EER over every
+pair of recordings and the false accept / false reject rates at --threshold
+are reported, plus the time the VAD itself took. Recordings are a folder with
+one subfolder per speaker; without one, synthetic speakers are used:
+
+    python -m benchmarks.vad --recordings recordings/ --model byol
+    python -m benchmarks.vad --synthetic 8 --model random
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from benchmarks.common import build_model, synthetic_speech
+from evaluation import equal_error_rate, error_rates, trial_scores
+from ml import EmbeddingGenerator
+from vad import NotEnoughSpeech, VoiceActivityDetector
+
+
+def pad(wav: Tensor, seconds: float, sample_rate: int = 44100, level: float = 1e-3, seed: int = 0) -> Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    noise = level * torch.randn(1, int(2 * seconds * sample_rate), generator=generator)
+    half = noise.shape[-1] // 2
+    return torch.cat([noise[:, :half], wav, noise[:, half:]], dim=-1)
+
+
+def embed_all(generator: EmbeddingGenerator, wavs: Sequence[Tensor]) -> Tuple[Tensor, float]:
+    """(clips, dim) embeddings one recording at a time, like logins, and the seconds it took"""
+    started = time.perf_counter()
+    embeddings = torch.cat([generator.generate_embeddings([wav]) for wav in wavs])
+    return embeddings, time.perf_counter() - started
+
+
+def evaluate(
+    generator: EmbeddingGenerator,
+    vad: VoiceActivityDetector,
+    clips: Sequence[Tuple[str, Tensor]],
+    pad_seconds: float,
+    threshold: float,
+) -> Dict[str, Dict[str, float]]:
+    speakers = [speaker for speaker, _ in clips]
+    clean = [wav for _, wav in clips]
+    padded = [pad(wav, pad_seconds, seed=i) for i, wav in enumerate(clean)]
+
+    started = time.perf_counter()
+    trimmed = []
+    for wav in padded:
+        try:
+            trimmed.append(vad(wav))
+        except NotEnoughSpeech as e:
+            print("Recording rejected:", e)
+            trimmed.append(wav)
+    vad_seconds = time.perf_counter() - started
+
+    generator.generate_embeddings([clean[0]])
+    report = {}
+    reference = None
+    for name, wavs in (("clean", clean), ("padded", padded), ("vad", trimmed)):
+        embeddings, elapsed = embed_all(generator, wavs)
+        reference = embeddings if reference is None else reference
+        cosine = F.cosine_similarity(embeddings, reference)
+        row = {
+            "audio_s": sum(wav.shape[-1] for wav in wavs) / 44100,
+            "embed_ms": elapsed * 1000,
+            "cos_clean_mean": cosine.mean().item(),
+            "cos_clean_min": cosine.min().item(),
+        }
+        if len(set(speakers)) > 1:
+            scores, labels = trial_scores(embeddings, speakers)
+            row["eer"], _ = equal_error_rate(scores, labels)
+            row["far"], row["frr"] = error_rates(scores, labels, threshold)
+            row["genuine"] = scores[labels].mean().item() if labels.any() else float("nan")
+            row["impostor"] = scores[~labels].mean().item()
+        report[name] = row
+    report["vad"]["vad_ms"] = vad_seconds * 1000
+    return report
+
+
+def synthetic_clips(speakers: int) -> List[Tuple[str, Tensor]]:
+    """Two recordings per synthetic speaker (a fixed pitch and timbre per seed), of different lengths"""
+    return [(f"speaker{seed}", synthetic_speech(seconds, seed=seed)) for seed in range(speakers) for seconds in (3.0, 4.5)]
+
+
+def main(args: argparse.Namespace) -> None:
+    torch.set_grad_enabled(False)
+    if args.recordings:
+        from ingest import AudioIngest
+        from quantization import load_audio_folder
+
+        clips = load_audio_folder(Path(args.recordings), AudioIngest(sample_rate=44100, max_seconds=15.0))
+    else:
+        clips = synthetic_clips(args.synthetic)
+    if not clips:
+        raise SystemExit(f"No audio found in {args.recordings}")
+
+    report = evaluate(EmbeddingGenerator(build_model(args.model)), VoiceActivityDetector(), clips, args.pad_seconds, args.threshold)
+    print(f"{len(clips)} recordings, {args.pad_seconds:.1f}s of room noise added on each side")
+    columns = list(report["clean"])
+    print(f"{'':>8}" + "".join(f"{column:>16}" for column in columns))
+    for name, row in report.items():
+        print(f"{name:>8}" + "".join(f"{row[column]:16.3f}" for column in columns))
+    saved = 1 - report["vad"]["embed_ms"] / report["padded"]["embed_ms"]
+    print(f"VAD took {report['vad']['vad_ms']:.1f} ms in total and saved {saved:.0%} of the padded embedding time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", help="folder of recordings, one subfolder per speaker")
+    parser.add_argument("--synthetic", type=int, default=8, help="synthetic speakers when no recordings are given")
+    parser.add_argument("--model", default="byol", help='checkpoint name, or "random" for untrained weights')
+    parser.add_argument("--pad-seconds", type=float, default=3.0)
+    parser.add_argument("--threshold", type=float, default=0.85, help="acceptance threshold, app.VOICE_SIMILARITY_THRESHOLD")
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+import torch
+import yaml
+from torch import Tensor
+
+from singer_identity.model import HF_SOURCE, IdentityEncoder
+from singer_identity.utils.fetch_pretrained import fetch
+
+BUNDLE_FORMAT = 1
+
+
+def content_hash(hparams: Dict[str, Any], state_dict: Dict[str, Tensor]) -> str:
+    """sha256 over the hyperparameters and every tensor's name, dtype, shape and bytes"""
+    digest = hashlib.sha256(json.dumps(hparams, sort_keys=True).encode())
+    for name in sorted(state_dict):
+        tensor = state_dict[name].detach().cpu().contiguous()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
+@contextmanager
+def _skip_init() -> Iterator[None]:
+    """Turn torch.nn.init into no-ops; on the meta device they still dispatch through Python decompositions"""
+    originals = {name: getattr(torch.nn.init, name) for name in dir(torch.nn.init) if name.endswith("_") and not name.startswith("_")}
+    for name in originals:
+        setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(torch.nn.init, name, fn)
+
+
+def pretrained_files(name: str, source: str = HF_SOURCE) -> Tuple[Path, Path]:
+    """(hyperparams.yaml, model.pt) of a published checkpoint, fetched into the same directory load_model uses"""
+    savedir = f"./pretrained_models/{IdentityEncoder.__name__}-{hashlib.md5(source.encode('UTF-8', errors='replace')).hexdigest()}"
+    return (
+        fetch(filename=f"{name}/hyperparams.yaml", source=source, savedir=savedir),
+        fetch(filename=f"{name}/model.pt", source=source, savedir=savedir),
+    )
+
+
+def write_bundle(hparams: Dict[str, Any], state_dict: Dict[str, Tensor], path: Path) -> str:
+    """Write hyperparameters, weights and their content hash to one file, atomically; returns the hash.
+
+    torch.save's zip format stores every tensor as an aligned, uncompressed
+    record, which is what lets load_bundle map the weights instead of reading them.
+    """
+    # the meta-device loader assigns tensors as is, so the keys have to match exactly
+    with torch.device("meta"):
+        IdentityEncoder(**hparams).load_state_dict(state_dict)
+    state_dict = {name: tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}
+    digest = content_hash(hparams, state_dict)
+    payload = {"format": BUNDLE_FORMAT, "hparams": hparams, "sha256": digest, "state_dict": state_dict}
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+        torch.save(payload, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return digest
+
+
+def bundle_pretrained(name: str, path: Path, source: str = HF_SOURCE) -> str:
+    hparams_path, weights_path = pretrained_files(name, source)
+    with open(hparams_path) as f:
+        hparams = yaml.safe_load(f)
+    return write_bundle(hparams, torch.load(weights_path, map_location="cpu", weights_only=True), path)
+
+
+def load_bundle(path: Path, verify: bool = False) -> IdentityEncoder:
+    """IdentityEncoder from a bundle without fetching anything or running weight init.
+
+    The module is built on the meta device with weight init turned off, so
+    constructing EfficientNet allocates and computes nothing, then the
+    memory-mapped weights are assigned in place of the meta tensors. Pages are
+    read from disk on first use and shared between processes that map the same
+    file. verify re-hashes every tensor, which reads the whole file.
+    """
+    payload = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)
+    if payload.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported model bundle format {payload.get('format')} in {path}")
+    if verify and content_hash(payload["hparams"], payload["state_dict"]) != payload["sha256"]:
+        raise ValueError(f"Model bundle {path} does not match its content hash")
+
+    with torch.device("meta"), _skip_init():
+        model = IdentityEncoder(**payload["hparams"])
+    model.load_state_dict(payload["state_dict"], assign=True)
+    print(f"Model loaded from {path} ({payload['sha256'][:12]})")
+    return model.eval()
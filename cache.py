@@ -0,0 +1,166 @@
+import ctypes
+import hashlib
+import math
+import mmap
+import multiprocessing
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+from litestar.stores.base import Store
+
+from metrics import timed
+from users import User
+
+# rough per-entry cost of the dataclass, tensor object and dict slot
+_ENTRY_OVERHEAD_BYTES = 512
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; no false negatives, about fp_rate false positives
+    while it holds fewer than capacity items (and gracefully more after that).
+
+    A shared filter keeps its bits in an anonymous shared mapping and
+    serializes adds with a process lock; created before forking, every worker
+    sees every other worker's adds.
+    """
+
+    def __init__(self, capacity: int = 100_000, fp_rate: float = 0.01, shared: bool = False):
+        self.num_bits = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        size = (self.num_bits + 7) // 8
+        self.shared = shared
+        self.bits = mmap.mmap(-1, size) if shared else bytearray(size)
+        self._count = multiprocessing.RawValue(ctypes.c_int64, 0) if shared else ctypes.c_int64(0)
+        # without it two workers setting bits in the same byte could lose one of them
+        self._lock = multiprocessing.Lock() if shared else nullcontext()
+
+    @property
+    def count(self) -> int:
+        return self._count.value
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str) -> None:
+        with self._lock:
+            for position in self._positions(item):
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self._count.value += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def _user_size(user: User) -> int:
+    return (
+        user.embedding.element_size() * user.embedding.nelement()
+        + len(user.password)
+        + len(user.username)
+        + _ENTRY_OVERHEAD_BYTES
+    )
+
+
+class UserCache:
+    """Read-through LRU cache of decoded users in front of the users store.
+
+    A Bloom filter of every known username answers lookups (get) for unknown
+    users without touching the store. The filter is built from the store directory at
+    startup and kept current by writes made through this cache, so it assumes
+    this process is the only writer, unless known is a shared filter handed to
+    every worker writing to the same store.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        max_bytes: int = 64 * 1024 * 1024,
+        bloom_capacity: int = 100_000,
+        known: Optional[BloomFilter] = None,
+    ):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.known = known if known is not None else BloomFilter(bloom_capacity)
+
+        self._users: "OrderedDict[str, User]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def _remember(self, user: User) -> None:
+        self._forget(user.username)
+        size = _user_size(user)
+        if size > self.max_bytes:
+            return
+        self._users[user.username] = user
+        self._sizes[user.username] = size
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            username, _ = self._users.popitem(last=False)
+            self.size_bytes -= self._sizes.pop(username)
+            self.evictions += 1
+
+    def _forget(self, username: str) -> None:
+        if username in self._users:
+            del self._users[username]
+            self.size_bytes -= self._sizes.pop(username)
+
+    async def exists(self, username: str) -> bool:
+        """Whether the store holds username, for signups, so the Bloom filter is not trusted
+
+        A filter that missed a write made outside this cache would let a signup
+        overwrite that user; only lookups, where a miss fails closed, use it.
+        """
+        if username in self._users:
+            return True
+        with timed("store_read"):
+            return await self.store.exists(username)
+
+    async def get(self, username: str) -> Optional[User]:
+        if username not in self.known:
+            self.negative_hits += 1
+            return None
+
+        user = self._users.get(username)
+        if user is not None:
+            self._users.move_to_end(username)
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        with timed("store_read"):
+            record = await self.store.get(username)
+        if record is None:
+            return None
+        user = User.from_record(record)
+        self._remember(user)
+        return user
+
+    async def set(self, user: User, record: bytes) -> None:
+        with timed("store_write"):
+            await self.store.set(user.username, record)
+        self.known.add(user.username)
+        # re-read the stored form so cached and uncached logins score identically
+        self._remember(User.from_record(record))
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._users),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "known_usernames": self.known.count,
+        }
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import os
+from pathlib import Path
+from typing import List, Optional
+
+
+def migrate(args: argparse.Namespace) -> None:
+    from users import migrate_store
+
+    migrated, skipped = asyncio.run(migrate_store(Path(args.database), dtype=args.dtype, dry_run=args.dry_run))
+    print(f"Migrated {migrated} records, skipped {skipped}" + (" (dry run)" if args.dry_run else ""))
+
+
+def quantize(args: argparse.Namespace) -> None:
+    import copy
+
+    from ingest import AudioIngest
+    from ml import EmbeddingGenerator
+    from quantization import compare_models, load_audio_folder, load_quantized_model, quantize_backbone, save_quantized_backbone
+    from singer_identity.model import IdentityEncoder, load_model
+
+    model = load_model(args.model)
+    if not isinstance(model, IdentityEncoder):
+        raise SystemExit("Model is not an IdentityEncoder")
+    ingest = AudioIngest(sample_rate=44100, max_seconds=args.max_seconds)
+    clips = load_audio_folder(Path(args.calibration), ingest)
+    if not clips:
+        raise SystemExit(f"No audio found in {args.calibration}")
+
+    reference = EmbeddingGenerator(model)
+    print(f"Calibrating on {len(clips)} clips")
+    save_quantized_backbone(quantize_backbone(reference, [wav for _, wav in clips], args.engine), Path(args.output), args.engine)
+    print(f"Wrote {args.output}")
+
+    eval_clips = load_audio_folder(Path(args.eval), ingest) if args.eval else clips
+    candidate = EmbeddingGenerator(load_quantized_model(copy.deepcopy(model), Path(args.output)))
+    report = compare_models(reference, candidate, eval_clips)
+    for key, value in report.items():
+        print(f"{key:>16}: {'n/a (one speaker)' if value is None else f'{value:.4f}'}")
+
+
+def export_onnx(args: argparse.Namespace) -> None:
+    from onnx_export import export_onnx as export
+    from singer_identity.model import IdentityEncoder, load_model
+
+    model = load_model(args.model)
+    if not isinstance(model, IdentityEncoder):
+        raise SystemExit("Model is not an IdentityEncoder")
+    export(model.eval(), Path(args.output), opset=args.opset)
+    print(f"Wrote {args.output}")
+
+
+def bundle(args: argparse.Namespace) -> None:
+    from bundle import bundle_pretrained, load_bundle
+
+    digest = bundle_pretrained(args.model, Path(args.output))
+    load_bundle(Path(args.output), verify=True)
+    print(f"Wrote {args.output}, sha256 {digest}")
+
+
+def serve(args: argparse.Namespace) -> None:
+    from prefork import serve as serve_prefork
+
+    serve_prefork(args.workers, args.host, args.port, threads=args.threads, log_level=args.log_level)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="voicerec")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="convert JSON user records to the binary format")
+    migrate_parser.add_argument("--database", default="database", help="FileStore directory holding user records")
+    migrate_parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    migrate_parser.add_argument("--dry-run", action="store_true")
+    migrate_parser.set_defaults(func=migrate)
+
+    quantize_parser = commands.add_parser("quantize", help="write an int8 encoder calibrated on local audio")
+    quantize_parser.add_argument("calibration", help="folder of recordings, one subfolder per speaker for the EER report")
+    quantize_parser.add_argument("--output", default="encoder-int8.pt")
+    quantize_parser.add_argument("--model", default="byol")
+    quantize_parser.add_argument("--eval", help="held-out folder for the drift/EER report, defaults to the calibration clips")
+    quantize_parser.add_argument("--engine", choices=["x86", "fbgemm", "qnnpack", "onednn"], default="x86")
+    quantize_parser.add_argument("--max-seconds", type=float, default=15.0)
+    quantize_parser.set_defaults(func=quantize)
+
+    export_parser = commands.add_parser("export-onnx", help="write the model as an ONNX graph for the onnx backend")
+    export_parser.add_argument("--output", default="encoder.onnx")
+    export_parser.add_argument("--model", default="byol")
+    export_parser.add_argument("--opset", type=int, default=17)
+    export_parser.set_defaults(func=export_onnx)
+
+    bundle_parser = commands.add_parser("bundle", help="write the model as one memory-mappable file for fast startup")
+    bundle_parser.add_argument("--output", default="voicerec-model.pt")
+    bundle_parser.add_argument("--model", default="byol")
+    bundle_parser.set_defaults(func=bundle)
+
+    serve_parser = commands.add_parser("serve", help="load the model once and fork pinned workers sharing its weights")
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--threads", type=int, help="torch threads per worker, defaults to its share of the cores")
+    serve_parser.add_argument("--log-level", default="info")
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from typing import Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+
+def trial_scores(embeddings: Tensor, speakers: Sequence[str]) -> Tuple[Tensor, Tensor]:
+    """Cosine scores and same-speaker labels for every pair of (clips, dim) embeddings"""
+    normalized = F.normalize(embeddings.float(), dim=-1)
+    first, second = torch.triu_indices(len(speakers), len(speakers), offset=1)
+    labels = torch.tensor([speakers[i] == speakers[j] for i, j in zip(first.tolist(), second.tolist())])
+    return (normalized[first] * normalized[second]).sum(dim=-1), labels
+
+
+def error_rates(scores: Tensor, labels: Tensor, threshold: float) -> Tuple[float, float]:
+    """(false accept rate, false reject rate) when accepting scores >= threshold"""
+    genuine, impostor = scores[labels], scores[~labels]
+    far = (impostor >= threshold).float().mean().item() if len(impostor) else 0.0
+    frr = (genuine < threshold).float().mean().item() if len(genuine) else 0.0
+    return far, frr
+
+
+def equal_error_rate(scores: Tensor, labels: Tensor) -> Tuple[float, float]:
+    """(EER, threshold) at the score where false accepts and false rejects are closest to equal"""
+    genuine_count = int(labels.sum())
+    impostor_count = len(labels) - genuine_count
+    if not genuine_count or not impostor_count:
+        return float("nan"), float("nan")
+
+    sorted_scores, order = torch.sort(scores.float())
+    genuine = labels[order].float()
+    # accepting scores >= sorted_scores[i] rejects exactly the trials sorted before i
+    rejected_genuine = torch.cumsum(genuine, 0) - genuine
+    rejected_impostor = torch.cumsum(1 - genuine, 0) - (1 - genuine)
+    frr = rejected_genuine / genuine_count
+    far = 1 - rejected_impostor / impostor_count
+    i = int(torch.argmin((far - frr).abs()))
+    return float(far[i] + frr[i]) / 2, float(sorted_scores[i])
+
+
+def threshold_at_far(scores: Tensor, labels: Tensor, far: float) -> float:
+    """Lowest threshold that accepts at most a far fraction of the impostor trials"""
+    impostor = torch.sort(scores[~labels].float(), descending=True).values
+    accepted = int(far * len(impostor))
+    if accepted >= len(impostor):
+        return float(impostor[-1])
+    # just above the first impostor score that has to be rejected
+    return float(torch.nextafter(impostor[accepted], torch.tensor(float("inf"))))
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import torch
+
+from metrics import timed
+
+T = TypeVar("T")
+
+# stages that touch the in-process model always run on their own threads
+INFERENCE_STAGES = {"inference"}
+# stages that use state living in this process never go to a process pool
+STATEFUL_STAGES = {"stream_decode", "identify", "model_load"}
+
+
+def _init_worker(torch_threads: int) -> None:
+    torch.set_num_threads(torch_threads)
+
+
+def available_cpus() -> int:
+    """Cores this process may run on, which is fewer than os.cpu_count() when it is pinned"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ExecutionLayer:
+    """Runs CPU-bound request stages off the event loop.
+
+    kind selects a "thread" or "process" pool for the decode and bcrypt stages.
+    Model inference always runs on a thread because the weights live in this
+    process, and so do stateful stages such as incremental stream decoding.
+    stage_limits caps how many calls of each stage may be in flight at once;
+    unlisted stages are only bounded by the pool size.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: Optional[int] = None,
+        stage_limits: Optional[Dict[str, int]] = None,
+        inference_threads: Optional[int] = None,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+
+        cpus = available_cpus()
+        self.kind = kind
+        self.workers = workers or cpus
+        self.stage_limits = dict(stage_limits or {})
+        # whatever the inference stage may run concurrently shares the cores between its forwards
+        self.inference_threads = inference_threads or max(1, cpus // self.stage_limits.get("inference", 1))
+
+        self._pool: Optional[Executor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._inference_pool: Optional[ThreadPoolExecutor] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        # calls per stage that are queued or running right now
+        self.in_flight: Dict[str, int] = {}
+
+    def start(self) -> None:
+        torch.set_num_threads(self.inference_threads)
+        self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu-stage")
+        if self.kind == "process":
+            # workers only run small ops, one intra-op thread each keeps them from fighting
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(1,))
+        else:
+            self._pool = self._threads
+        self._inference_pool = ThreadPoolExecutor(
+            self.stage_limits.get("inference", 1), thread_name_prefix="inference"
+        )
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.stage_limits.items()}
+
+    def shutdown(self) -> None:
+        for pool in {self._pool, self._threads, self._inference_pool}:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._threads = None
+        self._inference_pool = None
+
+    async def run(self, stage: str, fn: Callable[..., T], *args: Any) -> T:
+        """Run fn(*args) for the given stage on its pool and await the result"""
+        if stage in INFERENCE_STAGES:
+            pool = self._inference_pool
+        elif stage in STATEFUL_STAGES:
+            pool = self._threads
+        else:
+            pool = self._pool
+        if pool is None:
+            raise RuntimeError("ExecutionLayer has not been started")
+
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(stage)
+        self.in_flight[stage] = self.in_flight.get(stage, 0) + 1
+        try:
+            with timed(stage):
+                if semaphore is None:
+                    return await loop.run_in_executor(pool, fn, *args)
+                async with semaphore:
+                    return await loop.run_in_executor(pool, fn, *args)
+        finally:
+            self.in_flight[stage] -= 1
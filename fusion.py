@@ -0,0 +1,141 @@
+import copy
+from typing import Dict, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torchvision.ops.misc import Conv2dNormActivation
+
+from singer_identity.model import FeatureExtractor, IdentityEncoder
+from singer_identity.models.network_components import supports_masking
+
+
+class FusedLogMel(nn.Module):
+    """nnAudio's log mel spectrogram in fewer, cheaper steps.
+
+    The STFT runs as an FFT (torch.stft with the window nnAudio bakes into its
+    kernels) instead of a convolution with a 2048-tap kernel per frequency bin,
+    the power spectrum skips the square root that power=2 undoes, frequency
+    bins no mel filter uses are dropped, and LogScale's log(x + 1e-8) is applied
+    to the mel output with a constant eps.
+    """
+
+    def __init__(self, feature_extractor: FeatureExtractor, eps: float = 1e-8):
+        super().__init__()
+        spec_layer = feature_extractor.spec_layer
+        stft = spec_layer.stft
+        if not stft.center or stft.pad_mode != "reflect":
+            raise NotImplementedError("Only centered, reflect padded spectrograms can be fused")
+        self.n_fft = stft.n_fft
+        self.hop_length = stft.stride
+        self.power = spec_layer.power
+        self.eps = eps
+        # the cosine kernel of the DC bin is the analysis window itself
+        self.register_buffer("window", stft.wcos[0, 0].detach().clone())
+        used = spec_layer.mel_basis.abs().sum(dim=0) > 0
+        self.bins = int(used.nonzero().max()) + 1
+        self.register_buffer("mel_basis", spec_layer.mel_basis[:, : self.bins].detach().clone())
+
+    def forward(self, wav: Tensor) -> Tensor:
+        """(batch, samples) audio to (batch, mels, frames) log mel spectrograms"""
+        spec = torch.stft(
+            wav, self.n_fft, self.hop_length, window=self.window, center=True, pad_mode="reflect", return_complex=True
+        )[:, : self.bins]
+        power = spec.real.pow(2) + spec.imag.pow(2)
+        if self.power != 2:
+            power = power.pow(self.power / 2)
+        return torch.log(torch.matmul(self.mel_basis, power) + self.eps)
+
+
+class FusedStem(nn.Module):
+    """Grey2Rgb's per-sample scaling, channel replication and ImageNet normalization folded
+    into the first EfficientNet convolution and its BatchNorm.
+
+    Three normalized copies of x make conv(x, sum_c W_c / std_c) minus
+    conv(1, sum_c W_c * mean_c / std_c), where the second term is over a ones
+    image with the same zero padding, so it is a bias map that differs at the
+    borders where the padding replaces normalized values. The per-sample scale
+    is linear and applied after the convolution, and the BatchNorm affine goes
+    into the weights and bias.
+    """
+
+    # one bias map per input length; request lengths vary, so old ones are dropped past this many
+    MAX_CACHED_SIZES = 64
+
+    def __init__(self, grey2rgb: nn.Module, stem: Conv2dNormActivation):
+        super().__init__()
+        conv, bn, self.activation = stem
+        mean = conv.weight.new_tensor(grey2rgb.normalize.mean).view(1, -1, 1, 1)
+        std = conv.weight.new_tensor(grey2rgb.normalize.std).view(1, -1, 1, 1)
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        bias = bn.bias - bn.running_mean * scale
+        if conv.bias is not None:
+            bias = bias + conv.bias * scale
+        weight = conv.weight.detach() * scale.detach().view(-1, 1, 1, 1)
+        self.stride, self.padding = conv.stride, conv.padding
+        self.register_buffer("weight", (weight / std).sum(dim=1, keepdim=True))
+        self.register_buffer("offset", -(weight * mean / std).sum(dim=1, keepdim=True))
+        self.register_buffer("bias", bias.detach().view(1, -1, 1, 1))
+        self._bias_maps: Dict[Tuple[Tuple[int, ...], torch.device, torch.dtype], Tensor] = {}
+
+    def bias_map(self, x: Tensor) -> Tensor:
+        """Normalization offset and bias for inputs shaped like x, cached per input size"""
+        key = (tuple(x.shape[2:]), x.device, x.dtype)
+        bias_map = self._bias_maps.get(key)
+        if bias_map is None:
+            if len(self._bias_maps) >= self.MAX_CACHED_SIZES:
+                self._bias_maps.clear()
+            ones = x.new_ones(1, 1, *x.shape[2:])
+            bias_map = F.conv2d(ones, self.offset, stride=self.stride, padding=self.padding) + self.bias
+            self._bias_maps[key] = bias_map
+        return bias_map
+
+    def forward(self, spec: Tensor, scale: Tensor) -> Tensor:
+        """(batch, mels, frames) log mel spectrograms, each multiplied by scale[i] first"""
+        x = spec.unsqueeze(1)
+        out = F.conv2d(x, self.weight, stride=self.stride, padding=self.padding)
+        return self.activation(torch.addcmul(self.bias_map(x), out, scale.view(-1, 1, 1, 1)))
+
+
+class FusedEncoder(nn.Module):
+    """Inference-only IdentityEncoder, (batch, samples) peak-normalized audio to (batch, dim)
+    embeddings, computing what backends.BatchEmbedder does (every clip scaled by its own max)"""
+
+    def __init__(self, model: IdentityEncoder):
+        super().__init__()
+        _, grey2rgb, backbone = model.encoder.net
+        self.log_mel = FusedLogMel(model.feature_extractor)
+        self.stem = FusedStem(grey2rgb, backbone.features[0])
+        self.blocks = fold_batch_norms(copy.deepcopy(backbone.features[1:]))
+        self.avgpool = copy.deepcopy(backbone.avgpool)
+        self.classifier = copy.deepcopy(backbone.classifier)
+
+    def forward(self, wav: Tensor) -> Tensor:
+        spec = self.log_mel(wav)
+        x = self.stem(spec, 1 / spec.amax(dim=(1, 2)))
+        return self.classifier(torch.flatten(self.avgpool(self.blocks(x)), 1))
+
+
+def fold_batch_norms(module: nn.Module) -> nn.Module:
+    """Fold the BatchNorm of every conv-norm-activation block into its convolution, in place"""
+    for block in module.modules():
+        if isinstance(block, Conv2dNormActivation) and isinstance(block[1], nn.BatchNorm2d):
+            block[0] = fuse_conv_bn_eval(block[0], block[1])
+            block[1] = nn.Identity()
+    return module
+
+
+def fuse_for_inference(model: IdentityEncoder) -> FusedEncoder:
+    """FusedEncoder for an eval-mode float model; the model itself is left untouched"""
+    if model.training:
+        raise ValueError("Only eval mode models can be fused, BatchNorm statistics would be frozen")
+    if not supports_masking(model.encoder.net[2]):
+        raise ValueError("Only float EfficientNet backbones can be fused")
+    with torch.no_grad():
+        return FusedEncoder(model).eval()
+
+
+def state_nbytes(module: nn.Module) -> int:
+    return sum(tensor.numel() * tensor.element_size() for tensor in module.state_dict().values())
+
@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+
+class EmbeddingMatrix:
+    """Every enrolled user's centroid embedding as one contiguous, L2-normalized matrix.
+
+    Rows are appended in place into a buffer that doubles when full, so enrollment
+    never rebuilds the matrix. A query is scored against blocks of block_rows rows
+    at a time and only each block's top-k is kept, so the scores of every user are
+    never held at once.
+    """
+
+    def __init__(self, dtype: torch.dtype = torch.float16, block_rows: int = 65536, initial_capacity: int = 1024):
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.initial_capacity = initial_capacity
+
+        self.usernames: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[Tensor] = None
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self._matrix is None else self._matrix.element_size() * self._matrix.nelement()
+
+    def _reserve(self, rows: int, dim: int) -> Tensor:
+        if self._matrix is None:
+            self._matrix = torch.empty(max(rows, self.initial_capacity), dim, dtype=self.dtype)
+        elif rows > self._matrix.shape[0]:
+            grown = torch.empty(max(rows, 2 * self._matrix.shape[0]), dim, dtype=self.dtype)
+            grown[: len(self)] = self._matrix[: len(self)]
+            self._matrix = grown
+        return self._matrix
+
+    def add(self, username: str, embedding: Tensor) -> None:
+        """Insert or replace a user; embedding is a (dim,) vector or a (rows, dim) template whose row 0 is the centroid"""
+        self.add_many([username], embedding.reshape(-1, embedding.shape[-1])[:1])
+
+    def add_many(self, usernames: Sequence[str], embeddings: Tensor) -> None:
+        """Insert or replace users from a (len(usernames), dim) tensor"""
+        embeddings = F.normalize(embeddings.detach().cpu().float(), dim=-1).to(self.dtype)
+        rows: List[int] = []
+        added: Dict[str, int] = {}
+        for username in usernames:
+            row = self._rows.get(username, added.get(username))
+            if row is None:
+                row = added[username] = len(self.usernames) + len(added)
+            rows.append(row)
+        matrix = self._reserve(len(self) + len(added), embeddings.shape[-1])
+        for row, embedding in zip(rows, embeddings):
+            matrix[row] = embedding
+        # usernames are registered only once their rows are written, so a search that
+        # counts a new user never reads its row before it is filled in
+        for username, row in added.items():
+            self._rows[username] = row
+            self.usernames.append(username)
+
+    def snapshot(self) -> Tuple[List[str], Tensor]:
+        """The usernames and (users, dim) rows enrolled so far, unaffected by later appends"""
+        size, matrix = len(self), self._matrix
+        if matrix is None:
+            return [], torch.empty(0, 0, dtype=self.dtype)
+        return self.usernames[:size], matrix[:size]
+
+    def similarity(self, username: str, embedding: Tensor) -> Optional[float]:
+        """Exact cosine similarity between a query and one user's row, None for unknown users"""
+        row = self._rows.get(username)
+        if row is None or self._matrix is None:
+            return None
+        probe = F.normalize(embedding.reshape(-1).float(), dim=0)
+        return float(torch.dot(self._matrix[row].float(), probe))
+
+    def search(self, embedding: Tensor, k: int = 5) -> List[Tuple[str, float]]:
+        """Top-k (username, cosine similarity) pairs for a query embedding, best first"""
+        # size and matrix are read once, rows appended while this runs are simply not seen
+        size, matrix = len(self), self._matrix
+        if size == 0 or matrix is None or k <= 0:
+            return []
+        probe = F.normalize(embedding.reshape(-1).float(), dim=0).to(self.dtype)
+
+        best_scores: List[Tensor] = []
+        best_rows: List[Tensor] = []
+        for start in range(0, size, self.block_rows):
+            scores = torch.mv(matrix[start : min(start + self.block_rows, size)], probe)
+            top = torch.topk(scores.float(), min(k, scores.shape[0]))
+            best_scores.append(top.values)
+            best_rows.append(top.indices + start)
+
+        scores, rows = torch.cat(best_scores), torch.cat(best_rows)
+        top = torch.topk(scores, min(k, scores.shape[0]))
+        return [(self.usernames[int(row)], float(score)) for score, row in zip(top.values, rows[top.indices])]
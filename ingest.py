@@ -0,0 +1,98 @@
+import functools
+from typing import Optional, Union
+
+import torch
+import torchaudio.transforms as T
+from torch import Tensor
+from torchcodec.decoders import AudioDecoder
+
+
+@functools.lru_cache(maxsize=16)
+def get_resampler(orig_freq: int, new_freq: int) -> T.Resample:
+    """Resample modules keyed by rate pair, so the sinc kernel is only built once"""
+    return T.Resample(orig_freq=orig_freq, new_freq=new_freq)
+
+
+def resample(wav: Tensor, sample_rate: int, target_rate: int = 44100) -> Tensor:
+    if sample_rate == target_rate:
+        return wav
+    return get_resampler(sample_rate, target_rate)(wav)
+
+
+class AudioIngest:
+    """Turns an encoded recording (webm, wav, ...) into a mono waveform at sample_rate.
+
+    Downmixing and resampling are requested from the decoder itself, so FFmpeg does
+    them while decoding. Decoding stops after max_seconds so oversized uploads cost
+    no more than a capped one.
+    """
+
+    def __init__(self, sample_rate: int = 44100, max_seconds: Optional[float] = 15.0):
+        self.sample_rate = sample_rate
+        self.max_seconds = max_seconds
+
+    def __call__(self, audio_bytes: Union[bytes, bytearray]) -> Tensor:
+        """Returns a (1, samples) tensor"""
+        # a bytearray upload buffer is wrapped, not copied
+        source = torch.frombuffer(audio_bytes, dtype=torch.uint8) if isinstance(audio_bytes, bytearray) else audio_bytes
+        audio_decoder = AudioDecoder(source=source, sample_rate=self.sample_rate, num_channels=1)
+        samples = audio_decoder.get_samples_played_in_range(0.0, self.max_seconds)
+        # the decoder already hands back one contiguous tensor, no need to copy it again
+        wav = samples.data
+        if samples.sample_rate != self.sample_rate:
+            wav = resample(wav, samples.sample_rate, self.sample_rate)
+        return wav
+
+
+class StreamingDecoder:
+    """Decodes a recording that arrives in pieces, e.g. MediaRecorder chunks.
+
+    Only the first chunk of a MediaRecorder stream carries the container header,
+    so every feed re-opens the whole buffer (wrapped, not copied) but only
+    decodes the audio after the samples already handed out. The work per feed
+    grows with the buffer, which the caller caps. A buffer that fails to decode
+    is usually a chunk ending part way through a cluster, but one that still
+    fails after max_failures more chunks is corrupt, and the error is raised.
+    """
+
+    def __init__(self, sample_rate: int = 44100, max_seconds: Optional[float] = 15.0, max_failures: int = 4):
+        self.sample_rate = sample_rate
+        self.max_samples = int(max_seconds * sample_rate) if max_seconds is not None else None
+        self.max_failures = max_failures
+        self.buffer = bytearray()
+        self.emitted = 0
+        self.failures = 0
+
+    @property
+    def done(self) -> bool:
+        return self.max_samples is not None and self.emitted >= self.max_samples
+
+    def _decode(self) -> Tensor:
+        audio_decoder = AudioDecoder(
+            source=torch.frombuffer(self.buffer, dtype=torch.uint8), sample_rate=self.sample_rate, num_channels=1
+        )
+        wav = audio_decoder.get_samples_played_in_range(self.emitted / self.sample_rate).data
+        if self.max_samples is not None:
+            wav = wav[:, : self.max_samples - self.emitted]
+        self.emitted += wav.shape[-1]
+        self.failures = 0
+        return wav
+
+    def feed(self, chunk: bytes) -> Tensor:
+        """Append a chunk and return the (1, samples) audio decoded since the previous call"""
+        self.buffer.extend(chunk)
+        if self.done or not self.buffer:
+            return torch.zeros(1, 0)
+        try:
+            return self._decode()
+        except Exception:
+            self.failures += 1
+            if self.failures > self.max_failures:
+                raise
+            return torch.zeros(1, 0)
+
+    def finish(self) -> Tensor:
+        """The (1, samples) audio the last chunks completed; raises if the whole recording does not decode"""
+        if self.done or not self.failures:
+            return torch.zeros(1, 0)
+        return self._decode()
@@ -0,0 +1,165 @@
+import bisect
+import functools
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+AUDIO_SECONDS_BUCKETS = (0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 10.0, 15.0, 20.0, 30.0, 60.0)
+FRACTION_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+GaugeValue = Union[float, Dict[str, float]]
+T = TypeVar("T")
+
+
+def _labels(label: Optional[str], value: str, extra: str = "") -> str:
+    pairs = [f'{label}="{value}"'] if label else []
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by one label, safe to observe from any thread"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        # label value -> (per-bucket counts with a trailing +Inf slot, [sum, count])
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][slot] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), list(totals)) for key, (counts, totals) in self._series.items()}
+        for label_value, (counts, (total, count)) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label, label_value, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, label_value)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label, label_value)} {int(count)}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback returns a number or {label value: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], GaugeValue], label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}:", e)
+            return lines
+        if isinstance(value, dict):
+            lines.extend(f"{self.name}{_labels(self.label, key)} {float(v)}" for key, v in sorted(value.items()))
+        else:
+            lines.append(f"{self.name} {float(value)}")
+        return lines
+
+
+class Counter(Gauge):
+    """Monotonic total read from a callback at scrape time"""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[Histogram, Gauge]] = {}
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float], label: Optional[str] = None) -> Histogram:
+        histogram = Histogram(name, help, buckets, label)
+        self._metrics[name] = histogram
+        return histogram
+
+    def gauge(self, name: str, help: str, fn: Callable[[], GaugeValue], label: Optional[str] = None) -> Gauge:
+        """Register a gauge, replacing any earlier one with the same name (e.g. after a restart of the app)"""
+        gauge = Gauge(name, help, fn, label)
+        self._metrics[name] = gauge
+        return gauge
+
+    def counter(self, name: str, help: str, fn: Callable[[], GaugeValue], label: Optional[str] = None) -> Counter:
+        counter = Counter(name, help, fn, label)
+        self._metrics[name] = counter
+        return counter
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format"""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+def rss_bytes() -> int:
+    """Current resident set size, or the peak where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "voicerec_stage_seconds", "Wall time of each serving stage, including waiting for its pool", LATENCY_BUCKETS, "stage"
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "voicerec_request_seconds", "Wall time of each authentication request", LATENCY_BUCKETS, "endpoint"
+)
+AUDIO_SECONDS = REGISTRY.histogram(
+    "voicerec_audio_seconds", "Duration of decoded input audio", AUDIO_SECONDS_BUCKETS
+)
+VOICED_SECONDS = REGISTRY.histogram(
+    "voicerec_voiced_seconds", "Duration of input audio left after voice activity detection", AUDIO_SECONDS_BUCKETS
+)
+LOGIN_AUDIO_FRACTION = REGISTRY.histogram(
+    "voicerec_login_audio_fraction", "Audio embedded by progressive verification as a fraction of the login recording", FRACTION_BUCKETS
+)
+REGISTRY.gauge("voicerec_resident_memory_bytes", "Resident set size of this process", rss_bytes)
+
+
+@contextmanager
+def timed(label_value: str, histogram: Histogram = STAGE_SECONDS) -> Iterator[None]:
+    """Observe the wall time of the block, by default as a stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, label_value)
+
+
+def timed_request(endpoint: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorate a coroutine so every call is observed in REQUEST_SECONDS under endpoint"""
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with timed(endpoint, REQUEST_SECONDS):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
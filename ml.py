@@ -1,26 +1,270 @@
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
 from torch import Tensor
 import torch
+import torch.nn.functional as F
 from torch.nn.modules import Module
-from singer_identity.model import IdentityEncoder
+from singer_identity.model import FeatureExtractor, IdentityEncoder
+from singer_identity.models.network_components import Grey2Rgb
+
+from backends import build_backend, model_device
+from metrics import timed
+
+class RunningMean:
+    """Streaming (optionally weighted) mean of L2-normalized embeddings"""
+
+    def __init__(self):
+        self.value: Optional[Tensor] = None
+        self.count = 0
+        self.total_weight = 0.0
+
+    def add(self, embedding: Tensor, weight: float = 1.0) -> None:
+        if weight <= 0:
+            return
+        embedding = F.normalize(embedding.float(), dim=-1)
+        self.count += 1
+        self.total_weight += weight
+        if self.value is None:
+            self.value = embedding
+        else:
+            self.value = self.value + (embedding - self.value) * (weight / self.total_weight)
 
 class EmbeddingGenerator:
-    def __init__(self, model: IdentityEncoder):
-        self.device = next(model.parameters()).device
+    def __init__(self, model: IdentityEncoder, backend: str = "eager", onnx_path: Optional[Path] = None):
+        self.device = model_device(model)
         self.model = model.to(self.device)
         # set model to evaluation mode
         # basically just prevents self-training
         self.model.eval()
+        self.grey2rgb = Grey2Rgb(per_sample=True)
+        self.forwards = 0
+        # batched inference goes through the selected backend, eager keeps the per-stage timings
+        self.backend = backend
+        self.embedder = None if backend == "eager" else build_backend(self.model, backend, onnx_path=onnx_path)
 
     def generate_embedding(self, wav: Tensor, projecting:bool=False) -> Tensor:
         wav = self.normalize_audio(wav)
 
         with torch.no_grad():
-            features: Tensor = self.model.encoder(self.model.feature_extractor(wav))
+            with timed("feature_extractor"):
+                spec = self.model.feature_extractor(wav)
+            with timed("encoder"):
+                features: Tensor = self.model.encoder(spec)
+            self.forwards += 1
             if projecting:
                 features = self.project_features(features)
 
         return features
 
+    def generate_embeddings(self, wavs: List[Tensor], projecting:bool=False) -> Tensor:
+        # zero pad every waveform to the longest one so they share a single forward pass
+        normalized = [self.normalize_audio(wav) for wav in wavs]
+        lengths = [wav.shape[-1] for wav in normalized]
+        batch = torch.zeros(len(normalized), max(lengths), device=self.device)
+        for i, wav in enumerate(normalized):
+            batch[i, : wav.shape[-1]] = wav
+
+        with torch.no_grad():
+            if len(set(lengths)) > 1 and self.supports_masking:
+                # the padding must not reach the pooled embedding of the shorter clips
+                features: Tensor = self.embed_masked(batch, torch.tensor(lengths, device=self.device))
+            elif len(set(lengths)) > 1:
+                # backends that cannot mask would pool the padding in, so every length gets its own forward pass
+                rows: List[Optional[Tensor]] = [None] * len(lengths)
+                for length in sorted(set(lengths)):
+                    members = [i for i, other in enumerate(lengths) if other == length]
+                    for i, row in zip(members, self.embed_batch(batch[members, :length])):
+                        rows[i] = row
+                features = torch.stack(rows)
+            else:
+                features = self.embed_batch(batch)
+            if projecting:
+                features = self.project_features(features)
+
+        return features
+
+    def generate_embeddings_bucketed(
+        self, wavs: Sequence[Tensor], bucket_seconds: float = 2.0, max_batch_size: int = 16, sample_rate: int = 44100
+    ) -> Tensor:
+        """(clips, dim) embeddings of many clips of mixed lengths, in their order.
+
+        Clips are sorted by length and batched with clips at most bucket_seconds
+        longer, so little of each forward pass goes into padding.
+        """
+        order = sorted(range(len(wavs)), key=lambda i: wavs[i].shape[-1])
+        embeddings: List[Optional[Tensor]] = [None] * len(wavs)
+        batches: List[List[int]] = []
+        for i in order:
+            if not batches or len(batches[-1]) == max_batch_size or (
+                wavs[i].shape[-1] - wavs[batches[-1][0]].shape[-1] > bucket_seconds * sample_rate
+            ):
+                batches.append([])
+            batches[-1].append(i)
+        for batch in batches:
+            for i, embedding in zip(batch, self.generate_embeddings([wavs[i] for i in batch])):
+                embeddings[i] = embedding.unsqueeze(0)
+        return torch.cat(embeddings)
+
+    def generate_embedding_chunked(
+        self,
+        wav: Tensor,
+        window_seconds: float = 5.0,
+        overlap_seconds: float = 0.0,
+        batch_size: int = 4,
+        weighting: str = "mean",
+        min_tail_seconds: float = 1.0,
+        sample_rate: int = 44100,
+    ) -> Tensor:
+        # embeds fixed windows a few at a time so peak memory does not grow with clip length
+        # weighting="energy" weights each window by its mean square amplitude
+        wav = self.normalize_audio(wav)
+        window = int(window_seconds * sample_rate)
+        hop = window - int(overlap_seconds * sample_rate)
+        if hop <= 0:
+            raise ValueError("overlap_seconds must be shorter than window_seconds")
+
+        if wav.shape[-1] <= window:
+            windows, tail = wav.unsqueeze(0), wav[:0]
+        else:
+            # a view, nothing is copied until a batch of windows is stacked
+            windows = wav.unfold(0, window, hop)
+            tail = wav[(windows.shape[0] - 1) * hop + window :]
+
+        batches = [windows[start : start + batch_size] for start in range(0, windows.shape[0], batch_size)]
+        if tail.shape[-1] >= min_tail_seconds * sample_rate:
+            batches.append(tail.unsqueeze(0))
+
+        mean = RunningMean()
+        with torch.no_grad():
+            for batch in batches:
+                features = self.embed_batch(batch.contiguous())
+                weights = batch.pow(2).mean(dim=-1) if weighting == "energy" else torch.ones(batch.shape[0])
+                for embedding, weight in zip(features, weights.tolist()):
+                    mean.add(embedding.unsqueeze(0), weight)
+
+        if mean.value is None:
+            # every window was silent, fall back to an unweighted mean
+            return self.generate_embedding_chunked(
+                wav.unsqueeze(0), window_seconds, overlap_seconds, batch_size, "mean", min_tail_seconds, sample_rate
+            )
+        return mean.value
+
+    def embed_windows(
+        self,
+        wav: Tensor,
+        window_seconds: float,
+        hop_seconds: float,
+        batch_size: int = 8,
+        sample_rate: int = 44100,
+    ) -> Tuple[Tensor, Tensor]:
+        """(windows, dim) embeddings of window_seconds windows every hop_seconds, and each window's start in seconds.
+
+        The mel spectrogram of the whole recording is computed once and every
+        window is a strided view of it, scaled as if its slice of audio had been
+        peak normalized on its own. Only the frames at either edge of a window,
+        whose STFT frames reach past the slice, are recomputed from a few
+        thousand samples with the slice's own reflection padding, so each row
+        matches embedding that slice alone. Window and hop are rounded to whole
+        spectrogram frames, and a last window is added flush with the end if the
+        hop does not land there. Always runs the eager encoder.
+        """
+        feature_extractor = self.model.feature_extractor
+        spec_layer = feature_extractor.spec_layer
+        hop, pad = spec_layer.stride, spec_layer.stft.pad_amount
+        # frames whose STFT window reaches past a slice edge, and the audio that decides them
+        edge = -(-pad // hop)
+        edge_samples = -(-((edge - 1) * hop + pad) // hop) * hop
+        wav = self.normalize_audio(wav)
+        window_frames = int(window_seconds * sample_rate) // hop + 1
+        hop_frames = max(1, round(hop_seconds * sample_rate / hop))
+        if (window_frames - 1) * hop < 2 * edge_samples:
+            raise ValueError(f"window_seconds must be at least {2 * edge_samples / sample_rate:.3f}s")
+
+        with torch.no_grad():
+            with timed("feature_extractor"):
+                spec = feature_extractor(wav.unsqueeze(0))[0]
+            frames = spec.shape[-1]
+            if frames <= window_frames:
+                # one window over everything is exactly the recording on its own
+                return self.encode_batch(spec.unsqueeze(0)), torch.zeros(1)
+
+            window_samples = (window_frames - 1) * hop
+            # (windows, mels, window_frames) and (windows, window_samples) views, nothing is copied
+            windows = spec.unfold(-1, window_frames, hop_frames).transpose(0, 1)
+            slices = wav.unfold(0, window_samples, hop_frames * hop)[: windows.shape[0]]
+            starts = torch.arange(windows.shape[0]) * hop_frames
+            if starts[-1] + window_frames < frames:
+                last = frames - window_frames
+                windows = torch.cat([windows, spec[:, last:].unsqueeze(0)])
+                slices = torch.cat([slices, wav[last * hop : last * hop + window_samples].unsqueeze(0)])
+                starts = torch.cat([starts, torch.tensor([last])])
+
+            with timed("feature_extractor"):
+                edges = feature_extractor(torch.cat([slices[:, :edge_samples], slices[:, -edge_samples:]]))
+            heads, tails = edges[: len(slices), :, :edge], edges[len(slices) :, :, -edge:]
+            # peak normalizing a slice by p scales its power spectrogram by p ** power
+            gains = slices.abs().amax(dim=-1).pow(-spec_layer.power).view(-1, 1, 1)
+
+            embeddings = []
+            for start in range(0, windows.shape[0], batch_size):
+                batch = windows[start : start + batch_size].clone()
+                batch[:, :, :edge] = heads[start : start + batch_size]
+                batch[:, :, -edge:] = tails[start : start + batch_size]
+                embeddings.append(self.encode_batch(batch * gains[start : start + batch_size]))
+        return torch.cat(embeddings), starts * hop / sample_rate
+
+    def embed_batch(self, batch: Tensor) -> Tensor:
+        """(batch, samples) normalized audio to (batch, dim) embeddings with the selected backend"""
+        if self.embedder is None:
+            with timed("feature_extractor"):
+                spec = self.model.feature_extractor(batch)
+            return self.encode_batch(spec)
+        with timed("forward"):
+            features = self.embedder(batch)
+        self.forwards += 1
+        return features
+
+    @property
+    def supports_masking(self) -> bool:
+        """Whether clips of different lengths can share an exact forward pass (eager, float, 44.1 kHz input)"""
+        return (
+            self.embedder is None
+            and isinstance(self.model.feature_extractor, FeatureExtractor)
+            and self.model.encoder.supports_masking
+        )
+
+    def embed_masked(self, batch: Tensor, lengths: Tensor) -> Tensor:
+        """(batch, samples) normalized audio, zero past lengths, to the (batch, dim) embeddings each clip gets alone"""
+        with timed("feature_extractor"):
+            spec, frames = self.model.feature_extractor.forward_masked(batch, lengths)
+        with timed("encoder"):
+            features = self.model.encoder.forward_masked(spec, frames)
+        self.forwards += 1
+        return features
+
+    def warm_up(self, lengths_seconds: Sequence[float], batch_sizes: Sequence[int], sample_rate: int = 44100) -> None:
+        """Run every (batch size, length) combination once so lazy initialization and compilation
+        happen before real requests arrive"""
+        generator = torch.Generator().manual_seed(0)
+        with torch.no_grad():
+            for batch_size in batch_sizes:
+                for seconds in lengths_seconds:
+                    batch = torch.rand(batch_size, int(seconds * sample_rate), generator=generator) * 2 - 1
+                    self.embed_batch(batch.to(self.device))
+
+    def encode_batch(self, spec: Tensor) -> Tensor:
+        with timed("encoder"):
+            features = self.model.encoder.net[2](self.backbone_input(spec))
+        self.forwards += 1
+        return features
+
+    def backbone_input(self, spec: Tensor) -> Tensor:
+        """(batch, mels, frames) spectrogram to the (batch, 3, mels, frames) image the backbone sees"""
+        # the model's Grey2Rgb may scale by the max of the whole batch, which would make
+        # every row depend on its batchmates, so each clip is scaled by its own max here
+        return self.grey2rgb(self.model.encoder.net[0](spec))
+
     def project_features(self, features: Tensor) -> Tensor:
         if (isinstance(self.model.projection, Module)):
             with torch.no_grad():
@@ -32,7 +276,9 @@ class EmbeddingGenerator:
 
 
     def normalize_audio(self, wav: Tensor) -> Tensor:
-        wav = wav[0]  # assuming mono audio, take the first channel
+        if wav.dim() > 1:
+            # downmix instead of dropping every channel but the first
+            wav = wav.mean(dim=0) if wav.shape[0] > 1 else wav[0]
         wav = wav / torch.max(torch.abs(wav))  # normalize the audio
         wav = wav.to(self.device)  # move to the same device as the model
         return wav
@@ -0,0 +1,72 @@
+import io
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+import torch
+from torch import Tensor
+
+from backends import BatchEmbedder
+from singer_identity.model import IdentityEncoder
+
+ONNX_OPSET = 17
+
+
+def export_onnx(
+    model: IdentityEncoder,
+    output: Union[Path, BinaryIO],
+    example_seconds: float = 3.0,
+    sample_rate: int = 44100,
+    opset: int = ONNX_OPSET,
+) -> None:
+    """Write the serving forward pass (BatchEmbedder) as an ONNX graph taking
+    (batch, samples) peak-normalized audio, with both axes dynamic.
+
+    Uses the TorchScript-based exporter: torch.export cannot capture the
+    data-dependent std == 0 check in Grey2Rgb's torchvision normalize. The
+    nnAudio STFT is a conv1d and the mel filterbank a matmul, so the whole
+    front-end ends up in the graph.
+    """
+    embedder = BatchEmbedder(model).eval()
+    example = torch.randn(2, int(example_seconds * sample_rate))
+    with torch.no_grad():
+        torch.onnx.export(
+            embedder,
+            (example,),
+            str(output) if isinstance(output, Path) else output,
+            dynamo=False,
+            input_names=["wav"],
+            output_names=["embedding"],
+            dynamic_axes={"wav": {0: "batch", 1: "samples"}, "embedding": {0: "batch"}},
+            opset_version=opset,
+        )
+
+
+class OnnxEmbedder:
+    """Runs an exported graph with ONNX Runtime on the CPU, tensor in, tensor out"""
+
+    def __init__(self, model: Union[Path, bytes], threads: Optional[int] = None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx backend needs onnxruntime, install voicerec[onnx]") from e
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # share the core budget torch was given instead of claiming every core
+        options.intra_op_num_threads = threads or torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(
+            str(model) if isinstance(model, Path) else model, options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, wav: Tensor) -> Tensor:
+        (embedding,) = self.session.run(["embedding"], {"wav": wav.detach().cpu().float().contiguous().numpy()})
+        return torch.from_numpy(embedding).to(wav.device)
+
+
+def build_onnx_embedder(model: IdentityEncoder, path: Optional[Path] = None) -> OnnxEmbedder:
+    """Load the graph at path, or export model in memory when no path is given"""
+    if path is not None:
+        return OnnxEmbedder(Path(path))
+    buffer = io.BytesIO()
+    export_onnx(model, buffer)
+    return OnnxEmbedder(buffer.getvalue())
@@ -0,0 +1,119 @@
+import os
+import signal
+import socket
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import torch
+from torch import nn
+
+from cache import BloomFilter
+from users import iter_users
+
+
+def cpu_groups(workers: int, cpus: Optional[Iterable[int]] = None) -> List[List[int]]:
+    """Split the cores this process may use into one contiguous group per worker; with more
+    workers than cores, workers share single cores round robin"""
+    cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+    if workers > len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    size, extra = divmod(len(cpus), workers)
+    groups, start = [], 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+
+def share_model(model: nn.Module) -> nn.Module:
+    """Move every parameter and buffer into shared memory so forked workers map the same pages
+    instead of copying them on the first write near them"""
+    return model.share_memory()
+
+
+def fork_worker(cpus: Sequence[int], threads: int, target: Callable[[], None]) -> int:
+    """Fork a child pinned to cpus with a torch budget of threads that runs target and exits; returns its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(threads)
+        target()
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def preload(model_names: Iterable[str], database: Path) -> None:
+    """Load the served weights into shared memory and seed a shared username filter, before forking"""
+    import app
+
+    for name in model_names:
+        app.preloaded_weights[name] = share_model(app.load_weights(name).eval())
+    known = BloomFilter(app.USER_BLOOM_CAPACITY, shared=True)
+    for user in iter_users(database):
+        known.add(user.username)
+    app.shared_known_users = known
+
+
+def serve(workers: int, host: str = "127.0.0.1", port: int = 8000, threads: Optional[int] = None, log_level: str = "info") -> None:
+    """Load the model once, then fork workers that all accept on one listening socket.
+
+    Each worker is pinned to its own group of cores with as many torch threads
+    (or threads), so workers do not fight over cores. Eager and compile workers
+    serve straight from the shared weights; torchscript, onnx and fused build private
+    copies. A worker that dies is forked again. Workers share the username
+    filter, and sessions and stream tokens are kept in file stores, so any
+    worker can serve any request. Each keeps its own identification matrix
+    and voice index, and picks up the accounts the others enrolled every
+    app.USER_SYNC_SECONDS.
+    """
+    import uvicorn
+
+    import app
+
+    # no intra-op thread pool may exist at fork time, the children would inherit it half alive
+    torch.set_num_threads(1)
+    Path("database").mkdir(parents=True, exist_ok=True)
+    preload([app.ENROLLMENT_MODEL], Path("database"))
+    listener = socket.create_server((host, port), backlog=2048)
+    listener.set_inheritable(True)
+
+    def run_worker(budget: int) -> Callable[[], None]:
+        def target() -> None:
+            app.INFERENCE_THREADS = budget
+            uvicorn.Server(uvicorn.Config(app.app, fd=listener.fileno(), log_level=log_level)).run()
+        return target
+
+    groups = cpu_groups(workers)
+    children: Dict[int, int] = {}
+    for index, cpus in enumerate(groups):
+        children[fork_worker(cpus, threads or len(cpus), run_worker(threads or len(cpus)))] = index
+    print(f"Serving on http://{host}:{port} with {workers} workers, cores {groups}")
+
+    stopping = False
+
+    def stop(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} exited with status {status}, restarting it")
+            cpus = groups[index]
+            children[fork_worker(cpus, threads or len(cpus), run_worker(threads or len(cpus)))] = index
+    listener.close()
@@ -0,0 +1,58 @@
+from typing import Awaitable, Callable, List, Tuple
+
+from torch import Tensor
+
+from ml import RunningMean
+
+
+class ProgressiveVerification:
+    """Scores a login a piece of the recording at a time and stops once the decision is clear.
+
+    The first first_samples of audio are embedded and scored against the
+    user's template; if the score is at least margin above or below the
+    threshold, the rest of the recording is never embedded. Otherwise the next
+    piece, taking the audio covered to growth times as much, is embedded on its
+    own and folded into a duration-weighted mean of the piece embeddings,
+    which is scored again, up to the end of the recording (a remainder shorter
+    than min_tail_samples goes into the piece before it). Every sample is
+    embedded at most once, so no login costs more than embedding it whole.
+
+    A mean of piece embeddings does not score like one embedding of the whole
+    recording, so threshold has to be calibrated for it on its own trial set
+    (benchmarks/progressive.py prints one).
+    """
+
+    def __init__(self, threshold: float, margin: float, first_samples: int, min_tail_samples: int, growth: float = 2.0):
+        if growth <= 1:
+            raise ValueError("growth must be more than 1")
+        self.threshold = threshold
+        self.margin = margin
+        self.first_samples = first_samples
+        self.min_tail_samples = min_tail_samples
+        self.growth = growth
+
+    def boundaries(self, samples: int) -> List[int]:
+        """Where each piece of a recording of samples ends, in order; the last one is samples"""
+        ends = []
+        end = self.first_samples
+        while end + self.min_tail_samples <= samples:
+            ends.append(end)
+            end = int(end * self.growth)
+        return ends + [samples]
+
+    def decided(self, score: float) -> bool:
+        return abs(score - self.threshold) >= self.margin
+
+    async def verify(
+        self, wav: Tensor, embed: Callable[[Tensor], Awaitable[Tensor]], score: Callable[[Tensor], float]
+    ) -> Tuple[float, float]:
+        """(score, fraction of the recording embedded) with embed an async (1, samples) -> (1, dim) embedding"""
+        mean = RunningMean()
+        start = 0
+        for end in self.boundaries(wav.shape[-1]):
+            mean.add(await embed(wav[..., start:end]), end - start)
+            start = end
+            similarity = score(mean.value)
+            if self.decided(similarity):
+                break
+        return similarity, start / max(wav.shape[-1], 1)
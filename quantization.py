@@ -0,0 +1,108 @@
+import copy
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from evaluation import equal_error_rate, trial_scores
+from ml import EmbeddingGenerator
+from singer_identity.model import IdentityEncoder
+
+AUDIO_EXTENSIONS = {".wav", ".webm", ".ogg", ".opus", ".mp3", ".flac", ".m4a"}
+
+
+def load_audio_folder(folder: Path, decode: Callable[[bytes], Tensor]) -> List[Tuple[str, Tensor]]:
+    """(speaker, waveform) for every audio file under folder; the speaker is the file's parent directory"""
+    clips = []
+    for path in sorted(Path(folder).rglob("*")):
+        if path.suffix.lower() not in AUDIO_EXTENSIONS:
+            continue
+        try:
+            clips.append((path.parent.name, decode(path.read_bytes())))
+        except Exception as e:
+            print(f"Skipping {path}, could not decode it:", e)
+    return clips
+
+
+def quantize_backbone(generator: EmbeddingGenerator, wavs: Sequence[Tensor], engine: str = "x86") -> torch.jit.ScriptModule:
+    """Static int8 quantization of the EfficientNet backbone, calibrated on wavs.
+
+    Convolutions and linear layers get int8 weights (per channel) and
+    activations; the mel front-end, log scaling and channel replication stay in
+    float. The result is traced and frozen so it can be saved and loaded without
+    the FX graph.
+    """
+    torch.backends.quantized.engine = engine
+    inputs = []
+    with torch.no_grad():
+        for wav in wavs:
+            spec = generator.model.feature_extractor(generator.normalize_audio(wav).unsqueeze(0))
+            inputs.append(generator.backbone_input(spec))
+
+        backbone = copy.deepcopy(generator.model.encoder.net[2]).eval()
+        prepared = prepare_fx(backbone, get_default_qconfig_mapping(engine), (inputs[0],))
+        for backbone_input in inputs:
+            prepared(backbone_input)
+        quantized = convert_fx(prepared)
+        return torch.jit.freeze(torch.jit.trace(quantized, inputs[0]))
+
+
+def save_quantized_backbone(backbone: torch.jit.ScriptModule, path: Path, engine: str = "x86") -> None:
+    torch.jit.save(backbone, str(path), _extra_files={"quantized_engine": engine})
+
+
+def load_quantized_model(model: IdentityEncoder, path: Path) -> IdentityEncoder:
+    """Swap the backbone of a float model for a saved int8 one, in place"""
+    extra_files = {"quantized_engine": ""}
+    backbone = torch.jit.load(str(path), map_location="cpu", _extra_files=extra_files)
+    engine = extra_files["quantized_engine"]
+    if engine:
+        torch.backends.quantized.engine = engine.decode() if isinstance(engine, bytes) else engine
+    model.encoder.net[2] = backbone
+    return model
+
+
+def compare_models(
+    reference: EmbeddingGenerator,
+    candidate: EmbeddingGenerator,
+    clips: Sequence[Tuple[str, Tensor]],
+    timing_seconds: float = 5.0,
+    repeats: int = 5,
+) -> Dict[str, Optional[float]]:
+    """Embedding drift, EER on every pair of clips and latency of candidate against reference"""
+    speakers = [speaker for speaker, _ in clips]
+    embeddings = {}
+    for name, generator in (("reference", reference), ("candidate", candidate)):
+        embeddings[name] = torch.cat([generator.generate_embeddings([wav]) for _, wav in clips])
+    cosine = F.cosine_similarity(embeddings["reference"], embeddings["candidate"])
+
+    report: Dict[str, Optional[float]] = {"clips": float(len(clips)), "cosine_mean": cosine.mean().item(), "cosine_min": cosine.min().item()}
+    if len(set(speakers)) > 1:
+        for name in embeddings:
+            report[f"{name}_eer"], _ = equal_error_rate(*trial_scores(embeddings[name], speakers))
+    else:
+        report["reference_eer"] = report["candidate_eer"] = None
+
+    # whole pipeline, and the backbone alone since the mel front-end stays float
+    wav = torch.randn(1, int(timing_seconds * 44100))
+    with torch.no_grad():
+        backbone_input = reference.backbone_input(reference.model.feature_extractor(reference.normalize_audio(wav).unsqueeze(0)))
+        for name, generator in (("reference", reference), ("candidate", candidate)):
+            report[f"{name}_ms"] = _mean_ms(lambda: generator.generate_embeddings([wav]), repeats)
+            report[f"{name}_backbone_ms"] = _mean_ms(lambda: generator.model.encoder.net[2](backbone_input), repeats)
+    report["speedup"] = report["reference_ms"] / report["candidate_ms"]
+    report["backbone_speedup"] = report["reference_backbone_ms"] / report["candidate_backbone_ms"]
+    return report
+
+
+def _mean_ms(fn: Callable[[], object], repeats: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1000
@@ -0,0 +1,198 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import torchaudio.transforms as T
+from torch import nn
+
+from backends import BACKENDS
+from ml import EmbeddingGenerator
+from singer_identity.model import IdentityEncoder, load_model
+
+MODEL_SAMPLE_RATE = 44100
+# backends that keep their own copy of the weights (frozen constants, an ONNX Runtime session, folded convolutions)
+COPYING_BACKENDS = {"torchscript", "onnx", "fused"}
+
+
+class ModelKey(NamedTuple):
+    name: str
+    backend: str = "eager"
+    input_sr: int = MODEL_SAMPLE_RATE
+
+    def __str__(self) -> str:
+        return f"{self.name}/{self.backend}/{self.input_sr}"
+
+
+def model_nbytes(model: nn.Module) -> int:
+    """Bytes held by the parameters and buffers of model, shared tensors counted once"""
+    seen = set()
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if tensor.is_meta or tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def resampled_view(model: IdentityEncoder, input_sr: int) -> IdentityEncoder:
+    """model taking input_sr audio, sharing every weight with the original.
+
+    Same wrapping as load_model(input_sr=...), but on a shallow copy so the
+    44.1 kHz model stays usable as is.
+    """
+    if input_sr == MODEL_SAMPLE_RATE:
+        return model
+    view = copy.copy(model)
+    view._modules = dict(model._modules)
+    view.feature_extractor = nn.Sequential(T.Resample(input_sr, MODEL_SAMPLE_RATE), model.feature_extractor)
+    return view
+
+
+def _load_weights(name: str) -> IdentityEncoder:
+    model = load_model(name)
+    if not isinstance(model, IdentityEncoder):
+        raise ValueError(f"Model {name} is not an IdentityEncoder")
+    return model
+
+
+def _build_generator(key: ModelKey, model: IdentityEncoder) -> EmbeddingGenerator:
+    return EmbeddingGenerator(model, backend=key.backend)
+
+
+class ModelRegistry:
+    """Embedding generators keyed by (model name, backend, input rate), loaded on first use.
+
+    Generators of the same model name share one copy of the weights, loaded
+    with load_weights(name). When the estimated memory of everything loaded
+    exceeds max_bytes the least recently used generators are dropped, and with
+    the last one the weights; pinned keys are never dropped. Callers that still
+    hold an evicted generator keep using it, its memory goes with their
+    reference. Safe to call from any thread.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        load_weights: Callable[[str], IdentityEncoder] = _load_weights,
+        build_generator: Callable[[ModelKey, IdentityEncoder], EmbeddingGenerator] = _build_generator,
+        pinned: Iterable[ModelKey] = (),
+    ):
+        self.max_bytes = max_bytes
+        self.load_weights = load_weights
+        self.build_generator = build_generator
+        self.pinned = set(pinned)
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # one lock per key being loaded, so concurrent first uses load it once
+        self._loading: Dict[ModelKey, threading.Lock] = {}
+        self._generators: "OrderedDict[ModelKey, EmbeddingGenerator]" = OrderedDict()
+        self._generator_bytes: Dict[ModelKey, int] = {}
+        self._weights: Dict[str, IdentityEncoder] = {}
+        self._weight_bytes: Dict[str, int] = {}
+
+    def get(self, key: ModelKey) -> EmbeddingGenerator:
+        """The generator for key, loading it (and its weights) if needed; may block for seconds"""
+        if key.backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {key.backend}, expected one of {BACKENDS}")
+        generator = self.get_loaded(key)
+        if generator is not None:
+            return generator
+
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            try:
+                return self._load(key)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+    def _load(self, key: ModelKey) -> EmbeddingGenerator:
+        generator = self.get_loaded(key)
+        if generator is not None:
+            return generator
+        with self._lock:
+            weights = self._weights.get(key.name)
+        if weights is None:
+            loaded = self.load_weights(key.name).eval()
+            with self._lock:
+                # another backend of the same model may have won the race, build on its copy
+                weights = self._weights.setdefault(key.name, loaded)
+                self._weight_bytes.setdefault(key.name, model_nbytes(weights))
+        try:
+            generator = self.build_generator(key, resampled_view(weights, key.input_sr))
+        except Exception:
+            with self._lock:
+                self._drop_unused_weights(key.name)
+            raise
+
+        with self._lock:
+            # re-register the weights in case the last generator using them was evicted meanwhile
+            if self._weights.setdefault(key.name, weights) is weights:
+                self._weight_bytes.setdefault(key.name, model_nbytes(weights))
+            self._generators[key] = generator
+            self._generator_bytes[key] = self._weight_bytes[key.name] if key.backend in COPYING_BACKENDS else 0
+            self.loads += 1
+            self._evict(keep=key)
+        print(f"Loaded model {key}, registry holds {self.nbytes / 2**20:.0f} MB")
+        return generator
+
+    def get_loaded(self, key: ModelKey) -> Optional[EmbeddingGenerator]:
+        """The generator for key if it is loaded, marking it as recently used"""
+        with self._lock:
+            generator = self._generators.get(key)
+            if generator is not None:
+                self._generators.move_to_end(key)
+            return generator
+
+    def _evict(self, keep: ModelKey) -> None:
+        for key in list(self._generators):
+            if self._nbytes() <= self.max_bytes:
+                return
+            if key == keep or key in self.pinned:
+                continue
+            del self._generators[key]
+            del self._generator_bytes[key]
+            self._drop_unused_weights(key.name)
+            self.evictions += 1
+            print(f"Evicted model {key}")
+
+    def _drop_unused_weights(self, name: str) -> None:
+        if not any(key.name == name for key in self._generators):
+            self._weights.pop(name, None)
+            self._weight_bytes.pop(name, None)
+
+    def _nbytes(self) -> int:
+        return sum(self._weight_bytes.values()) + sum(self._generator_bytes.values())
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory of the loaded weights and backend copies"""
+        with self._lock:
+            return self._nbytes()
+
+    def keys(self) -> List[ModelKey]:
+        """Loaded keys, least recently used first"""
+        with self._lock:
+            return list(self._generators)
+
+    def __contains__(self, key: ModelKey) -> bool:
+        with self._lock:
+            return key in self._generators
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._generators)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "models": [str(key) for key in self._generators],
+                "bytes": self._nbytes(),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
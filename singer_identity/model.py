@@ -12,6 +12,9 @@ from singer_identity.models.network_components import (
     get_vision_backbone,
     LogScale,
     Grey2Rgb,
+    masked_backbone,
+    supports_masking,
+    time_mask,
 )
 
 HF_SOURCE = "BernardoTorres/singer-identity"
@@ -47,13 +50,47 @@ class FeatureExtractor(nn.Module):
     def forward(self, x):
         return self.spec_layer(x)
 
+    def forward_masked(self, x, lengths):
+        """
+        x shape [batch, samples], zero past lengths[i] samples in row i
+        Returns the spectrograms and the number of frames valid in each, which
+        match the spectrogram of each row on its own: the end of every row is
+        reflect padded like a single clip's, instead of continuing into zeros
+        """
+        stft = self.spec_layer.stft
+        if not stft.center or stft.pad_mode != "reflect":
+            raise NotImplementedError("Masked spectrograms need a centered, reflect padded STFT")
+        pad = stft.pad_amount
+        batch_size, samples = x.shape
+        padded = x.new_zeros(batch_size, samples + 2 * pad)
+        padded[:, pad : pad + samples] = x
+        padded[:, :pad] = x[:, 1 : pad + 1].flip(-1)
+        offsets = torch.arange(pad, device=x.device)
+        reflected = x.gather(1, (lengths.unsqueeze(1) - 2 - offsets).clamp(min=0))
+        padded.scatter_(1, pad + lengths.unsqueeze(1) + offsets, reflected)
+
+        # the STFT of nnAudio's MelSpectrogram, without its own padding
+        padded = padded.unsqueeze(1)
+        real = F.conv1d(padded, stft.wcos, stride=stft.stride)[:, : stft.freq_bins]
+        imag = F.conv1d(padded, stft.wsin, stride=stft.stride)[:, : stft.freq_bins]
+        spec = torch.sqrt(real.pow(2) + imag.pow(2)) ** self.spec_layer.power
+        frames = lengths // stft.stride + 1
+        return torch.matmul(self.spec_layer.mel_basis, spec), frames
+
 
 class Encoder(nn.Module):
     """Encoder, used to extract embeddings from the input acoustic features"""
 
     def __init__(
-        self, backbone="efficientnet_b0", embedding_dim=1000, pretrained=False, **kwargs
+        self,
+        backbone="efficientnet_b0",
+        embedding_dim=1000,
+        pretrained=False,
+        per_sample_norm=False,
+        **kwargs,
     ):
+        """per_sample_norm scales each spectrogram by its own max (see Grey2Rgb)
+        so embeddings do not depend on the batch; checkpoints load either way"""
         super().__init__()
 
         # With attention pooling, not used in the paper
@@ -65,7 +102,7 @@ class Encoder(nn.Module):
                 embedding_dim=embedding_dim,
                 **kwargs,
             )
-            self.net = nn.Sequential(LogScale(), Grey2Rgb(), encoder_backbone)
+            self.net = nn.Sequential(LogScale(), Grey2Rgb(per_sample_norm), encoder_backbone)
 
         # Default to efficientnet backbone with average pooling, used in the paper
         else:
@@ -77,7 +114,7 @@ class Encoder(nn.Module):
             )
 
             # Grey2Rgb() is used to replicate mel-spec channel (efficientnet expects 3)
-            self.net = nn.Sequential(LogScale(), Grey2Rgb(), encoder_backbone)
+            self.net = nn.Sequential(LogScale(), Grey2Rgb(per_sample_norm), encoder_backbone)
 
     def forward(self, x):
         """
@@ -86,6 +123,24 @@ class Encoder(nn.Module):
         embedding = self.net(x)
         return embedding
 
+    @property
+    def supports_masking(self):
+        return supports_masking(self.net[2])
+
+    def forward_masked(self, x, frames):
+        """
+        x shape [batch, channels, frames], only the first frames[i] valid in row i
+        Each row is scaled by its own maximum and pooled over its valid frames
+        only, so it matches the embedding of that row on its own
+        """
+        log_scale, grey2rgb, backbone = self.net
+        x = log_scale(x)
+        valid = time_mask(frames, x.shape[-1]).unsqueeze(1)
+        x = x / x.masked_fill(~valid, float("-inf")).amax(dim=(1, 2), keepdim=True)
+        batch_size, freq_bins, times = x.shape
+        x = grey2rgb.normalize(x.unsqueeze(1).expand(batch_size, 3, freq_bins, times))
+        return masked_backbone(backbone, x * valid.unsqueeze(1), frames)
+
 
 class Projection(nn.Module):
     """Projection head, used to reduce the dimensionality of the embedding"""
@@ -130,6 +185,13 @@ class IdentityEncoder(nn.Module):
     def forward(self, x):
         return self.encoder(self.feature_extractor(x))
 
+    def forward_masked(self, x, lengths):
+        """
+        x shape [batch, samples] of clips zero padded past lengths[i] samples
+        Returns the embedding each clip gets on its own
+        """
+        return self.encoder.forward_masked(*self.feature_extractor.forward_masked(x, lengths))
+
 
 class SiameseArm(nn.Module):
     """For BYOL"""
@@ -1,7 +1,9 @@
 import torch
 import torch.nn as nn
-from typing import Union, Callable, List, Optional
+from typing import Union, Callable, List, Optional, Tuple
 from torchvision.models import efficientnet_b0, efficientnet_b4
+from torchvision.models.efficientnet import EfficientNet, MBConv
+from torchvision.ops.misc import Conv2dNormActivation, SqueezeExcitation
 import torchvision.transforms as vt
 
 
@@ -17,20 +19,89 @@ def get_vision_backbone(
         raise NotImplementedError
 
 
+def time_mask(lengths: torch.Tensor, frames: int) -> torch.Tensor:
+    """(batch, frames) boolean mask of the first lengths[i] frames of each row"""
+    return torch.arange(frames, device=lengths.device) < lengths.unsqueeze(1)
+
+
+def conv_lengths(conv: nn.Conv2d, lengths: torch.Tensor) -> torch.Tensor:
+    """Valid output frames (last dimension) of conv for inputs of lengths valid frames"""
+    kernel, stride = conv.kernel_size[-1], conv.stride[-1]
+    padding, dilation = conv.padding[-1], conv.dilation[-1]
+    return (lengths + 2 * padding - dilation * (kernel - 1) - 1) // stride + 1
+
+
+def supports_masking(backbone: nn.Module) -> bool:
+    return isinstance(backbone, EfficientNet)
+
+
+def masked_backbone(backbone: EfficientNet, x: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    """EfficientNet forward over a batch of images whose rows only fill their first lengths frames.
+
+    x is (batch, 3, mels, frames), zero past each row's length. Activations
+    past the valid frames are zeroed again after every convolution block, so
+    every convolution sees the same zero padding at a row's end as when that
+    row runs alone, and squeeze-excitation and the final pooling average over
+    valid frames only. Each row then matches its unbatched embedding.
+    """
+    x, lengths = _masked_forward(backbone.features, x, lengths)
+    pooled = x.sum(dim=(2, 3)) / (x.shape[2] * lengths).unsqueeze(1).to(x.dtype)
+    return backbone.classifier(pooled)
+
+
+def _masked_forward(module: nn.Module, x: torch.Tensor, lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    if isinstance(module, Conv2dNormActivation):
+        lengths = conv_lengths(module[0], lengths)
+        x = module(x)
+        return x.mul_(time_mask(lengths, x.shape[-1])[:, None, None, :]), lengths
+    if isinstance(module, SqueezeExcitation):
+        # padded frames are zero, so the sum only counts valid ones
+        scale = x.sum(dim=(2, 3), keepdim=True) / (x.shape[2] * lengths).view(-1, 1, 1, 1).to(x.dtype)
+        scale = module.scale_activation(module.fc2(module.activation(module.fc1(scale))))
+        return x * scale, lengths
+    if isinstance(module, MBConv):
+        result, result_lengths = _masked_forward(module.block, x, lengths)
+        if module.use_res_connect:
+            result = module.stochastic_depth(result) + x
+        return result, result_lengths
+    if isinstance(module, nn.Sequential):
+        for child in module:
+            x, lengths = _masked_forward(child, x, lengths)
+        return x, lengths
+    raise TypeError(f"No masked forward for {type(module).__name__}")
+
+
 class Grey2Rgb(nn.Module):
-    def __init__(self):
+    """Scales a [batch, freq, time] log spectrogram to at most 1 and replicates it
+    into the 3 ImageNet-normalized channels the vision backbone expects.
+
+    By default the whole batch is divided by its maximum, in place, as the
+    published checkpoints were trained, so a clip's output depends on its
+    batchmates. per_sample divides every spectrogram by its own maximum into a
+    new tensor instead: outputs do not depend on the batch, and a batch of one
+    gives exactly the default output. There are no weights either way, so
+    existing checkpoints load in both modes.
+    """
+
+    def __init__(self, per_sample=False):
         super().__init__()
+        self.per_sample = per_sample
         self.normalize = vt.Normalize(
             mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
         )
 
     def forward(self, data):
-        batch_size, freq_bins, times = data.shape
-        data /= data.max()
-        data = data.unsqueeze(1).expand(batch_size, 3, freq_bins, times)
+        if self.per_sample:
+            data = data / data.amax(dim=(1, 2), keepdim=True)
+        else:
+            data /= data.max()
+        data = data.unsqueeze(1).expand(-1, 3, -1, -1)
         data = self.normalize(data)
         return data
 
+    def extra_repr(self):
+        return f"per_sample={self.per_sample}"
+
 
 class LogScale(nn.Module):
     def forward(self, data):
@@ -0,0 +1,85 @@
+import asyncio
+from typing import List, Optional
+
+import torch
+from torch import Tensor
+
+from batching import BatchingEngine
+from ml import RunningMean
+from registry import ModelKey
+from vad import NotEnoughSpeech, VoiceActivityDetector
+
+
+class StreamingEmbedding:
+    """Embeds audio in fixed windows while it is still arriving.
+
+    Every full window_samples of audio is sent to the batching engine as soon as
+    it is available, and the normalized window embeddings are folded into a
+    running mean (the 1/n average). On finish, a leftover tail of at least
+    min_tail_samples is embedded as one more window.
+
+    With a voice_activity detector, non-speech is cut out of every window
+    before it is embedded (a window left with less than min_tail_samples is
+    not embedded), and finish raises NotEnoughSpeech when the windows held
+    less speech in total than the detector requires of a whole recording.
+    """
+
+    def __init__(
+        self,
+        engine: BatchingEngine,
+        window_samples: int,
+        min_tail_samples: int,
+        model: Optional[ModelKey] = None,
+        voice_activity: Optional[VoiceActivityDetector] = None,
+    ):
+        self.engine = engine
+        self.model = model
+        self.window_samples = window_samples
+        self.min_tail_samples = min_tail_samples
+        self.voice_activity = voice_activity
+        self.voiced_seconds = 0.0
+
+        self.pending: List[Tensor] = []
+        self.pending_samples = 0
+        self.mean = RunningMean()
+        self._tasks: List[asyncio.Task] = []
+
+    async def _embed_window(self, window: Tensor) -> None:
+        if self.voice_activity is not None:
+            mask = self.voice_activity.voiced(window)
+            self.voiced_seconds += self.voice_activity.voiced_seconds(mask)
+            if not bool(mask.all()):
+                window = self.voice_activity.frames(window)[mask].reshape(1, -1)
+            if window.shape[-1] < self.min_tail_samples:
+                return
+        self.mean.add(await self.engine.embed(window, self.model))
+
+    def _take(self, samples: int) -> Tensor:
+        wav = torch.cat(self.pending, dim=-1)
+        window, rest = wav[:, :samples], wav[:, samples:]
+        self.pending = [rest] if rest.shape[-1] else []
+        self.pending_samples = rest.shape[-1]
+        return window
+
+    def add(self, wav: Tensor) -> None:
+        """Buffer newly decoded (1, samples) audio, starting a window embedding for every full window"""
+        if wav.shape[-1] == 0:
+            return
+        self.pending.append(wav)
+        self.pending_samples += wav.shape[-1]
+        while self.pending_samples >= self.window_samples:
+            self._tasks.append(asyncio.create_task(self._embed_window(self._take(self.window_samples))))
+
+    async def finish(self) -> Optional[Tensor]:
+        """Wait for outstanding windows and return the mean embedding, or None if there was too little audio"""
+        if self.pending_samples >= self.min_tail_samples:
+            self._tasks.append(asyncio.create_task(self._embed_window(self._take(self.pending_samples))))
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        if self.voice_activity is not None and self.voiced_seconds < self.voice_activity.min_voiced_seconds:
+            raise NotEnoughSpeech(self.voiced_seconds, self.voice_activity.min_voiced_seconds)
+        return self.mean.value
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,19 @@
+import pytest
+import torch
+
+from benchmarks.common import build_model, synthetic_speech
+from singer_identity.model import IdentityEncoder
+
+
+@pytest.fixture(scope="session")
+def random_model() -> IdentityEncoder:
+    """The published architecture with untrained, BatchNorm-calibrated weights, so tests run offline"""
+    torch.set_grad_enabled(False)
+    return build_model("random")
+
+
+@pytest.fixture(scope="session")
+def clips() -> torch.Tensor:
+    """(3, samples) peak-normalized synthetic speech, 2 s each"""
+    wav = torch.cat([synthetic_speech(2.0, seed=seed) for seed in range(3)])
+    return wav / wav.abs().amax(dim=1, keepdim=True)
@@ -0,0 +1,82 @@
+from typing import List
+
+import numpy as np
+
+from ann import IVFPQIndex
+
+
+class SearchingList(list):
+    """A usernames list that runs a search right before every append, like another thread could"""
+
+    def __init__(self, items: List[str], index: IVFPQIndex, query: np.ndarray):
+        super().__init__(items)
+        self.index = index
+        self.query = query
+        self.results: List[List[str]] = []
+
+    def append(self, username: str) -> None:
+        self.results.append([found for found, _ in self.index.search(self.query, k=50)])
+        super().append(username)
+
+
+def vectors(count: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_search_during_add_only_sees_registered_usernames() -> None:
+    for trained in (False, True):
+        initial = vectors(300)
+        index = IVFPQIndex(16, nprobe=64)
+        if trained:
+            index.train(initial, m=4)
+        index.add([f"user{i}" for i in range(300)], initial)
+
+        added = vectors(40, seed=1)
+        index.usernames = SearchingList(index.usernames, index, added[0])
+        index.add([f"new{i}" for i in range(40)], added)
+        assert len(index) == 340
+        for i, results in enumerate(index.usernames.results):
+            assert set(results) <= {f"user{j}" for j in range(300)} | {f"new{j}" for j in range(i)}
+        assert "new0" in [found for found, _ in index.search(added[0], k=5)]
+
+
+def test_build_and_save_round_trip(tmp_path) -> None:
+    data = vectors(500)
+    index = IVFPQIndex.build([f"user{i}" for i in range(500)], data, nprobe=64, m=4)
+    index.save(tmp_path / "index.npz")
+    loaded = IVFPQIndex.load(tmp_path / "index.npz")
+    assert loaded.search(data[7], k=3) == index.search(data[7], k=3)
+    assert index.search(data[7], k=1)[0][0] == "user7"
+
+
+class SavingList(list):
+    """A usernames list that saves the index right after every append, like the retraining task could"""
+
+    def __init__(self, items: List[str], index: IVFPQIndex, path):
+        super().__init__(items)
+        self.index = index
+        self.path = path
+        self.saved: List[IVFPQIndex] = []
+
+    def append(self, username: str) -> None:
+        super().append(username)
+        self.index.save(self.path)
+        self.saved.append(IVFPQIndex.load(self.path))
+
+
+def test_save_during_add_only_keeps_searchable_usernames(tmp_path) -> None:
+    for trained in (False, True):
+        initial = vectors(300)
+        index = IVFPQIndex(16, nprobe=64)
+        if trained:
+            index.train(initial, m=4)
+        index.add([f"user{i}" for i in range(300)], initial)
+
+        added = vectors(5, seed=1)
+        index.usernames = SavingList(index.usernames, index, tmp_path / "index.npz")
+        index.add([f"new{i}" for i in range(5)], added)
+        for loaded in index.usernames.saved:
+            assert len(loaded) >= 300
+            # every username the file holds is in the index, so load_voice_index will not skip it
+            stored = np.concatenate(loaded._list_ids) if trained else np.arange(len(loaded._flat))
+            assert sorted(stored.tolist()) == list(range(len(loaded)))
@@ -0,0 +1,20 @@
+import pytest
+import torch.nn.functional as F
+
+from ml import EmbeddingGenerator
+
+# 1 - cosine allowed against eager; the backends reorder float sums but compute the same thing
+TOLERANCE = 1e-4
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "compile"])
+def test_backend_matches_eager(random_model, clips, backend: str) -> None:
+    expected = EmbeddingGenerator(random_model).embed_batch(clips)
+    embeddings = EmbeddingGenerator(random_model, backend=backend).embed_batch(clips)
+    assert embeddings.shape == expected.shape
+    assert (1 - F.cosine_similarity(embeddings, expected)).max().item() <= TOLERANCE
+
+
+def test_unknown_backend(random_model) -> None:
+    with pytest.raises(ValueError):
+        EmbeddingGenerator(random_model, backend="tensorrt")
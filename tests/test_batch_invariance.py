@@ -0,0 +1,79 @@
+from typing import Callable, Dict, Tuple
+
+import pytest
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from benchmarks.common import BYOL_HPARAMS, synthetic_speech
+from ml import EmbeddingGenerator
+from singer_identity.model import IdentityEncoder
+
+BATCH_SIZES = (1, 7, 64)
+# 1 - cosine allowed against batch size 1: the backbone input is bit for bit the same, but the
+# convolution kernels sum in a different order per batch size
+TOLERANCE = 1e-3
+
+Path = Tuple[Callable[[Tensor], Tensor], Callable[[Tensor], Tensor]]
+
+
+def in_batches(fn: Callable[[Tensor], Tensor], clips: Tensor, batch_size: int) -> Tensor:
+    return torch.cat([fn(clips[start : start + batch_size]) for start in range(0, len(clips), batch_size)])
+
+
+def backbone_input(model: IdentityEncoder) -> Callable[[Tensor], Tensor]:
+    log_scale, grey2rgb, _ = model.encoder.net
+    return lambda batch: grey2rgb(log_scale(model.feature_extractor(batch)))
+
+
+@pytest.fixture(scope="module")
+def many_clips() -> Tensor:
+    """(64, samples) peak-normalized synthetic speech, like EmbeddingGenerator.normalize_audio leaves it"""
+    wav = torch.cat([synthetic_speech(1.0, seed=seed) for seed in range(BATCH_SIZES[-1])])
+    return wav / wav.abs().amax(dim=1, keepdim=True)
+
+
+@pytest.fixture(scope="module")
+def per_sample(random_model) -> IdentityEncoder:
+    """The random model's weights in a per_sample_norm model"""
+    model = IdentityEncoder(BYOL_HPARAMS["feature_extractor"], {**BYOL_HPARAMS["encoder"], "per_sample_norm": True})
+    model.load_state_dict(random_model.state_dict())
+    return model.eval()
+
+
+@pytest.fixture(scope="module")
+def paths(random_model, per_sample) -> Dict[str, Path]:
+    """(what the backbone sees, the embedding) of each batch-invariant path"""
+    generator = EmbeddingGenerator(random_model)
+    return {
+        "per_sample": (backbone_input(per_sample), per_sample),
+        "generator": (
+            lambda batch: generator.backbone_input(random_model.feature_extractor(batch)),
+            lambda batch: generator.generate_embeddings(list(batch.unsqueeze(1))),
+        ),
+    }
+
+
+@pytest.fixture(scope="module")
+def single(paths, many_clips) -> Dict[str, Tuple[Tensor, Tensor]]:
+    return {name: (in_batches(inputs, many_clips, 1), in_batches(embed, many_clips, 1)) for name, (inputs, embed) in paths.items()}
+
+
+@pytest.mark.parametrize("batch_size", BATCH_SIZES[1:])
+@pytest.mark.parametrize("name", ["per_sample", "generator"])
+def test_rows_match_single_clips(paths, single, many_clips, name: str, batch_size: int) -> None:
+    inputs, embed = paths[name]
+    single_inputs, single_embeddings = single[name]
+    assert torch.equal(in_batches(inputs, many_clips, batch_size), single_inputs)
+    embeddings = in_batches(embed, many_clips, batch_size)
+    assert (1 - F.cosine_similarity(embeddings, single_embeddings)).max().item() <= TOLERANCE
+
+
+@pytest.mark.parametrize("name", ["per_sample", "generator"])
+def test_deterministic(paths, many_clips, name: str) -> None:
+    _, embed = paths[name]
+    assert torch.equal(embed(many_clips), embed(many_clips))
+
+
+def test_per_sample_keeps_batch_size_1_outputs(random_model, single, many_clips) -> None:
+    assert torch.equal(in_batches(random_model, many_clips, 1), single["per_sample"][1])
@@ -0,0 +1,18 @@
+import asyncio
+
+import torch
+from litestar.stores.memory import MemoryStore
+
+from cache import UserCache
+from users import User
+
+
+def test_exists_sees_users_written_around_the_bloom_filter() -> None:
+    store = MemoryStore()
+    cache = UserCache(store)
+    user = User("alice", b"hash", torch.ones(1, 4))
+    # another worker wrote alice, so this cache's filter never heard of her
+    asyncio.run(store.set("alice", user.to_bytes("float16")))
+
+    assert asyncio.run(cache.exists("alice"))
+    assert not asyncio.run(cache.exists("bob"))
@@ -0,0 +1,33 @@
+import copy
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from backends import BatchEmbedder
+from fusion import fuse_for_inference, state_nbytes
+
+# 1 - cosine allowed against eager; folding reorders float sums only
+TOLERANCE = 1e-5
+
+
+def test_fused_matches_eager(random_model, clips) -> None:
+    expected = BatchEmbedder(random_model).eval()(clips)
+    fused = fuse_for_inference(random_model)
+    assert (1 - F.cosine_similarity(fused(clips), expected)).max().item() <= TOLERANCE
+    # a second input size gets its own cached bias map
+    short = clips[:1, :44100]
+    expected = BatchEmbedder(random_model).eval()(short)
+    assert (1 - F.cosine_similarity(fused(short), expected)).max().item() <= TOLERANCE
+
+
+def test_fusing_leaves_the_model_untouched(random_model, clips) -> None:
+    before = {name: tensor.clone() for name, tensor in random_model.state_dict().items()}
+    fused = fuse_for_inference(random_model)
+    assert all(torch.equal(before[name], tensor) for name, tensor in random_model.state_dict().items())
+    assert state_nbytes(fused) < state_nbytes(BatchEmbedder(random_model))
+
+
+def test_training_models_are_not_fused(random_model) -> None:
+    with pytest.raises(ValueError):
+        fuse_for_inference(copy.deepcopy(random_model).train())
@@ -0,0 +1,38 @@
+from typing import List
+
+import torch
+import torch.nn.functional as F
+
+from identify import EmbeddingMatrix
+
+
+class SearchingList(list):
+    """A usernames list that searches for each new user right after it is registered, like another thread could"""
+
+    def __init__(self, matrix: EmbeddingMatrix, queries: torch.Tensor):
+        super().__init__()
+        self.matrix = matrix
+        self.queries = queries
+        self.scores: List[float] = []
+
+    def append(self, username: str) -> None:
+        super().append(username)
+        found = dict(self.matrix.search(self.queries[len(self) - 1], k=len(self)))
+        self.scores.append(found[username])
+
+
+def test_search_never_sees_a_user_before_its_row() -> None:
+    embeddings = F.normalize(torch.randn(40, 16, generator=torch.Generator().manual_seed(0)), dim=-1)
+    matrix = EmbeddingMatrix(dtype=torch.float32, initial_capacity=8)
+    matrix.usernames = SearchingList(matrix, embeddings)
+    matrix.add_many([f"user{i}" for i in range(20)], embeddings[:20])
+    for i in range(20, 40):
+        matrix.add(f"user{i}", embeddings[i])
+    assert min(matrix.usernames.scores) > 0.999
+
+
+def test_replacing_a_user_keeps_its_row() -> None:
+    matrix = EmbeddingMatrix(dtype=torch.float32)
+    matrix.add_many(["alice", "bob", "alice"], torch.eye(3))
+    assert matrix.usernames == ["alice", "bob"]
+    assert matrix.similarity("alice", torch.tensor([0.0, 0.0, 1.0])) > 0.999
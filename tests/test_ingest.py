@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from ingest import AudioIngest, StreamingDecoder
+
+TEST_WAV = Path(__file__).parent.parent / "test.wav"
+
+
+@pytest.fixture(scope="module")
+def recording() -> bytes:
+    audio_bytes = TEST_WAV.read_bytes()
+    try:
+        AudioIngest(sample_rate=44100)(audio_bytes)
+    except RuntimeError as e:
+        pytest.skip(f"torchcodec cannot decode here: {e}")
+    return audio_bytes
+
+
+def test_streaming_decoder_matches_whole_recording(recording: bytes) -> None:
+    decoder = StreamingDecoder(sample_rate=44100, max_seconds=None)
+    chunk = len(recording) // 7 + 1
+    pieces = [decoder.feed(recording[start : start + chunk]) for start in range(0, len(recording), chunk)]
+    streamed = torch.cat(pieces + [decoder.finish()], dim=-1)
+    whole = AudioIngest(sample_rate=44100, max_seconds=None)(recording)
+    assert abs(streamed.shape[-1] - whole.shape[-1]) <= 0.01 * whole.shape[-1]
+
+
+def test_streaming_decoder_caps_samples(recording: bytes) -> None:
+    decoder = StreamingDecoder(sample_rate=44100, max_seconds=1.0)
+    assert decoder.feed(recording).shape[-1] == 44100
+    assert decoder.done
+    assert decoder.feed(b"more").shape[-1] == 0
+
+
+def test_streaming_decoder_raises_on_corrupt_stream() -> None:
+    decoder = StreamingDecoder(sample_rate=44100, max_failures=2)
+    # the first failures could be a chunk cut part way through a cluster
+    for _ in range(2):
+        assert decoder.feed(b"\x00garbage" * 64).shape[-1] == 0
+    with pytest.raises(Exception):
+        decoder.feed(b"\x00garbage" * 64)
+
+
+def test_streaming_decoder_finish_raises_on_corrupt_tail() -> None:
+    decoder = StreamingDecoder(sample_rate=44100)
+    decoder.feed(b"\x00garbage" * 64)
+    with pytest.raises(Exception):
+        decoder.finish()
+
+
+def test_streaming_decoder_finish_without_audio() -> None:
+    assert StreamingDecoder().finish().shape == (1, 0)
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Tuple
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from batching import BatchingEngine
+from benchmarks.common import synthetic_speech
+from ml import EmbeddingGenerator
+
+# 1 - cosine allowed against embedding each clip alone; padding without a mask is off by far more
+TOLERANCE = 1e-4
+LENGTHS = (1.0, 1.7, 2.9, 4.0)
+
+
+@pytest.fixture(scope="module")
+def generator(random_model) -> EmbeddingGenerator:
+    generator = EmbeddingGenerator(random_model)
+    assert generator.supports_masking
+    return generator
+
+
+@pytest.fixture(scope="module")
+def wavs():
+    return [synthetic_speech(seconds, seed=i) for i, seconds in enumerate(LENGTHS)]
+
+
+@pytest.fixture(scope="module")
+def single(generator, wavs) -> torch.Tensor:
+    return torch.cat([generator.generate_embeddings([wav]) for wav in wavs])
+
+
+def drift(embeddings: torch.Tensor, reference: torch.Tensor) -> float:
+    return (1 - F.cosine_similarity(embeddings, reference)).max().item()
+
+
+def test_masked_batch_matches_single_clips(generator, wavs, single) -> None:
+    assert drift(generator.generate_embeddings(wavs), single) <= TOLERANCE
+
+
+def test_bucketed_matches_single_clips(generator, wavs, single) -> None:
+    embeddings = generator.generate_embeddings_bucketed(wavs, bucket_seconds=2.0, max_batch_size=2)
+    assert drift(embeddings, single) <= TOLERANCE
+
+
+def test_unmasked_padding_would_not(generator, wavs, single) -> None:
+    # guards the test itself: without the mask the short clips drift well past the tolerance
+    batch = torch.zeros(len(wavs), max(wav.shape[-1] for wav in wavs))
+    for i, wav in enumerate(wavs):
+        batch[i, : wav.shape[-1]] = generator.normalize_audio(wav)
+    assert drift(generator.embed_batch(batch), single) > TOLERANCE
+
+
+@pytest.fixture(scope="module")
+def unmaskable(random_model) -> EmbeddingGenerator:
+    generator = EmbeddingGenerator(random_model, backend="torchscript")
+    assert not generator.supports_masking
+    return generator
+
+
+def test_backends_without_masking_match_single_clips(unmaskable, wavs) -> None:
+    single = torch.cat([unmaskable.generate_embeddings([wav]) for wav in wavs])
+    assert drift(unmaskable.generate_embeddings(wavs), single) <= TOLERANCE
+
+
+def test_engine_batches_backends_without_masking_by_exact_length(unmaskable, wavs) -> None:
+    # two clips in every half second bucket, only the equal ones may share a forward pass
+    clips = [wav[:, :cut] for wav in wavs for cut in (wav.shape[-1], wav.shape[-1] - 4410)]
+
+    async def run() -> Tuple[int, torch.Tensor]:
+        engine = BatchingEngine(unmaskable, max_batch_size=len(clips) + 2, max_wait_ms=1000.0)
+        engine.start()
+        try:
+            embeddings = await engine.embed_many(clips + clips[:2])
+        finally:
+            await engine.stop()
+        return engine.total_batches, embeddings
+
+    single = torch.cat([unmaskable.generate_embeddings([clip]) for clip in clips])
+    batches, embeddings = asyncio.run(run())
+    assert batches == len(clips)
+    assert drift(embeddings[: len(clips)], single) <= TOLERANCE
+    assert drift(embeddings[len(clips) :], single[:2]) <= TOLERANCE
@@ -0,0 +1,27 @@
+import pytest
+import torch.nn.functional as F
+
+from ml import EmbeddingGenerator
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+# 1 - cosine allowed against eager
+TOLERANCE = 1e-4
+
+
+def test_onnx_matches_eager(random_model, clips) -> None:
+    expected = EmbeddingGenerator(random_model).embed_batch(clips)
+    embeddings = EmbeddingGenerator(random_model, backend="onnx").embed_batch(clips)
+    assert (1 - F.cosine_similarity(embeddings, expected)).max().item() <= TOLERANCE
+
+
+def test_exported_file_has_dynamic_batch_and_length(random_model, clips, tmp_path) -> None:
+    from onnx_export import export_onnx
+
+    path = tmp_path / "encoder.onnx"
+    export_onnx(random_model, path, example_seconds=1.0)
+    generator = EmbeddingGenerator(random_model, backend="onnx", onnx_path=path)
+    expected = EmbeddingGenerator(random_model).embed_batch(clips[:1, : 44100 * 3 // 2])
+    embeddings = generator.embed_batch(clips[:1, : 44100 * 3 // 2])
+    assert (1 - F.cosine_similarity(embeddings, expected)).max().item() <= TOLERANCE
@@ -0,0 +1,15 @@
+import bcrypt
+
+from app import MAX_PASSWORD_BYTES, check_password, password_error
+
+
+def test_long_passwords_are_refused_at_signup() -> None:
+    assert password_error("a" * MAX_PASSWORD_BYTES) is None
+    assert password_error("é" * (MAX_PASSWORD_BYTES // 2 + 1)).status_code == 400
+
+
+def test_login_checks_the_bytes_bcrypt_hashed() -> None:
+    # what older bcrypt releases stored for a longer password: its first 72 bytes
+    hashed = bcrypt.hashpw(b"a" * MAX_PASSWORD_BYTES, bcrypt.gensalt(4))
+    assert check_password("a" * (MAX_PASSWORD_BYTES + 10), hashed)
+    assert not check_password("b" * (MAX_PASSWORD_BYTES + 10), hashed)
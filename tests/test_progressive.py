@@ -0,0 +1,52 @@
+import asyncio
+from typing import Callable, List
+
+import torch
+
+from progressive import ProgressiveVerification
+
+SECOND = 100
+
+
+def verification(margin: float) -> ProgressiveVerification:
+    return ProgressiveVerification(0.8, margin, first_samples=3 * SECOND, min_tail_samples=SECOND)
+
+
+def run(verification: ProgressiveVerification, seconds: float, scores: Callable[[int], float]):
+    """verify on a recording whose piece embeddings score scores(samples embedded so far)"""
+    embedded: List[int] = []
+
+    async def embed(piece: torch.Tensor) -> torch.Tensor:
+        embedded.append(piece.shape[-1])
+        return torch.ones(1, 4)
+
+    score, fraction = asyncio.run(
+        verification.verify(torch.zeros(1, int(seconds * SECOND)), embed, lambda _: scores(sum(embedded)))
+    )
+    return score, fraction, embedded
+
+
+def test_pieces_cover_the_recording_once() -> None:
+    assert verification(0.0).boundaries(15 * SECOND) == [300, 600, 1200, 1500]
+    # a remainder shorter than min_tail_samples joins the piece before it
+    assert verification(0.0).boundaries(int(3.5 * SECOND)) == [350]
+    assert verification(0.0).boundaries(2 * SECOND) == [200]
+
+
+def test_clear_scores_stop_after_the_first_piece() -> None:
+    for clear in (0.95, 0.5):
+        score, fraction, embedded = run(verification(0.1), 15, lambda _: clear)
+        assert (score, embedded) == (clear, [300])
+        assert fraction == 0.2
+
+
+def test_borderline_scores_embed_every_sample_once() -> None:
+    score, fraction, embedded = run(verification(0.1), 15, lambda _: 0.85)
+    assert sum(embedded) == 15 * SECOND
+    assert fraction == 1.0
+
+
+def test_stops_once_the_running_score_is_clear() -> None:
+    score, fraction, embedded = run(verification(0.1), 15, lambda samples: 0.85 if samples < 600 else 0.95)
+    assert embedded == [300, 300]
+    assert fraction == 0.4
@@ -0,0 +1,44 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from benchmarks.common import synthetic_speech
+from ml import EmbeddingGenerator
+
+# 1 - cosine allowed against embedding each window's slice on its own
+TOLERANCE = 1e-3
+WINDOW_SECONDS = 3.0
+# does not divide the recording into whole hops, so the last window is the flush-end one
+HOP_SECONDS = 1.3
+
+
+@pytest.fixture(scope="module")
+def generator(random_model) -> EmbeddingGenerator:
+    return EmbeddingGenerator(random_model)
+
+
+@pytest.fixture(scope="module")
+def recording() -> torch.Tensor:
+    """Three speakers one after another at different levels"""
+    return torch.cat([synthetic_speech(3.5, seed=seed) * level for seed, level in enumerate((0.3, 1.0, 0.6))], dim=-1)
+
+
+def test_windows_match_their_slices(generator: EmbeddingGenerator, recording: torch.Tensor) -> None:
+    embeddings, starts = generator.embed_windows(recording, WINDOW_SECONDS, HOP_SECONDS, batch_size=4)
+    hop = generator.model.feature_extractor.spec_layer.stride
+    window_samples = int(WINDOW_SECONDS * 44100) // hop * hop
+    offsets = (starts * 44100).round().long().tolist()
+    # flush with the end up to the partial spectrogram frame it cannot hold
+    assert 0 <= recording.shape[-1] - (offsets[-1] + window_samples) < hop
+    assert offsets[-1] - offsets[-2] < round(HOP_SECONDS * 44100)
+
+    reference = generator.generate_embeddings([recording[:, start : start + window_samples] for start in offsets])
+    assert embeddings.shape == reference.shape
+    assert (1 - F.cosine_similarity(embeddings, reference)).max().item() <= TOLERANCE
+
+
+def test_recording_shorter_than_a_window_is_one_row(generator: EmbeddingGenerator, recording: torch.Tensor) -> None:
+    short = recording[:, : 2 * 44100]
+    embeddings, starts = generator.embed_windows(short, WINDOW_SECONDS, HOP_SECONDS)
+    assert starts.tolist() == [0.0]
+    assert (1 - F.cosine_similarity(embeddings, generator.generate_embeddings([short]))).max().item() <= TOLERANCE
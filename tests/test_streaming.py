@@ -0,0 +1,51 @@
+import asyncio
+from typing import List
+
+import pytest
+import torch
+from torch import Tensor
+
+from batching import BatchingEngine
+from benchmarks.common import synthetic_speech
+from ml import EmbeddingGenerator
+from streaming import StreamingEmbedding
+from vad import NotEnoughSpeech, VoiceActivityDetector
+
+WINDOW = 2 * 44100
+
+
+def quiet(seconds: float) -> Tensor:
+    return 1e-3 * torch.randn(1, int(seconds * 44100), generator=torch.Generator().manual_seed(0))
+
+
+def stream(generator: EmbeddingGenerator, chunks: List[Tensor]) -> StreamingEmbedding:
+    async def run() -> StreamingEmbedding:
+        engine = BatchingEngine(generator)
+        engine.start()
+        embedding = StreamingEmbedding(engine, WINDOW, 44100, voice_activity=VoiceActivityDetector())
+        for chunk in chunks:
+            embedding.add(chunk)
+        try:
+            await embedding.finish()
+        finally:
+            await engine.stop()
+        return embedding
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(scope="module")
+def generator(random_model) -> EmbeddingGenerator:
+    return EmbeddingGenerator(random_model)
+
+
+def test_silent_windows_are_not_embedded(generator: EmbeddingGenerator) -> None:
+    speech = synthetic_speech(4.0) / synthetic_speech(4.0).abs().max()
+    embedding = stream(generator, [speech[:, :WINDOW], quiet(2.0), speech[:, WINDOW:]])
+    assert embedding.mean.count == 2
+    assert embedding.voiced_seconds >= 3.0
+
+
+def test_rejects_a_stream_without_speech(generator: EmbeddingGenerator) -> None:
+    with pytest.raises(NotEnoughSpeech):
+        stream(generator, [quiet(6.0)])
@@ -0,0 +1,19 @@
+import asyncio
+import os
+import time
+
+import torch
+from litestar.stores.file import FileStore
+
+from users import User, iter_users
+
+
+def test_iter_users_skips_records_written_before_modified_after(tmp_path) -> None:
+    store = FileStore(tmp_path)
+    for username in ("old", "new"):
+        asyncio.run(store.set(username, User(username, b"hash", torch.ones(1, 4)).to_bytes("float16")))
+    hour_ago = time.time() - 3600
+    os.utime(tmp_path / "old", (hour_ago, hour_ago))
+
+    assert sorted(user.username for user in iter_users(tmp_path)) == ["new", "old"]
+    assert [user.username for user in iter_users(tmp_path, modified_after=hour_ago + 60)] == ["new"]
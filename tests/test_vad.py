@@ -0,0 +1,47 @@
+import asyncio
+import pickle
+
+import pytest
+import torch
+
+from benchmarks.common import synthetic_speech
+from executor import ExecutionLayer
+from vad import NotEnoughSpeech, VoiceActivityDetector
+
+
+def quiet(seconds: float, level: float = 1e-3) -> torch.Tensor:
+    return level * torch.randn(1, int(seconds * 44100), generator=torch.Generator().manual_seed(0))
+
+
+def test_not_enough_speech_round_trips_through_pickle() -> None:
+    error = pickle.loads(pickle.dumps(NotEnoughSpeech(0.4, 1.0)))
+    assert isinstance(error, NotEnoughSpeech)
+    assert (error.voiced_seconds, error.min_voiced_seconds) == (0.4, 1.0)
+    assert str(error) == "Only 0.4s of speech, need 1.0s"
+
+
+def test_trims_padding_around_speech() -> None:
+    speech = synthetic_speech(3.0)
+    trimmed = VoiceActivityDetector()(torch.cat([quiet(2.0), speech, quiet(2.0)], dim=-1))
+    assert 2.5 * 44100 <= trimmed.shape[-1] <= 4.0 * 44100
+
+
+def test_rejects_silence() -> None:
+    with pytest.raises(NotEnoughSpeech):
+        VoiceActivityDetector()(quiet(5.0))
+
+
+def test_rejection_in_process_pool_keeps_the_pool_usable() -> None:
+    async def run() -> None:
+        execution = ExecutionLayer("process", workers=1)
+        execution.start()
+        try:
+            with pytest.raises(NotEnoughSpeech):
+                await execution.run("decode", VoiceActivityDetector(), quiet(5.0))
+            # a broken pool would fail every later decode and bcrypt call
+            voiced = await execution.run("decode", VoiceActivityDetector(), synthetic_speech(3.0))
+            assert voiced.shape[-1] > 0
+        finally:
+            execution.shutdown()
+
+    asyncio.run(run())
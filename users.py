@@ -0,0 +1,171 @@
+import base64
+import json
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from litestar.stores.base import StorageObject
+from litestar.stores.file import FileStore
+from torch import Tensor
+
+# Binary user record, all little-endian:
+#   header: magic, version, dtype code, rows, dim, hash length, username length,
+#   model name length (version 2 on)
+#   rows * dim embedding values (L2-normalized at write time), row 0 is the
+#   enrollment centroid and any further rows are the individual samples
+#   bcrypt hash bytes
+#   utf-8 username
+#   utf-8 name of the model that produced the embedding (version 2 on)
+RECORD_MAGIC = b"VREC"
+RECORD_VERSION = 2
+RECORD_HEADERS = {1: struct.Struct("<4sBBHHHH"), 2: struct.Struct("<4sBBHHHHH")}
+RECORD_HEADER = RECORD_HEADERS[RECORD_VERSION]
+RECORD_DTYPES = {1: np.dtype("<f2"), 2: np.dtype("<f4")}
+RECORD_DTYPE_CODES = {"float16": 1, "float32": 2}
+# every record written before records named their model came from this checkpoint
+LEGACY_MODEL = "byol"
+
+
+@dataclass
+class User:
+    username: str
+    password: bytes # should be hashed
+    embedding: Tensor
+    model: str = LEGACY_MODEL
+
+    def to_dict(self) -> Dict[str, Any]:
+        embedding_np = self.embedding.cpu().numpy()
+        return {
+            'username': self.username,
+            'password': base64.b64encode(self.password).decode('utf-8'),
+            'embedding': base64.b64encode(embedding_np.tobytes()).decode('utf-8'),
+            'embedding_shape': list(self.embedding.shape),
+            'embedding_dtype': str(embedding_np.dtype),
+            'model': self.model,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'User':
+        password_bytes = base64.b64decode(data['password'])
+
+        embedding_bytes = base64.b64decode(data['embedding'])
+        embedding_shape = data['embedding_shape']
+        embedding_dtype = data['embedding_dtype']
+
+        embedding_np = np.frombuffer(embedding_bytes, dtype=np.dtype(embedding_dtype)).reshape(embedding_shape)
+        embedding_tensor = torch.from_numpy(embedding_np.copy())
+
+        return cls(
+            username=data['username'],
+            password=password_bytes,
+            embedding=embedding_tensor,
+            model=data.get('model', LEGACY_MODEL),
+        )
+
+    def to_bytes(self, dtype: str = "float16") -> bytes:
+        code = RECORD_DTYPE_CODES[dtype]
+        embedding = F.normalize(self.embedding.detach().cpu().float().reshape(-1, self.embedding.shape[-1]), dim=-1)
+        vector = embedding.numpy().astype(RECORD_DTYPES[code]).tobytes()
+        username = self.username.encode('utf-8')
+        model = self.model.encode('utf-8')
+        rows, dim = embedding.shape
+        header = RECORD_HEADER.pack(
+            RECORD_MAGIC, RECORD_VERSION, code, rows, dim, len(self.password), len(username), len(model)
+        )
+        return b"".join((header, vector, self.password, username, model))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'User':
+        magic, version = struct.unpack_from("<4sB", data)
+        if magic != RECORD_MAGIC or version not in RECORD_HEADERS:
+            raise ValueError("Not a user record")
+        header = RECORD_HEADERS[version]
+        magic, version, code, rows, dim, hash_len, name_len, *model_len = header.unpack_from(data)
+
+        offset = header.size
+        embedding_np = np.frombuffer(data, dtype=RECORD_DTYPES[code], count=rows * dim, offset=offset)
+        offset += embedding_np.nbytes
+        password = data[offset : offset + hash_len]
+        offset += hash_len
+        username = data[offset : offset + name_len].decode('utf-8')
+        offset += name_len
+        model = data[offset : offset + model_len[0]].decode('utf-8') if model_len else LEGACY_MODEL
+
+        return cls(
+            username=username,
+            password=password,
+            embedding=torch.from_numpy(embedding_np.astype(np.float32).reshape(rows, dim)),
+            model=model,
+        )
+
+    @classmethod
+    def from_record(cls, data: bytes) -> 'User':
+        """Load either a binary record or a legacy base64-in-JSON one"""
+        if data[: len(RECORD_MAGIC)] == RECORD_MAGIC:
+            return cls.from_bytes(data)
+        user = cls.from_dict(json.loads(data.decode('utf-8')))
+        user.embedding = F.normalize(user.embedding.float(), dim=-1)
+        return user
+
+    def score(self, embedding: Tensor) -> float:
+        """Best cosine similarity against the stored (already normalized) template rows"""
+        probe = F.normalize(embedding.reshape(-1).float(), dim=0)
+        return float(torch.mv(self.embedding, probe).max())
+
+
+def build_template(embeddings: Tensor, keep_samples: bool = True) -> Tensor:
+    """Stack the normalized centroid of (samples, dim) enrollment embeddings on top of the samples
+    themselves into one contiguous (rows, dim) template"""
+    embeddings = F.normalize(embeddings.float(), dim=-1)
+    centroid = F.normalize(embeddings.mean(dim=0, keepdim=True), dim=-1)
+    if not keep_samples or embeddings.shape[0] == 1:
+        return centroid
+    return torch.cat([centroid, embeddings]).contiguous()
+
+
+def iter_store_entries(path: Path, modified_after: Optional[float] = None) -> Iterator[Tuple[Path, bytes]]:
+    """Yield (file, value) for every live entry of a FileStore directory, or only those written after modified_after"""
+    for file in sorted(Path(path).iterdir()):
+        if not file.is_file() or ".tmp" in file.name:
+            continue
+        if modified_after is not None and file.stat().st_mtime <= modified_after:
+            continue
+        try:
+            storage_obj = StorageObject.from_bytes(file.read_bytes())
+        except Exception as e:
+            print(f"Skipping {file.name}, not a store entry:", e)
+            continue
+        if not storage_obj.expired:
+            yield file, storage_obj.data
+
+
+def iter_users(path: Path, modified_after: Optional[float] = None) -> Iterator[User]:
+    """Yield every readable user record of a FileStore directory, or only those written after modified_after"""
+    for file, data in iter_store_entries(path, modified_after):
+        try:
+            yield User.from_record(data)
+        except Exception as e:
+            print(f"Skipping {file.name}, not a user record:", e)
+
+
+async def migrate_store(path: Path, dtype: str = "float16", dry_run: bool = False) -> Tuple[int, int]:
+    """Rewrite every legacy JSON record in a FileStore directory as a binary record.
+
+    Returns the number of migrated and skipped entries.
+    """
+    store = FileStore(path)
+    migrated = skipped = 0
+    for _, data in iter_store_entries(path):
+        if data[: len(RECORD_MAGIC)] == RECORD_MAGIC:
+            skipped += 1
+            continue
+
+        user = User.from_record(data)
+        if not dry_run:
+            await store.set(user.username, user.to_bytes(dtype))
+        migrated += 1
+    return migrated, skipped
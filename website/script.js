@@ -7,6 +7,9 @@ class VoiceRecorder {
     this.recordingStartTime = null;
     this.maxRecordingTime = 15000; // 15 seconds in milliseconds
     this.recordingTimer = null;
+    this.streamSocket = null;
+    this.recordings = [];
+    this.maxEnrollmentSamples = 5; // matches MAX_ENROLLMENT_SAMPLES on the server
 
     this.initializeElements();
     this.setupEventListeners();
@@ -15,6 +18,7 @@ class VoiceRecorder {
   initializeElements() {
     this.startButton = document.getElementById("startButton");
     this.loginButton = document.getElementById("loginButton");
+    this.streamLoginButton = document.getElementById("streamLoginButton");
     this.createAccountButton = document.getElementById("createAccountButton");
     this.usernameInput = document.getElementById("usernameText");
     this.passwordInput = document.getElementById("passwordText");
@@ -24,6 +28,9 @@ class VoiceRecorder {
   setupEventListeners() {
     this.startButton.addEventListener("click", () => this.startRecording());
     this.loginButton.addEventListener("click", () => this.handleLogin());
+    this.streamLoginButton.addEventListener("click", () =>
+      this.handleStreamingLogin(),
+    );
     this.createAccountButton.addEventListener("click", () =>
       this.createAccount(),
     );
@@ -63,10 +70,17 @@ class VoiceRecorder {
       this.mediaRecorder.ondataavailable = (event) => {
         if (event.data.size > 0) {
           this.audioChunks.push(event.data);
+          // streaming login sends every chunk as soon as the recorder hands it over
+          if (this.streamSocket) {
+            this.streamSocket.send(event.data);
+          }
         }
       };
 
       this.mediaRecorder.onstop = () => {
+        if (this.streamSocket) {
+          this.streamSocket.send(JSON.stringify({ end: true }));
+        }
         this.processRecording();
       };
 
@@ -94,6 +108,11 @@ class VoiceRecorder {
     } catch (error) {
       console.error("Error starting recording:", error);
       alert("Could not access microphone: " + error.message);
+      if (this.streamSocket) {
+        this.streamSocket.close();
+        this.streamSocket = null;
+        this.resetStreamingUI();
+      }
       this.resetUI();
     }
   }
@@ -139,11 +158,13 @@ class VoiceRecorder {
       console.log(
         `Recorded audio blob: ${audioBlob.size} bytes, type: ${audioBlob.type}`,
       );
-      this.textBlurb.textContent = `Recorded ${audioBlob.size} bytes`;
-
-      const base64Audio = await this.blobToBase64(audioBlob);
-
-      this.lastRecording = base64Audio;
+      // the blob is uploaded as-is, no base64 round trip
+      this.lastRecording = audioBlob;
+      // account creation enrolls with every recent recording
+      this.recordings = [...this.recordings, audioBlob].slice(
+        -this.maxEnrollmentSamples,
+      );
+      this.textBlurb.textContent = `Recorded ${audioBlob.size} bytes (${this.recordings.length} sample${this.recordings.length === 1 ? "" : "s"} for enrollment)`;
       this.resetUI();
     } catch (error) {
       console.error("Error processing recording:", error);
@@ -152,19 +173,30 @@ class VoiceRecorder {
     }
   }
 
-  async blobToBase64(blob) {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onload = () => {
-        // Remove the data URL prefix (e.g., "data:audio/webm;base64,")
-        const base64 = reader.result.split(",")[1];
-        resolve(base64);
-      };
-      reader.onerror = reject;
-      reader.readAsDataURL(blob);
+  uploadRecording(path, username, password) {
+    // credentials travel in headers so the body can be the raw recording
+    return fetch(path, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/octet-stream",
+        "X-Username": encodeURIComponent(username),
+        "X-Password": encodeURIComponent(password),
+      },
+      body: this.lastRecording,
     });
   }
 
+  uploadEnrollment(path, username, password) {
+    // several recordings go as repeated multipart "audio" parts
+    const form = new FormData();
+    form.append("username", username);
+    form.append("password", password);
+    this.recordings.forEach((recording, index) =>
+      form.append("audio", recording, `sample-${index}.webm`),
+    );
+    return fetch(path, { method: "POST", body: form });
+  }
+
   async handleLogin() {
     const username = this.usernameInput.value.trim();
     const password = this.passwordInput.value.trim();
@@ -183,17 +215,11 @@ class VoiceRecorder {
       this.loginButton.disabled = true;
       this.loginButton.textContent = "Logging in...";
 
-      const response = await fetch("/account/login", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          username: username,
-          password: password,
-          audio_data: this.lastRecording,
-        }),
-      });
+      const response = await this.uploadRecording(
+        "/account/login/upload",
+        username,
+        password,
+      );
 
       if (response.ok) {
         // the server should always return json with similarity
@@ -215,6 +241,78 @@ class VoiceRecorder {
     }
   }
 
+  async handleStreamingLogin() {
+    const username = this.usernameInput.value.trim();
+    const password = this.passwordInput.value.trim();
+
+    if (!username || !password) {
+      alert("Please enter both username and password");
+      return;
+    }
+
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    const socket = new WebSocket(
+      `${protocol}//${window.location.host}/account/login/stream`,
+    );
+
+    this.streamLoginButton.disabled = true;
+    this.streamLoginButton.textContent = "Speak now...";
+
+    socket.onopen = () => {
+      socket.send(JSON.stringify({ username: username, password: password }));
+    };
+
+    socket.onmessage = async (event) => {
+      const message = JSON.parse(event.data);
+
+      if (message.status === "ready") {
+        this.streamSocket = socket;
+        await this.startRecording();
+        return;
+      }
+
+      this.streamSocket = null;
+      socket.close();
+      this.resetStreamingUI();
+
+      if (message.error) {
+        if (this.isRecording) {
+          this.stopRecording();
+        }
+        alert("Login failed: " + message.error);
+        return;
+      }
+
+      // the websocket cannot set the session cookie, so trade the token for one
+      const response = await fetch("/account/login/stream/session", {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ token: message.token }),
+      });
+
+      if (response.ok) {
+        let similarity = Math.round(message.similarity * 100);
+        alert(`Login successful! Similarity: ${similarity}%`);
+        window.location.assign("/account.html");
+      } else {
+        alert("Login failed: " + (await response.text()));
+      }
+    };
+
+    socket.onerror = () => {
+      alert("Streaming login error");
+      this.streamSocket = null;
+      this.resetStreamingUI();
+    };
+  }
+
+  resetStreamingUI() {
+    this.streamLoginButton.disabled = false;
+    this.streamLoginButton.textContent = "Login While Speaking";
+  }
+
   async createAccount() {
     const username = this.usernameInput.value.trim();
     const password = this.passwordInput.value.trim();
@@ -230,17 +328,11 @@ class VoiceRecorder {
     }
 
     try {
-      const response = await fetch("/account/create", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          username: username,
-          password: password,
-          audio_data: this.lastRecording,
-        }),
-      });
+      const response = await this.uploadEnrollment(
+        "/account/create/upload",
+        username,
+        password,
+      );
 
       const responseText = await response.text();
 